@@ -1,12 +1,17 @@
 # app/routers/auth.py
-from fastapi import APIRouter, HTTPException, Request, Header, Depends
+from fastapi import APIRouter, HTTPException, Request, Header, Depends, Response
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, EmailStr
 from jose import jwt, JWTError
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from pathlib import Path
 import os, sqlite3
 
+from app.services.metrics import register_collector, stats_collector
+from app.services.password_hasher import HASHER, HasherBusy, server_timing
+from app.services.sqlite_pool import PoolTimeout, SQLitePool
+from app.services.token_cache import TokenCache, now_ms
+
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 JWT_SECRET = os.getenv("JWT_SECRET", "change-me-now")
@@ -14,18 +19,12 @@ JWT_ALG = "HS256"
 JWT_EXPIRE_MIN = int(os.getenv("JWT_EXPIRE_MIN", "10080"))  # 7 días
 
 DATA_DIR = Path(os.getenv("DATA_DIR", "storage"))
-DATA_DIR.mkdir(parents=True, exist_ok=True)
 DB_PATH = DATA_DIR / "auth.db"
-
-pwd = CryptContext(schemes=["bcrypt"], deprecated="auto")
+AUTH_DB_POOL = int(os.getenv("AUTH_DB_POOL", "4"))
 
 # -----------------------------
 # DB helpers
 # -----------------------------
-def db():
-    con = sqlite3.connect(DB_PATH)
-    con.row_factory = sqlite3.Row
-    return con
 
 def col_exists(con: sqlite3.Connection, table: str, col: str) -> bool:
     cur = con.cursor()
@@ -33,8 +32,7 @@ def col_exists(con: sqlite3.Connection, table: str, col: str) -> bool:
     cols = [r[1] for r in cur.fetchall()]
     return col in cols
 
-def init_db():
-    con = db()
+def init_db(con: sqlite3.Connection):
     cur = con.cursor()
     cur.execute("""
       CREATE TABLE IF NOT EXISTS users(
@@ -51,9 +49,32 @@ def init_db():
         cur.execute("ALTER TABLE users ADD COLUMN role TEXT NOT NULL DEFAULT 'user'")
         con.commit()
 
-    con.close()
+    # revocaciones por subject (ms): tokens emitidos en o antes de revoked_at ya no valen
+    cur.execute("""
+      CREATE TABLE IF NOT EXISTS token_revocations(
+        email TEXT PRIMARY KEY,
+        revoked_at INTEGER NOT NULL
+      )
+    """)
+    con.commit()
 
-init_db()
+# pool WAL: el esquema se crea con la primera conexión (no al importar)
+AUTH_DB = SQLitePool(DB_PATH, size=AUTH_DB_POOL, init=init_db)
+register_collector(stats_collector("auth_db", AUTH_DB.stats, counters=("waits", "timeouts")))
+
+async def _db_call(fn, *args):
+    # SQLite en el threadpool (nunca en el event loop); sin conexión libre → 503
+    try:
+        return await run_in_threadpool(fn, *args)
+    except PoolTimeout:
+        raise HTTPException(503, "Auth DB ocupada, reintenta.")
+
+async def _bcrypt(op: str, *args):
+    # executor propio de bcrypt (ver services/password_hasher); cola llena → 503
+    try:
+        return await getattr(HASHER, op)(*args)
+    except HasherBusy:
+        raise HTTPException(503, "Demasiados logins simultáneos, reintenta.")
 
 # -----------------------------
 # Models
@@ -70,6 +91,9 @@ class TokenOut(BaseModel):
     access_token: str
     token_type: str = "bearer"
 
+class RevokeIn(BaseModel):
+    email: EmailStr
+
 class AdminCreateUserIn(BaseModel):
     email: EmailStr
     password: str
@@ -84,6 +108,8 @@ def make_token(email: str, role: str = "user") -> str:
         "sub": email,
         "role": role,
         "iat": int(now.timestamp()),
+        # emisión en ms para las revocaciones (iat en segundos no separa tokens del mismo segundo)
+        "iat_ms": now_ms(),
         "exp": int((now + timedelta(minutes=JWT_EXPIRE_MIN)).timestamp()),
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALG)
@@ -95,17 +121,38 @@ def parse_bearer(authorization: str | None) -> str:
         raise HTTPException(401, "Missing bearer token")
     return parts[1]
 
-def get_current_user(authorization: str | None = Header(default=None)) -> dict:
-    token = parse_bearer(authorization)
+def _issued_ms(payload: dict):
+    # tokens anteriores a iat_ms: el inicio de su segundo (un revoke en ese segundo los alcanza)
+    if payload.get("iat_ms") is not None:
+        return int(payload["iat_ms"])
+    if payload.get("iat") is not None:
+        return int(payload["iat"]) * 1000
+    return None
+
+def verify_token(token: str) -> dict:
+    """Firma + claims (python-jose); sin caché. Lo guarda en TOKENS si es válido."""
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
-        email = payload.get("sub")
-        role = payload.get("role") or "user"
-        if not email:
-            raise HTTPException(401, "Invalid token")
-        return {"email": email, "role": role}
     except JWTError:
         raise HTTPException(401, "Invalid token")
+    email = payload.get("sub")
+    role = payload.get("role") or "user"
+    if not email:
+        raise HTTPException(401, "Invalid token")
+    issued = _issued_ms(payload)
+    if TOKENS.is_revoked(email, issued):
+        raise HTTPException(401, "Token revocado")
+    user = {"email": email, "role": role}
+    TOKENS.put(token, user, exp=payload.get("exp"), issued_ms=issued)
+    return user
+
+def get_current_user(authorization: str | None = Header(default=None)) -> dict:
+    token = parse_bearer(authorization)
+    # token ya verificado (polling de /orders/mine, etc.): sin firma ni parseo
+    user = TOKENS.get(token)
+    if user is None:
+        user = verify_token(token)
+    return dict(user)
 
 def require_admin(u: dict = Depends(get_current_user)) -> dict:
     if (u.get("role") or "user") != "admin":
@@ -113,48 +160,89 @@ def require_admin(u: dict = Depends(get_current_user)) -> dict:
     return u
 
 def get_user_row(email: str):
-    con = db()
-    cur = con.cursor()
-    cur.execute("SELECT * FROM users WHERE email = ?", (email.lower().strip(),))
-    row = cur.fetchone()
-    con.close()
-    return row
+    with AUTH_DB.connection() as con:
+        cur = con.cursor()
+        cur.execute("SELECT * FROM users WHERE email = ?", (email.lower().strip(),))
+        return cur.fetchone()
+
+def insert_user(email: str, password_hash: str, role: str) -> bool:
+    """False si el email ya existe."""
+    with AUTH_DB.connection() as con:
+        try:
+            con.execute(
+                "INSERT INTO users(email, password_hash, created_at, role) VALUES(?,?,?,?)",
+                (email, password_hash, datetime.utcnow().isoformat(), role),
+            )
+            con.commit()
+        except sqlite3.IntegrityError:
+            con.rollback()
+            return False
+    return True
+
+def promote_admin(email: str) -> bool:
+    """Eleva a admin si el usuario existe."""
+    with AUTH_DB.connection() as con:
+        cur = con.execute("UPDATE users SET role='admin' WHERE email=?", (email,))
+        con.commit()
+        return cur.rowcount > 0
+
+def load_revocations(since: int) -> list:
+    with AUTH_DB.connection() as con:
+        cur = con.execute("SELECT email, revoked_at FROM token_revocations WHERE revoked_at >= ?", (since,))
+        return [(r["email"], r["revoked_at"]) for r in cur.fetchall()]
+
+def revoke_subject(email: str) -> int:
+    """Invalida los tokens ya emitidos para `email` (persistido: vale para todos los workers)."""
+    at = now_ms()
+    with AUTH_DB.connection() as con:
+        con.execute(
+            "INSERT INTO token_revocations(email, revoked_at) VALUES(?, ?) "
+            "ON CONFLICT(email) DO UPDATE SET revoked_at = MAX(revoked_at, excluded.revoked_at)",
+            (email, at),
+        )
+        con.commit()
+    TOKENS.revoke(email, at)
+    return at
+
+# tokens verificados (ver services/token_cache); revocaciones desde auth.db
+TOKENS = TokenCache()
+TOKENS.set_loader(load_revocations)
+register_collector(stats_collector("token_cache", TOKENS.stats, counters=("hits", "misses", "evictions")))
+
+def list_users() -> list:
+    with AUTH_DB.connection() as con:
+        cur = con.execute("SELECT id, email, role, created_at FROM users ORDER BY id DESC")
+        return [dict(r) for r in cur.fetchall()]
 
 # -----------------------------
 # Endpoints
 # -----------------------------
+# los que hashean exponen la espera en cola y el tiempo de bcrypt en Server-Timing
 @router.post("/register", response_model=TokenOut)
-def register(data: RegisterIn):
+async def register(data: RegisterIn, response: Response):
     email = data.email.lower().strip()
     if len(data.password) < 6:
         raise HTTPException(400, "Password muy corta (mínimo 6).")
 
-    con = db()
-    cur = con.cursor()
-    ph = pwd.hash(data.password)
+    ph, timings = await _bcrypt("hash", data.password)
+    response.headers["Server-Timing"] = server_timing(timings)
 
-    try:
-        cur.execute(
-            "INSERT INTO users(email, password_hash, created_at, role) VALUES(?,?,?,?)",
-            (email, ph, datetime.utcnow().isoformat(), "user"),
-        )
-        con.commit()
-    except sqlite3.IntegrityError:
-        con.close()
+    if not await _db_call(insert_user, email, ph, "user"):
         raise HTTPException(409, "Este email ya está registrado.")
-    con.close()
 
     token = make_token(email, "user")
     return {"access_token": token, "token_type": "bearer"}
 
 @router.post("/login", response_model=TokenOut)
-def login(data: LoginIn):
+async def login(data: LoginIn, response: Response):
     email = data.email.lower().strip()
-    row = get_user_row(email)
+    row = await _db_call(get_user_row, email)
     if not row:
         raise HTTPException(401, "Credenciales inválidas.")
-    if not pwd.verify(data.password, row["password_hash"]):
-        raise HTTPException(401, "Credenciales inválidas.")
+    ok, timings = await _bcrypt("verify", data.password, row["password_hash"])
+    response.headers["Server-Timing"] = server_timing(timings)
+    if not ok:
+        raise HTTPException(401, "Credenciales inválidas.", headers={"Server-Timing": server_timing(timings)})
 
     role = row["role"] if "role" in row.keys() else "user"
     token = make_token(row["email"], role)
@@ -166,45 +254,39 @@ def me(u: dict = Depends(get_current_user)):
 
 # ---- bootstrap admin (1 vez, por ENV) ----
 @router.post("/bootstrap_admin")
-def bootstrap_admin():
+async def bootstrap_admin():
     admin_email = (os.getenv("ADMIN_EMAIL") or "").lower().strip()
     admin_pass = os.getenv("ADMIN_PASSWORD") or ""
     if not admin_email or len(admin_pass) < 6:
         raise HTTPException(400, "Setea ADMIN_EMAIL y ADMIN_PASSWORD (>=6) en ENV.")
 
-    con = db()
-    cur = con.cursor()
-    cur.execute("SELECT * FROM users WHERE email=?", (admin_email,))
-    row = cur.fetchone()
-
-    if row:
-        # si existe, lo elevamos a admin
-        cur.execute("UPDATE users SET role='admin' WHERE email=?", (admin_email,))
-        con.commit()
-        con.close()
+    # si existe, lo elevamos a admin (sus tokens viejos dicen role=user: se revocan)
+    if await _db_call(promote_admin, admin_email):
+        await _db_call(revoke_subject, admin_email)
         return {"ok": True, "message": "Admin ya existía; rol actualizado a admin."}
 
-    ph = pwd.hash(admin_pass)
-    cur.execute(
-        "INSERT INTO users(email, password_hash, created_at, role) VALUES(?,?,?,?)",
-        (admin_email, ph, datetime.utcnow().isoformat(), "admin"),
-    )
-    con.commit()
-    con.close()
+    ph, _ = await _bcrypt("hash", admin_pass)
+    if not await _db_call(insert_user, admin_email, ph, "admin"):
+        # otro request lo creó mientras hasheábamos
+        await _db_call(promote_admin, admin_email)
+        await _db_call(revoke_subject, admin_email)
+        return {"ok": True, "message": "Admin ya existía; rol actualizado a admin."}
     return {"ok": True, "message": "Admin creado."}
 
 # ---- admin utilities (opcionales pero útiles) ----
 @router.get("/admin/users")
-def admin_list_users(_: dict = Depends(require_admin)):
-    con = db()
-    cur = con.cursor()
-    cur.execute("SELECT id, email, role, created_at FROM users ORDER BY id DESC")
-    rows = [dict(r) for r in cur.fetchall()]
-    con.close()
-    return {"users": rows}
+async def admin_list_users(_: dict = Depends(require_admin)):
+    return {"users": await _db_call(list_users)}
+
+@router.post("/admin/revoke")
+async def admin_revoke_tokens(data: RevokeIn, _: dict = Depends(require_admin)):
+    # logout global de un usuario: todos sus tokens emitidos hasta ahora dejan de valer
+    email = data.email.lower().strip()
+    at = await _db_call(revoke_subject, email)
+    return {"ok": True, "email": email, "revoked_at_ms": at}
 
 @router.post("/admin/users", response_model=TokenOut)
-def admin_create_user(data: AdminCreateUserIn, _: dict = Depends(require_admin)):
+async def admin_create_user(data: AdminCreateUserIn, response: Response, _: dict = Depends(require_admin)):
     email = data.email.lower().strip()
     if len(data.password) < 6:
         raise HTTPException(400, "Password muy corta (mínimo 6).")
@@ -212,19 +294,10 @@ def admin_create_user(data: AdminCreateUserIn, _: dict = Depends(require_admin))
     if role not in ("user", "admin"):
         raise HTTPException(400, "role debe ser 'user' o 'admin'.")
 
-    con = db()
-    cur = con.cursor()
-    ph = pwd.hash(data.password)
-    try:
-        cur.execute(
-            "INSERT INTO users(email, password_hash, created_at, role) VALUES(?,?,?,?)",
-            (email, ph, datetime.utcnow().isoformat(), role),
-        )
-        con.commit()
-    except sqlite3.IntegrityError:
-        con.close()
+    ph, timings = await _bcrypt("hash", data.password)
+    response.headers["Server-Timing"] = server_timing(timings)
+    if not await _db_call(insert_user, email, ph, role):
         raise HTTPException(409, "Este email ya está registrado.")
-    con.close()
 
     # devuelve token por si quieres loguear directo a ese user
     token = make_token(email, role)
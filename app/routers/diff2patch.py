@@ -1,14 +1,67 @@
-from fastapi import APIRouter, UploadFile, File, Form
+from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException
 from pathlib import Path
-import zlib
+import asyncio
+import os
+import shutil
 import yaml
 
-from app.services.patch_engine import create_patch, sha256
+from app.routers.auth import require_admin
+from app.services.digest import StreamDigest
+from app.services.diff_jobs import DIFF_JOBS, QueueFull, load_diff_job, new_staging_dir
+from app.services.patch_engine import install_patch
 
 router = APIRouter(prefix="/admin", tags=["diff2patch"])
 
-def crc32_hex(data: bytes) -> str:
-    return f"{zlib.crc32(data) & 0xFFFFFFFF:08X}"
+# espera inline antes de responder "queued" (diffs chicos siguen saliendo en la misma llamada)
+DIFF_INLINE_WAIT_S = float(os.getenv("DIFF_INLINE_WAIT_S", "5"))
+
+async def _stage_upload(upload: UploadFile, dest: Path) -> StreamDigest:
+    dig = StreamDigest()
+    with open(dest, "wb") as f:
+        while chunk := await upload.read(1024 * 1024):
+            f.write(chunk)
+            dig.update(chunk)
+    return dig
+
+def _job_response(job: dict) -> dict:
+    if job["state"] == "done":
+        return job["result"]
+    if job["state"] == "failed":
+        raise HTTPException(status_code=500, detail=f"diff failed: {job['error']}")
+    return {
+        "status": job["state"],
+        "job_id": job["id"],
+        "poll_url": f"/admin/diff2patch/jobs/{job['id']}",
+    }
+
+def _finalize(job: dict, patch_path: Path) -> dict:
+    meta = dict(job["meta"])
+    ecu_type, patch_id = meta["ecu_type"], meta["patch_id"]
+
+    base_dir = Path("app/data/patches") / ecu_type / patch_id
+    meta_core = install_patch(patch_path, meta["base"]["sha256"], meta["base"]["size_bytes"], base_dir)
+
+    meta["patch"] = {
+        "format": meta_core["format"],
+        "patch_size_bytes": meta_core["patch_size"],
+    }
+    meta["offsets"] = meta.pop("offsets")  # mismo orden de claves que antes en meta.yaml
+
+    (base_dir / "meta.yaml").write_text(yaml.safe_dump(meta, sort_keys=False, allow_unicode=True))
+
+    # Esto es “copy friendly” para ti:
+    copy_block = (
+        f"ECU={ecu_type}\n"
+        f"PATCH={patch_id}\n"
+        f"BASE_SHA256={meta['base']['sha256']}\n"
+        f"BASE_SIZE={meta['base']['size_bytes']}\n"
+        f"BASE_CVN={meta['base']['cvn_crc32']}\n"
+        f"MOD_SHA256={meta['mod']['sha256']}\n"
+        f"MOD_SIZE={meta['mod']['size_bytes']}\n"
+        f"MOD_CVN={meta['mod']['cvn_crc32']}\n"
+    )
+
+    return {"status": "ok", "meta": meta, "copy": copy_block, "job_id": job["id"], "cached": job["cached"]}
 
 @router.post("/diff2patch")
 async def diff2patch(
@@ -24,36 +77,38 @@ async def diff2patch(
     ecu_offset: str = Form(None),
 
     stock: UploadFile = File(...),
-    mod: UploadFile = File(...)
+    mod: UploadFile = File(...),
+    _: dict = Depends(require_admin),
 ):
-    stock_bytes = await stock.read()
-    mod_bytes   = await mod.read()
-
-    base_dir = Path("app/data/patches") / ecu_type / patch_id
-    meta_core = create_patch(stock_bytes, mod_bytes, base_dir)
+    # a disco en streaming: el diff corre en otro proceso y lee de ahí
+    staging = new_staging_dir()
+    stock_path, mod_path = staging / "stock.bin", staging / "mod.bin"
+    try:
+        stock_dig = await _stage_upload(stock, stock_path)
+        mod_dig = await _stage_upload(mod, mod_path)
+    except BaseException:
+        # upload cortado a mitad: el staging no llega a ningún job
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
 
     meta = {
         "ecu_type": ecu_type,
         "patch_id": patch_id,
 
         "base": {
-            "sha256": sha256(stock_bytes),
-            "size_bytes": len(stock_bytes),
-            "cvn_crc32": crc32_hex(stock_bytes),
+            "sha256": stock_dig.sha256,
+            "size_bytes": stock_dig.size,
+            "cvn_crc32": stock_dig.cvn_crc32,
             "original_filename": stock.filename,
         },
 
         "mod": {
-            "sha256": sha256(mod_bytes),
-            "size_bytes": len(mod_bytes),
-            "cvn_crc32": crc32_hex(mod_bytes),
+            "sha256": mod_dig.sha256,
+            "size_bytes": mod_dig.size,
+            "cvn_crc32": mod_dig.cvn_crc32,
             "original_filename": mod.filename,
         },
 
-        "patch": {
-            "patch_size_bytes": meta_core["patch_size"],
-        },
-
         # máscara offsets (tu formato)
         "offsets": {
             "sw_number": sw_number,
@@ -65,18 +120,25 @@ async def diff2patch(
         }
     }
 
-    (base_dir / "meta.yaml").write_text(yaml.safe_dump(meta, sort_keys=False, allow_unicode=True))
+    try:
+        job, done = DIFF_JOBS.submit(meta, stock_path, mod_path, _finalize)
+    except QueueFull:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise HTTPException(status_code=503, detail="diff queue full, retry later")
 
-    # Esto es “copy friendly” para ti:
-    copy_block = (
-        f"ECU={ecu_type}\n"
-        f"PATCH={patch_id}\n"
-        f"BASE_SHA256={meta['base']['sha256']}\n"
-        f"BASE_SIZE={meta['base']['size_bytes']}\n"
-        f"BASE_CVN={meta['base']['cvn_crc32']}\n"
-        f"MOD_SHA256={meta['mod']['sha256']}\n"
-        f"MOD_SIZE={meta['mod']['size_bytes']}\n"
-        f"MOD_CVN={meta['mod']['cvn_crc32']}\n"
-    )
+    try:
+        job = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(done)), DIFF_INLINE_WAIT_S)
+    except asyncio.TimeoutError:
+        pass  # sigue en la cola: el cliente hace poll
+    return _job_response(job)
+
+@router.get("/diff2patch/jobs/{job_id}")
+def diff2patch_job(job_id: str, _: dict = Depends(require_admin)):
+    job = load_diff_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="job not found")
+    return _job_response(job)
 
-    return {"status": "ok", "meta": meta, "copy": copy_block}
+@router.get("/diff2patch/stats")
+def diff2patch_stats(_: dict = Depends(require_admin)):
+    return DIFF_JOBS.stats()
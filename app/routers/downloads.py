@@ -1,30 +1,157 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from pathlib import Path
+from typing import Optional, Tuple
 
+from app.services.jobs import download_ready, load_job
+from app.services.mod_variants import ENCODINGS, load_manifest, publish, variant_path
 from app.services.storage import load_order
 
 router = APIRouter(prefix="/download", tags=["download"])
 
+CHUNK = 256 * 1024
+
+def _mod_path(o: dict) -> Optional[str]:
+    # create_order guarda el path en "paths"; órdenes viejas lo tenían en la raíz
+    return (o.get("paths") or {}).get("mod_file_path") or o.get("mod_file_path")
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag == etag or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+def _choose_encoding(accept: Optional[str], manifest: dict) -> Optional[str]:
+    """Mejor variante precomprimida aceptada por el cliente (q>0), o None = identity."""
+    if not accept:
+        return None
+    accepted = set()
+    for part in accept.split(","):
+        token, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if q > 0:
+            accepted.add(token.strip().lower())
+    for encoding, _ in ENCODINGS:
+        if encoding in accepted and encoding in (manifest.get("variants") or {}):
+            return encoding
+    return None
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Un solo rango "bytes=a-b" | "bytes=a-" | "bytes=-n" → (start, end) inclusivo.
+    None = ignorar (sintaxis rara o multi-rango → respuesta completa).
+    Lanza ValueError si el rango no es satisfacible (416).
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = (x.strip() for x in spec.strip().partition("-"))
+    if not sep or not (first or last) or not (first.isdigit() or not first) or not (last.isdigit() or not last):
+        return None
+    if not first:
+        n = int(last)
+        if n == 0:
+            raise ValueError("empty suffix range")
+        start, end = max(0, size - n), size - 1
+    else:
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        end = int(last) if last else size - 1
+    if start >= size:
+        raise ValueError("range not satisfiable")
+    return start, min(end, size - 1)
+
+def _iter_file(path: Path, start: int, length: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
 @router.get("/{order_id}")
-def download_by_order(order_id: str):
+def download_by_order(order_id: str, request: Request):
     o = load_order(order_id)
     if not o:
         raise HTTPException(status_code=404, detail="order_id not found")
 
-    if not o.get("download_ready"):
+    if not download_ready(o):
+        job = load_job(order_id)
+        if o.get("paid") and job and job.get("state") in ("queued", "running"):
+            raise HTTPException(status_code=409, detail="mod is still being generated")
         raise HTTPException(status_code=403, detail="download not ready")
 
-    path = o.get("mod_file_path")
+    path = _mod_path(o)
     if not path or not Path(path).exists():
+        job = load_job(order_id)
+        if job and job.get("state") in ("queued", "running"):
+            raise HTTPException(status_code=409, detail="mod is still being generated")
         raise HTTPException(status_code=404, detail="mod file not found")
 
+    # órdenes previas a las variantes: se generan una vez y quedan en disco
+    manifest = load_manifest(Path(path)) or publish(Path(path))
+
     family = o.get("family") or "ECU"
     patch_id = o.get("patch_option_id") or "patch"
     filename = f"EFX_{family}_{patch_id}.mod.bin"
 
+    # representación: identity o variante precomprimida (ETag fuerte distinto por variante)
+    encoding = _choose_encoding(request.headers.get("accept-encoding"), manifest)
+    file_path = variant_path(Path(path), encoding, manifest) if encoding else None
+    if file_path is None:
+        encoding, file_path = None, Path(path)
+    etag = f'"{manifest["sha256"]}"' if not encoding else f'"{manifest["sha256"]}-{encoding}"'
+
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Vary": "Accept-Encoding",
+        "Cache-Control": "private, max-age=0, must-revalidate",
+    }
+    if encoding:
+        headers["Content-Encoding"] = encoding
+
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        size = file_path.stat().st_size
+        try:
+            rng = _parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        if rng is not None:
+            start, end = rng
+            length = end - start + 1
+            headers.update({
+                "Content-Range": f"bytes {start}-{end}/{size}",
+                "Content-Length": str(length),
+                "Content-Disposition": f'attachment; filename="{filename}"',
+            })
+            return StreamingResponse(
+                _iter_file(file_path, start, length),
+                status_code=206,
+                media_type="application/octet-stream",
+                headers=headers,
+            )
+
     return FileResponse(
-        path,
+        file_path,
         filename=filename,
-        media_type="application/octet-stream"
+        media_type="application/octet-stream",
+        headers=headers,
     )
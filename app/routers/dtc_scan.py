@@ -0,0 +1,51 @@
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
+from fastapi.concurrency import run_in_threadpool
+import os
+import tempfile
+
+from app.routers.auth import require_admin
+from app.services.analysis_store import ANALYSIS_STORE
+from app.services.digest import StreamDigest
+from app.services.dtc_scan_cache import DTC_SCAN_CACHE, valid_sha256
+
+router = APIRouter(prefix="/admin", tags=["dtc"])
+
+def _response(res: dict, cached: bool) -> dict:
+    return {**res, "cached": cached}
+
+@router.post("/dtc_scan")
+async def dtc_scan(bin_file: UploadFile = File(...), _: dict = Depends(require_admin)):
+    # a disco mientras se calcula el sha256: el escáner trabaja sobre un mmap del archivo
+    staging = DTC_SCAN_CACHE.root / ".staging"
+    staging.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=staging, suffix=".bin")
+    try:
+        dig = StreamDigest()
+        with os.fdopen(fd, "wb") as f:
+            while chunk := await bin_file.read(1024 * 1024):
+                f.write(chunk)
+                dig.update(chunk)
+        if not dig.size:
+            raise HTTPException(status_code=400, detail="empty file")
+        res, cached = await run_in_threadpool(DTC_SCAN_CACHE.scan, tmp, dig.sha256)
+    finally:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+    return _response(res, cached)
+
+@router.get("/dtc_scan/{sha256}")
+async def dtc_scan_by_sha(sha256: str, _: dict = Depends(require_admin)):
+    """Resultado cacheado; si no hay, escanea la imagen si quedó en el store de análisis."""
+    sha256 = sha256.lower()
+    if not valid_sha256(sha256):
+        raise HTTPException(status_code=400, detail="invalid sha256")
+    res = DTC_SCAN_CACHE.get(sha256)
+    if res is not None:
+        return _response(res, True)
+    blob = ANALYSIS_STORE.blob_path(sha256)
+    if not blob.exists():
+        raise HTTPException(status_code=404, detail="scan not found (upload the bin to /admin/dtc_scan)")
+    res, cached = await run_in_threadpool(DTC_SCAN_CACHE.scan, blob, sha256)
+    return _response(res, cached)
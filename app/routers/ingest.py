@@ -1,12 +1,14 @@
 from __future__ import annotations
 
-import os, uuid, zipfile
-from pathlib import Path
-from typing import Optional
+import os, shutil, time, uuid, zipfile, zlib
+from pathlib import Path, PurePosixPath
+from typing import List, Optional, Tuple
 from datetime import datetime
 
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
 
+from app.services.digest import StreamDigest
+from app.services.metrics import observe_stage, stage
 from app.services.storage import save_order
 
 router = APIRouter(prefix="/api", tags=["ingest"])
@@ -20,6 +22,11 @@ MAX_BYTES = 64 * 1024 * 1024
 ALLOWED_EXTS = {".bin", ".ori", ".mod", ".mpc", ".hex", ".s19", ".srec", ".e2p", ".eep", ".rom", ".frf"}
 IGNORE_EXTS  = {".txt", ".nfo", ".pdf", ".jpg", ".jpeg", ".png", ".gif", ".xml", ".json", ".csv", ".ini", ".log"}
 
+# límites anti zip-bomb
+ZIP_MAX_MEMBERS = 1000
+ZIP_MAX_TOTAL_BYTES = 512 * 1024 * 1024
+ZIP_MAX_RATIO = 200
+
 DATA_DIR = Path(os.getenv("DATA_DIR", "/storage/efx"))
 ORDERS_DIR = DATA_DIR / "orders"
 ORDERS_DIR.mkdir(parents=True, exist_ok=True)
@@ -27,20 +34,22 @@ ORDERS_DIR.mkdir(parents=True, exist_ok=True)
 # -------------------------------------------------------------------
 # HELPERS
 # -------------------------------------------------------------------
-def pick_ecu_file(extract_dir: Path) -> Optional[Path]:
+def pick_ecu_file(infos: List[zipfile.ZipInfo]) -> Optional[zipfile.ZipInfo]:
+    # scoring solo con metadata del ZIP (infolist), sin extraer nada
     best = None
     best_score = -999
     best_size = -1
 
-    for p in extract_dir.rglob("*"):
-        if not p.is_file():
+    for info in infos:
+        if info.is_dir():
             continue
 
-        size = p.stat().st_size
+        size = info.file_size
         if size <= 0:
             continue
 
-        ext = p.suffix.lower()
+        name = PurePosixPath(info.filename).name
+        ext = PurePosixPath(name).suffix.lower()
         if ext in IGNORE_EXTS:
             continue
 
@@ -50,17 +59,82 @@ def pick_ecu_file(extract_dir: Path) -> Optional[Path]:
         if ext == ".zip":
             score = -5
 
-        low = p.name.lower()
+        low = name.lower()
         if any(k in low for k in ["readme", "info", "license", "checksum", "md5", "sha"]):
             score -= 2
 
         if score > best_score or (score == best_score and size > best_size):
-            best = p
+            best = info
             best_score = score
             best_size = size
 
     return best
 
+def check_zip_limits(z: zipfile.ZipFile) -> List[zipfile.ZipInfo]:
+    infos = z.infolist()
+    if len(infos) > ZIP_MAX_MEMBERS:
+        raise HTTPException(413, f"ZIP has too many entries (max {ZIP_MAX_MEMBERS})")
+    if sum(i.file_size for i in infos) > ZIP_MAX_TOTAL_BYTES:
+        raise HTTPException(413, "ZIP uncompressed size too large")
+    return infos
+
+def stream_member(z: zipfile.ZipFile, info: zipfile.ZipInfo, dest: Path, limit: int) -> StreamDigest:
+    """Extrae UN miembro en streaming (hash incluido), validando tamaño y ratio."""
+    if info.file_size > limit:
+        raise HTTPException(413, "File too large")
+    if info.file_size > ZIP_MAX_RATIO * max(info.compress_size, 1):
+        raise HTTPException(413, "Suspicious ZIP compression ratio")
+
+    d = StreamDigest()
+    try:
+        with z.open(info) as src, open(dest, "wb") as dst:
+            while chunk := src.read(1024 * 1024):
+                d.update(chunk)
+                # el tamaño declarado puede mentir: contamos lo realmente descomprimido
+                if d.size > min(info.file_size, limit):
+                    raise HTTPException(413, "ZIP member larger than declared")
+                dst.write(chunk)
+    except RuntimeError:
+        dest.unlink(missing_ok=True)
+        raise HTTPException(400, "Encrypted ZIP not supported")
+    except (zipfile.BadZipFile, zlib.error, EOFError):
+        # stream deflate corrupto/truncado o CRC que no cierra
+        dest.unlink(missing_ok=True)
+        raise HTTPException(400, "Invalid ZIP")
+    except HTTPException:
+        dest.unlink(missing_ok=True)
+        raise
+    return d
+
+def extract_ecu_from_zip(zip_path: Path, workdir: Path) -> Tuple[Path, StreamDigest]:
+    """Elige el archivo ECU por metadata y extrae solo ese; ZIP anidado: un nivel."""
+    try:
+        with zipfile.ZipFile(zip_path) as z:
+            picked = pick_ecu_file(check_zip_limits(z))
+            if not picked:
+                raise HTTPException(400, "No ECU file found in ZIP")
+
+            if PurePosixPath(picked.filename).suffix.lower() != ".zip":
+                dest = workdir / PurePosixPath(picked.filename).name
+                return dest, stream_member(z, picked, dest, MAX_BYTES)
+
+            nested_path = workdir / ".nested.zip"
+            stream_member(z, picked, nested_path, ZIP_MAX_TOTAL_BYTES)
+    except (zipfile.BadZipFile, zlib.error, EOFError):
+        raise HTTPException(400, "Invalid ZIP")
+
+    try:
+        with zipfile.ZipFile(nested_path) as nz:
+            inner = pick_ecu_file(check_zip_limits(nz))
+            if not inner or PurePosixPath(inner.filename).suffix.lower() == ".zip":
+                raise HTTPException(400, "No ECU file found in ZIP")
+            dest = workdir / PurePosixPath(inner.filename).name
+            return dest, stream_member(nz, inner, dest, MAX_BYTES)
+    except (zipfile.BadZipFile, zlib.error, EOFError):
+        raise HTTPException(400, "Invalid ZIP")
+    finally:
+        nested_path.unlink(missing_ok=True)
+
 # -------------------------------------------------------------------
 # ENDPOINT
 # -------------------------------------------------------------------
@@ -77,34 +151,44 @@ async def ingest_multipart(
     workdir = ORDERS_DIR / order_id
     workdir.mkdir(parents=True, exist_ok=True)
 
-    raw_path = workdir / (file.filename or "upload.bin")
+    raw_path = workdir / Path(file.filename or "upload.bin").name
 
+    # hash + CVN + tamaño en el mismo loop de escritura; corta apenas supera MAX_BYTES
+    upload = StreamDigest()
+    t_hash = t_write = 0.0
     with open(raw_path, "wb") as f:
         while chunk := await file.read(1024 * 1024):
+            t0 = time.perf_counter()
+            upload.update(chunk)
+            t1 = time.perf_counter()
+            t_hash += t1 - t0
+            if upload.size > MAX_BYTES:
+                f.close()
+                shutil.rmtree(workdir, ignore_errors=True)
+                raise HTTPException(413, "File too large")
             f.write(chunk)
+            t_write += time.perf_counter() - t1
+    observe_stage("hash", t_hash)
+    observe_stage("upload_write", t_write)
 
     ecu_file = raw_path
+    source = upload
 
     if raw_path.suffix.lower() == ".zip":
-        extract_dir = workdir / "extract"
-        extract_dir.mkdir()
-
         try:
-            with zipfile.ZipFile(raw_path) as z:
-                z.extractall(extract_dir)
-        except zipfile.BadZipFile:
-            raise HTTPException(400, "Invalid ZIP")
-
-        picked = pick_ecu_file(extract_dir)
-        if not picked:
-            raise HTTPException(400, "No ECU file found in ZIP")
-        ecu_file = picked
+            with stage("zip_extract"):
+                ecu_file, source = extract_ecu_from_zip(raw_path, workdir)
+        except Exception:
+            shutil.rmtree(workdir, ignore_errors=True)
+            raise
 
-    size = ecu_file.stat().st_size
+    size = source.size
     if size < MIN_BYTES:
+        shutil.rmtree(workdir, ignore_errors=True)
         raise HTTPException(400, "File too small")
     if size > MAX_BYTES:
-        raise HTTPException(400, "File too large")
+        shutil.rmtree(workdir, ignore_errors=True)
+        raise HTTPException(413, "File too large")
 
     order = {
         "id": order_id,
@@ -115,6 +199,9 @@ async def ingest_multipart(
         "detectedEcu": ecu or "UNKNOWN",
         "sourceFileName": ecu_file.name,
         "sourceFileBytes": size,
+        "sourceSha256": source.sha256,
+        "sourceCvnCrc32": source.cvn_crc32,
+        "upload": upload.as_dict(),
         "vehicle": {
             "brand": brand,
             "model": model,
@@ -0,0 +1,28 @@
+# app/routers/metrics.py
+import os
+import secrets
+
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from app.services.metrics import render
+
+# importados por sus colectores (tamaño del store, colas, conexiones SQLite, caché de mods)
+import app.services.analysis_store  # noqa: F401
+import app.services.diff_jobs  # noqa: F401
+import app.services.jobs  # noqa: F401
+import app.services.storage  # noqa: F401
+
+router = APIRouter(tags=["metrics"])
+
+# si está definido, el scraper debe mandar "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics(authorization: str | None = Header(default=None)):
+    if METRICS_TOKEN:
+        token = (authorization or "").removeprefix("Bearer ").strip()
+        if not secrets.compare_digest(token, METRICS_TOKEN):
+            raise HTTPException(401, "Invalid metrics token")
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -6,15 +6,17 @@ import uuid
 from datetime import datetime
 from pathlib import Path
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
 from pydantic import BaseModel
 
-from app.services.patcher import apply_patch
-from app.routers.public import ANALYSIS_DB, load_global_config, ecu_matches
-from app.routers.auth import get_current_user
+from app.services.jobs import PATCH_JOBS, QueueFull, download_ready, load_job
+from app.services.output_cache import OUTPUT_CACHE, output_key
+from app.services.applicability import actions_key
+from app.routers.public import ANALYSIS_DB, get_catalog_index
+from app.routers.auth import get_current_user, require_admin
 
 from app.services.storage import (
-    order_dir, save_order, load_order
+    order_dir, save_order, load_order, query_orders
 )
 
 router = APIRouter(prefix="/orders", tags=["orders"])
@@ -26,9 +28,6 @@ class OrderCreate(BaseModel):
 
 
 def find_patch_for_family(family: str, engine: str, patch_id: str) -> dict | None:
-    cfg = load_global_config()
-    patches = cfg.get("patches", [])
-
     fam = (family or "").strip()
     eng = (engine or "auto").strip().lower()
     if eng == "auto":
@@ -36,26 +35,12 @@ def find_patch_for_family(family: str, engine: str, patch_id: str) -> dict | Non
 
     pid = (patch_id or "").strip()
 
-    for p in patches:
-        if p.get("id") != pid:
-            continue
-
-        engines = p.get("engines")
-        if isinstance(engines, list) and eng:
-            if eng not in [str(e).lower() for e in engines]:
-                continue
-
-        if not ecu_matches(fam, p.get("compatible_ecu", [])):
-            continue
-
-        return p
-
-    return None
+    return get_catalog_index().find(fam, eng, pid)
 
 
 @router.post("")
 def create_order(data: OrderCreate, u: dict = Depends(get_current_user)):
-    a = ANALYSIS_DB.get(data.analysis_id)
+    a = ANALYSIS_DB.get_record(data.analysis_id)
     if not a:
         raise HTTPException(status_code=404, detail="analysis_id not found")
 
@@ -73,18 +58,26 @@ def create_order(data: OrderCreate, u: dict = Depends(get_current_user)):
     if rules.get("max_size") and size > int(rules["max_size"]):
         raise HTTPException(status_code=400, detail="BIN too large for this patch")
 
-    price_usd = (patch.get("price") or {}).get("USD")
+    # aplicabilidad resuelta en analyze (misma versión de las acciones): sin volver a buscar
+    key = actions_key(patch)
+    skipped = (a.get("not_applicable") or {}).get(patch.get("id"))
+    if skipped and skipped.get("key") == key:
+        raise HTTPException(status_code=400, detail=f"patch does not apply to this BIN: {skipped.get('reason')}")
+    pre = (a.get("applicable") or {}).get(patch.get("id"))
+    offsets = pre["offsets"] if pre and pre.get("key") == key else None
 
-    # ✅ genera mod
-    mod_bytes = apply_patch(a["bytes"], patch)
+    price_usd = (patch.get("price") or {}).get("USD")
 
     order_id = str(uuid.uuid4())
     odir = order_dir(order_id)
 
-    # ✅ persistimos el mod en el disk (no tempfile)
+    # ✅ el mod se genera en background (pool de procesos) → ver /orders/{id}/job
     mod_path = odir / "output.mod.bin"
-    with open(mod_path, "wb") as f:
-        f.write(mod_bytes)
+    try:
+        job = PATCH_JOBS.submit(order_id, a["sha256"], patch, str(mod_path),
+                                cache_key=output_key(a["sha256"], patch), offsets=offsets)
+    except QueueFull:
+        raise HTTPException(status_code=503, detail="patch queue full, retry later")
 
     order = {
         "id": order_id,
@@ -110,6 +103,8 @@ def create_order(data: OrderCreate, u: dict = Depends(get_current_user)):
 
         "original_filename": a.get("filename"),
         "checkout_url": f"/static/checkout.html?order_id={order_id}",
+        "job_url": f"/orders/{order_id}/job",
+        "job_state": job["state"],
     }
 
     save_order(order_id, order)
@@ -117,11 +112,25 @@ def create_order(data: OrderCreate, u: dict = Depends(get_current_user)):
 
 
 @router.get("/mine")
-def my_orders(u: dict = Depends(get_current_user)):
-    all_orders = iter_orders()
-    mine = [o for o in all_orders if o.get("owner_email") == u["email"]]
-    mine.sort(key=lambda x: x.get("created_at") or "", reverse=True)
-    return {"orders": mine}
+def my_orders(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: str | None = Query(None),
+    u: dict = Depends(get_current_user),
+):
+    mine, next_cursor = query_orders(owner_email=u["email"], limit=limit, cursor=cursor)
+    return {"orders": mine, "next_cursor": next_cursor}
+
+
+@router.get("")
+def admin_list_orders(
+    status: str | None = Query(None),
+    owner_email: str | None = Query(None),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: str | None = Query(None),
+    _: dict = Depends(require_admin),
+):
+    orders, next_cursor = query_orders(owner_email=owner_email, status=status, limit=limit, cursor=cursor)
+    return {"orders": orders, "next_cursor": next_cursor}
 
 
 @router.get("/{order_id}")
@@ -136,6 +145,26 @@ def get_order(order_id: str, u: dict = Depends(get_current_user)):
     return o
 
 
+@router.get("/jobs/stats")
+def patch_jobs_stats(_: dict = Depends(require_admin)):
+    return {**PATCH_JOBS.stats(), "output_cache": OUTPUT_CACHE.stats()}
+
+
+@router.get("/{order_id}/job")
+def get_order_job(order_id: str, u: dict = Depends(get_current_user)):
+    o = load_order(order_id)
+    if not o:
+        raise HTTPException(status_code=404, detail="order_id not found")
+
+    if o.get("owner_email") != u["email"] and u.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="forbidden")
+
+    job = load_job(order_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="job not found")
+    return job
+
+
 @router.post("/{order_id}/confirm_payment")
 def confirm_payment_demo(order_id: str, u: dict = Depends(get_current_user)):
     o = load_order(order_id)
@@ -147,8 +176,12 @@ def confirm_payment_demo(order_id: str, u: dict = Depends(get_current_user)):
 
     o["status"] = "paid"
     o["paid"] = True
-    o["download_ready"] = True
-    o["download_url"] = f"/download/{order_id}"
+    # el mod sale del job: listo solo si terminó bien (si no, se informa su estado)
+    job = load_job(order_id) or {}
+    o["download_ready"] = download_ready(o)
+    o["download_url"] = f"/download/{order_id}" if o["download_ready"] else None
+    if job:
+        o["job_state"] = job.get("state")
 
     save_order(order_id, o)
 
@@ -156,6 +189,10 @@ def confirm_payment_demo(order_id: str, u: dict = Depends(get_current_user)):
         "ok": True,
         "order_id": order_id,
         "status": o["status"],
+        "download_ready": o["download_ready"],
         "download_url": o["download_url"],
+        "job_state": job.get("state"),
+        "job_error": job.get("error"),
+        "job_url": o.get("job_url"),
     }
 
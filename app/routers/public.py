@@ -1,142 +1,67 @@
 # app/routers/public.py
 from fastapi import APIRouter, UploadFile, File, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 import zlib
 
-router = APIRouter(prefix="", tags=["public"])
-
-# memoria demo: analysis_id -> bytes
-ANALYSIS_DB = {}
-
-from pathlib import Path
-import json
-
-def normalize_ecu_family(ecu: str) -> str:
-    if not ecu:
-        return ""
-    e = ecu.strip().upper()
-
-    # corta por separadores típicos
-    for sep in (" ", "-", "_"):
-        if sep in e:
-            e = e.split(sep, 1)[0]
-
-    # familias por prefijo
-    if e.startswith("EDC17"):
-        return "EDC17"
-    if e.startswith("MED17"):
-        return "MED17"
-    if e.startswith("MD1"):
-        return "MD1"
-    if e.startswith("MG1"):
-        return "MG1"
-    if e.startswith("MEVD"):
-        return "MEVD"
-    if e.startswith("DENSO"):
-        return "DENSO"
-    if e.startswith("SID"):
-        return "SIEMENS_SID"
-    if e.startswith("DCM"):
-        return "CONTINENTAL_DCM"
-    if e.startswith("DELPHI"):
-        return "DELPHI"
-
-    # fallback seguro
-    return e[:6]
-
-
-def ecu_matches(ecu_detected: str, compatible_list: list) -> bool:
-    if not ecu_detected or not compatible_list:
-        return False
-
-    d = str(ecu_detected).strip().upper()
-    fam_d = normalize_ecu_family(d)
-
-    for c in compatible_list:
-        if not c:
-            continue
-        cc = str(c).strip().upper()
-        fam_c = normalize_ecu_family(cc)
-
-        # match exacto
-        if d == cc:
-            return True
-        # match por familia (EDC17C81 vs EDC17)
-        if fam_d and fam_c and fam_d == fam_c:
-            return True
-        # match por substring (por si guardas variantes)
-        if cc in d or d in cc:
-            return True
-
-    return False
-
-
-from pathlib import Path
-import json
-from fastapi import HTTPException
-
-def load_global_config() -> dict:
-    repo_root = Path(__file__).resolve().parents[2]  # .../src
-
-    candidates = [
-        repo_root / "static" / "global.json",
-        repo_root / "static" / "patches" / "global.json",  # 👈 TU CASO
-        repo_root / "global.json",
-        Path("static") / "global.json",
-        Path("static") / "patches" / "global.json",        # 👈 TU CASO
-        Path("global.json"),
-    ]
+from app.services.analysis_store import ANALYSIS_STORE
+from app.services.applicability import precompute
+from app.services.catalog_index import CatalogIndex, get_catalog
+from app.services.ecu_fingerprint import detect_fingerprint
+from app.services.metrics import stage
+from app.services.recipe_registry import registry_stats
 
-    path = next((p for p in candidates if p.exists()), None)
+router = APIRouter(prefix="", tags=["public"])
 
-    if not path:
-        raise HTTPException(
-            status_code=500,
-            detail="global.json no encontrado. Esperado en static/global.json o static/patches/global.json"
-        )
+# analysis_id -> registro + blob (disco compartido entre workers, LRU acotado en memoria)
+ANALYSIS_DB = ANALYSIS_STORE
 
+def get_catalog_index() -> CatalogIndex:
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            cfg = json.load(f)
-        # log útil para Render
-        print(f"[ECU FORGE X] global.json loaded from: {path}")
-        return cfg
-    except json.JSONDecodeError as e:
-        raise HTTPException(status_code=500, detail=f"global.json inválido ({path}): {e}")
+        return get_catalog()
+    except (FileNotFoundError, ValueError) as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def load_global_config() -> dict:
+    # global.json cacheado: solo se vuelve a leer si cambia mtime/size
+    return get_catalog_index().config
 
 @router.post("/analyze_bin")
 async def analyze_bin(bin_file: UploadFile = File(...)):
     data = await bin_file.read()
     size = len(data)
-    crc = zlib.crc32(data) & 0xFFFFFFFF
-
-    ecu_type = "EDC17C81" if size > 2_000_000 else "UNKNOWN"
-    engine = "diesel"  # demo
+    with stage("hash"):
+        crc = zlib.crc32(data) & 0xFFFFFFFF
+
+    with stage("family_detection"):
+        # una pasada con todos los marcadores de static/data (familia, PN, SW)
+        fp = detect_fingerprint(data)
+        # sin marcadores conocidos: heurística por tamaño (demo)
+        ecu_type = fp["family"] or ("EDC17C81" if size > 2_000_000 else "UNKNOWN")
+        engine = "diesel"  # demo
     analysis_id = f"demo-{crc:08X}-{size}"
 
-    ANALYSIS_DB[analysis_id] = {
-        "bytes": data,
-        "filename": bin_file.filename,
-        "ecu_type": ecu_type,
-        "engine": engine,
-        "bin_size": size,
-        "cvn_crc32": f"{crc:08X}",
-    }
-
-    # 🔹 cargar parches
-    global_data = load_global_config()
-    all_patches = global_data.get("patches", [])
-
-    patches_out = []
-    for p in all_patches:
-        engines = p.get("engines")
-        if isinstance(engines, list):
-            if engine not in [str(e).lower() for e in engines]:
-                continue
-
-        if not ecu_matches(ecu_type, p.get("compatible_ecu", [])):
-            continue
-
-        patches_out.append(p)
+    # 🔹 parches compatibles (índice en memoria)
+    with stage("catalog_filter"):
+        candidates = get_catalog_index().query(ecu_type, engine)
+
+    # 🔹 solo los que aplican a ESTE bin: offsets por acción, create_order los reutiliza
+    with stage("applicability"):
+        applicable, not_applicable = precompute(data, candidates)
+        patches_out = [p for p in candidates if p.get("id") in applicable]
+
+    with stage("analysis_store_write"):
+        # blob con fsync/rename: en el threadpool, no en el event loop
+        await run_in_threadpool(ANALYSIS_DB.put, analysis_id, data, {
+            "filename": bin_file.filename,
+            "ecu_type": ecu_type,
+            "engine": engine,
+            "bin_size": size,
+            "cvn_crc32": f"{crc:08X}",
+            "ecu_part_number": fp["part_number"],
+            "ecu_sw_id": fp["sw_id"],
+            "applicable": applicable,
+            "not_applicable": not_applicable,
+        })
 
     return {
         "analysis_id": analysis_id,
@@ -144,8 +69,16 @@ async def analyze_bin(bin_file: UploadFile = File(...)):
         "bin_size": size,
         "cvn_crc32": f"{crc:08X}",
         "ecu_type": ecu_type,
-        "ecu_part_number": None,
-        "patches": patches_out
+        "ecu_part_number": fp["part_number"],
+        "ecu_sw_id": fp["sw_id"],
+        "ecu_desc": fp["desc"],
+        "fingerprint": {
+            "source": "markers" if fp["family"] else "size",
+            "matches": fp["matches"],
+            "scan_ms": fp["scan_ms"],
+        },
+        "patches": patches_out,
+        "patches_not_applicable": [{"id": pid, "reason": v["reason"]} for pid, v in not_applicable.items()],
     }
     
 @router.get("/debug/global")
@@ -157,6 +90,11 @@ def debug_global():
         "first_patch_id": (cfg.get("patches") or [{}])[0].get("id")
     }
 
+@router.get("/debug/recipes")
+def debug_recipes():
+    # contadores del registro de recetas compiladas (hit/miss por mtime/size)
+    return registry_stats()
+
 @router.get("/public/recipes/{family}")
 def public_recipes(family: str, engine: str = Query("auto")):
     """
@@ -164,9 +102,6 @@ def public_recipes(family: str, engine: str = Query("auto")):
     GET /public/recipes/<family>?engine=...
     Respuesta: { recipes: [...] }
     """
-    global_data = load_global_config()
-    all_patches = global_data.get("patches", [])
-
     fam = (family or "").strip()
     eng = (engine or "auto").strip().lower()
 
@@ -174,18 +109,8 @@ def public_recipes(family: str, engine: str = Query("auto")):
     if eng == "auto":
         eng = "diesel"
 
-    out = []
-    for p in all_patches:
-        engines = p.get("engines")
-        if isinstance(engines, list) and eng:
-            if eng not in [str(e).lower() for e in engines]:
-                continue
-
-        if not ecu_matches(fam, p.get("compatible_ecu", [])):
-            continue
-
-        # devolvemos el objeto tal cual como "recipe"
-        out.append(p)
+    # devolvemos los objetos tal cual como "recipe"
+    out = get_catalog_index().query(fam, eng)
 
     return {"recipes": out}
 
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, HTTPException
+from app.services.jobs import download_ready
 from app.services.storage import load_order
 
 router = APIRouter(prefix="/public", tags=["public"])
@@ -9,13 +10,15 @@ def public_get_order(order_id: str):
     if not o:
         raise HTTPException(status_code=404, detail="order_id not found")
 
+    ready = download_ready(o)
+
     # Público: devuelve solo lo necesario
     return {
         "id": o.get("id"),
         "created_at": o.get("created_at"),
         "status": o.get("status"),
         "paid": o.get("paid"),
-        "download_ready": o.get("download_ready"),
+        "download_ready": ready,
 
         "family": o.get("family"),
         "engine": o.get("engine"),
@@ -31,6 +34,6 @@ def public_get_order(order_id: str):
         "vehicle": o.get("vehicle"),
 
         "checkout_url": o.get("checkout_url"),
-        "download_url": f"/download/{order_id}" if o.get("download_ready") else None,
+        "download_url": f"/download/{order_id}" if ready else None,
         "availablePatches": o.get("availablePatches") or [],
     }
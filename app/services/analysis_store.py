@@ -0,0 +1,202 @@
+# app/services/analysis_store.py
+# Store de análisis acotado y direccionado por contenido.
+# - blobs en DATA_DIR/analysis/blobs/<sha256[:2]>/<sha256>.bin (compartidos entre workers)
+# - registro por analysis_id en DATA_DIR/analysis/records/<id>.json con TTL
+# - en memoria solo un LRU acotado en bytes de los blobs más recientes; el resto se lee con mmap
+from __future__ import annotations
+
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from app.services.metrics import register_collector, stats_collector
+from app.services.storage import DATA_DIR
+
+ANALYSIS_DIR = DATA_DIR / "analysis"
+ANALYSIS_CACHE_BYTES = int(os.getenv("ANALYSIS_CACHE_MB", "64")) * 1024 * 1024
+ANALYSIS_TTL_S = int(float(os.getenv("ANALYSIS_TTL_HOURS", "24")) * 3600)
+PURGE_EVERY_S = 600
+
+
+def _atomic_write(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def _map_file(path: Path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class AnalysisStore:
+    def __init__(self, root: Path, *, max_mem_bytes: int = ANALYSIS_CACHE_BYTES, ttl_s: int = ANALYSIS_TTL_S):
+        self.root = root
+        self.blobs_dir = root / "blobs"
+        self.records_dir = root / "records"
+        self.blobs_dir.mkdir(parents=True, exist_ok=True)
+        self.records_dir.mkdir(parents=True, exist_ok=True)
+        self.max_mem_bytes = max_mem_bytes
+        self.ttl_s = ttl_s
+
+        self._lock = threading.Lock()
+        self._hot: "OrderedDict[str, bytes]" = OrderedDict()
+        self._hot_bytes = 0
+        self._last_purge = 0.0
+        self._purging = False
+        self.hits = 0
+        self.misses = 0
+
+    # ---------- paths ----------
+    def blob_path(self, sha256: str) -> Path:
+        return self.blobs_dir / sha256[:2] / f"{sha256}.bin"
+
+    def record_path(self, analysis_id: str) -> Path:
+        # analysis_id viene del cliente: solo nombre plano
+        return self.records_dir / f"{Path(analysis_id).name}.json"
+
+    # ---------- LRU ----------
+    def _remember(self, sha256: str, data: bytes) -> None:
+        if len(data) > self.max_mem_bytes:
+            return
+        with self._lock:
+            old = self._hot.pop(sha256, None)
+            if old is not None:
+                self._hot_bytes -= len(old)
+            self._hot[sha256] = data
+            self._hot_bytes += len(data)
+            while self._hot_bytes > self.max_mem_bytes and self._hot:
+                _, ev = self._hot.popitem(last=False)
+                self._hot_bytes -= len(ev)
+
+    # ---------- API ----------
+    def put(self, analysis_id: str, data: bytes, record: dict, *, sha256: Optional[str] = None) -> dict:
+        digest = sha256 or hashlib.sha256(data).hexdigest()
+        bp = self.blob_path(digest)
+        if bp.exists():
+            os.utime(bp)  # renueva TTL del blob
+        else:
+            _atomic_write(bp, bytes(data))
+
+        now = time.time()
+        rec = dict(record)
+        rec.update({"sha256": digest, "created_at": now, "expires_at": now + self.ttl_s})
+        _atomic_write(self.record_path(analysis_id),
+                      json.dumps(rec, ensure_ascii=False).encode("utf-8"))
+        self._remember(digest, bytes(data))
+
+        self._maybe_purge(now)
+        return rec
+
+    def _maybe_purge(self, now: float) -> None:
+        # put corre en el event loop (analyze_bin): la purga recorre y parsea todos los
+        # registros, así que va en un hilo aparte y nunca hay dos a la vez
+        with self._lock:
+            if self._purging or now - self._last_purge <= PURGE_EVERY_S:
+                return
+            self._last_purge = now
+            self._purging = True
+        threading.Thread(target=self._purge_bg, name="analysis-purge", daemon=True).start()
+
+    def _purge_bg(self) -> None:
+        try:
+            self.purge()
+        except Exception as e:
+            print(f"[ECU FORGE X] analysis store: falló la purga: {e}")
+        finally:
+            with self._lock:
+                self._purging = False
+
+    def get_record(self, analysis_id: str) -> Optional[dict]:
+        p = self.record_path(analysis_id)
+        try:
+            rec = json.loads(p.read_text(encoding="utf-8"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if rec.get("expires_at", 0) < time.time():
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                pass
+            return None
+        return rec
+
+    def blob(self, sha256: str):
+        """Bytes del blob: desde el LRU si está caliente, si no vía mmap (solo lectura)."""
+        with self._lock:
+            data = self._hot.get(sha256)
+            if data is not None:
+                self._hot.move_to_end(sha256)
+                self.hits += 1
+                return data
+            self.misses += 1
+        try:
+            return _map_file(self.blob_path(sha256))
+        except FileNotFoundError:
+            return None
+
+    def get(self, analysis_id: str) -> Optional[dict]:
+        """Registro + "bytes" (compatible con el antiguo ANALYSIS_DB[analysis_id])."""
+        rec = self.get_record(analysis_id)
+        if rec is None:
+            return None
+        data = self.blob(rec["sha256"])
+        if data is None:
+            return None
+        rec["bytes"] = data
+        return rec
+
+    def __contains__(self, analysis_id: str) -> bool:
+        return self.get_record(analysis_id) is not None
+
+    def purge(self) -> int:
+        """Borra registros vencidos y blobs sin uso (mtime) más viejos que el TTL."""
+        now = time.time()
+        removed = 0
+        for p in self.records_dir.glob("*.json"):
+            try:
+                if json.loads(p.read_text(encoding="utf-8")).get("expires_at", 0) < now:
+                    p.unlink()
+                    removed += 1
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+        for p in self.blobs_dir.glob("*/*.bin"):
+            try:
+                if p.stat().st_mtime + self.ttl_s < now:
+                    p.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                continue
+        return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hot_entries": len(self._hot),
+                "hot_bytes": self._hot_bytes,
+                "max_mem_bytes": self.max_mem_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+ANALYSIS_STORE = AnalysisStore(ANALYSIS_DIR)
+register_collector(stats_collector("analysis_store", ANALYSIS_STORE.stats, counters=("hits", "misses")))
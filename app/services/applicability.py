@@ -0,0 +1,117 @@
+# app/services/applicability.py
+# Aplicabilidad por imagen, calculada una vez en analyze_bin: para cada parche
+# candidato de la familia se resuelven los offsets donde escribiría cada acción
+# (los mismos que buscaría patcher.apply_actions). Se guardan en el registro del
+# análisis y create_order se los pasa al job: el parcheo escribe directo, sin buscar.
+#
+# Las búsquedas se comparten entre parches: el mismo (needle, inicio de cola) se
+# busca una sola vez por imagen. Las acciones siguientes de un mismo parche ven las
+# escrituras de las anteriores (overlay sobre las ventanas tocadas), igual que el
+# pipeline en el lugar.
+from __future__ import annotations
+
+import hashlib
+import json
+from typing import Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_SCAN_TAIL = 1048576
+
+
+def actions_key(patch_def: dict) -> str:
+    """Versión de las acciones de un parche: offsets de otra versión no se reutilizan."""
+    raw = json.dumps(patch_def.get("actions") or [], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class _Finder:
+    """find() memorizado sobre la imagen original (compartido por todos los parches)."""
+
+    def __init__(self, data):
+        self.data = data
+        self._memo: Dict[Tuple[bytes, int], int] = {}
+
+    def first(self, needle: bytes, start: int) -> int:
+        key = (needle, start)
+        hit = self._memo.get(key)
+        if hit is None:
+            hit = self._memo[key] = self.data.find(needle, start)
+        return hit
+
+
+def _overlay(data, writes: List[Tuple[int, bytes]], start: int, end: int) -> bytes:
+    out = bytearray(data[start:end])
+    for at, payload in writes:
+        a, b = max(at, start), min(at + len(payload), end)
+        if a < b:
+            out[a - start:b - start] = payload[a - at:b - at]
+    return bytes(out)
+
+
+def _locate(finder: _Finder, needle: bytes, start: int, writes: List[Tuple[int, bytes]]) -> int:
+    """Primer offset >= start donde está `needle` tras aplicar `writes` (o -1)."""
+    data, n = finder.data, len(needle)
+    pos = finder.first(needle, start)
+    # ocurrencias originales pisadas por una escritura anterior: se valida con el overlay
+    while pos >= 0 and any(at < pos + n and pos < at + len(p) for at, p in writes):
+        if _overlay(data, writes, pos, pos + n) == needle:
+            break
+        pos = data.find(needle, pos + 1)
+    # ocurrencias que crearon las escrituras (ventanas alrededor de cada una)
+    for at, payload in writes:
+        lo, hi = max(start, at - n + 1), min(len(data), at + len(payload) + n - 1)
+        if hi - lo < n or (0 <= pos < lo):
+            continue
+        i = _overlay(data, writes, lo, hi).find(needle)
+        if i >= 0 and (pos < 0 or lo + i < pos):
+            pos = lo + i
+    return pos
+
+
+def _resolve(finder: _Finder, patch_def: dict) -> Tuple[Optional[List[int]], Optional[str]]:
+    size = len(finder.data)
+    rules = patch_def.get("rules") or {}
+    if rules.get("min_size") and size < int(rules["min_size"]):
+        return None, "bin too small"
+    if rules.get("max_size") and size > int(rules["max_size"]):
+        return None, "bin too large"
+
+    offsets: List[int] = []
+    writes: List[Tuple[int, bytes]] = []
+    for act in patch_def.get("actions") or []:
+        if act.get("type") != "patch_in_padding":
+            return None, f"unknown action type: {act.get('type')}"
+        try:
+            needle = bytes.fromhex(act["needle_hex"])
+            payload = act["write_ascii"].encode("ascii", errors="strict")
+        except (KeyError, ValueError) as e:
+            return None, f"invalid action: {e}"
+        if len(payload) > len(needle):
+            return None, "payload too long for needle block"
+        tail_start = max(0, size - int(act.get("max_scan_tail", DEFAULT_SCAN_TAIL)))
+        at = _locate(finder, needle, tail_start, writes)
+        if at < 0:
+            return None, "padding region not found"
+        offsets.append(at)
+        writes.append((at, payload))
+    return offsets, None
+
+
+def precompute(data, patches: Sequence[dict]) -> Tuple[Dict[str, dict], Dict[str, dict]]:
+    """
+    (aplicables, no aplicables) por patch id:
+      aplicables    → {"key": actions_key, "offsets": [offset por acción]}
+      no aplicables → {"key": actions_key, "reason": "..."}
+    """
+    finder = _Finder(data)
+    ok: Dict[str, dict] = {}
+    skipped: Dict[str, dict] = {}
+    for p in patches:
+        pid = p.get("id")
+        if pid is None or pid in ok or pid in skipped:
+            continue
+        offsets, reason = _resolve(finder, p)
+        if offsets is None:
+            skipped[pid] = {"key": actions_key(p), "reason": reason}
+        else:
+            ok[pid] = {"key": actions_key(p), "offsets": offsets}
+    return ok, skipped
@@ -0,0 +1,236 @@
+# app/services/catalog_index.py
+# Índice en memoria de global.json: se construye una vez y se recarga solo si
+# cambia el archivo (mtime/size). Las consultas por ECU/engine/patch_id son
+# lookups en dict en vez de recorrer todos los parches con ecu_matches.
+from __future__ import annotations
+
+import copy
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+
+CANDIDATES = [
+    REPO_ROOT / "static" / "global.json",
+    REPO_ROOT / "static" / "patches" / "global.json",
+    REPO_ROOT / "global.json",
+    Path("static") / "global.json",
+    Path("static") / "patches" / "global.json",
+    Path("global.json"),
+]
+
+# tope de familias / ECUs distintas memorizadas por versión del catálogo
+MAX_MEMO = 4096
+
+
+def normalize_ecu_family(ecu: str) -> str:
+    if not ecu:
+        return ""
+    e = ecu.strip().upper()
+
+    # corta por separadores típicos
+    for sep in (" ", "-", "_"):
+        if sep in e:
+            e = e.split(sep, 1)[0]
+
+    # familias por prefijo
+    if e.startswith("EDC17"):
+        return "EDC17"
+    if e.startswith("MED17"):
+        return "MED17"
+    if e.startswith("MD1"):
+        return "MD1"
+    if e.startswith("MG1"):
+        return "MG1"
+    if e.startswith("MEVD"):
+        return "MEVD"
+    if e.startswith("DENSO"):
+        return "DENSO"
+    if e.startswith("SID"):
+        return "SIEMENS_SID"
+    if e.startswith("DCM"):
+        return "CONTINENTAL_DCM"
+    if e.startswith("DELPHI"):
+        return "DELPHI"
+
+    # fallback seguro
+    return e[:6]
+
+
+def ecu_matches(ecu_detected: str, compatible_list: list) -> bool:
+    if not ecu_detected or not compatible_list:
+        return False
+
+    d = str(ecu_detected).strip().upper()
+    fam_d = normalize_ecu_family(d)
+
+    for c in compatible_list:
+        if not c:
+            continue
+        cc = str(c).strip().upper()
+        fam_c = normalize_ecu_family(cc)
+
+        # match exacto
+        if d == cc:
+            return True
+        # match por familia (EDC17C81 vs EDC17)
+        if fam_d and fam_c and fam_d == fam_c:
+            return True
+        # match por substring (por si guardas variantes)
+        if cc in d or d in cc:
+            return True
+
+    return False
+
+
+class CatalogIndex:
+    """Vista indexada e inmutable de una versión de global.json."""
+
+    def __init__(self, config: dict, path: Path):
+        self.config = config
+        self.path = path
+        self.patches: List[dict] = list(config.get("patches", []))
+
+        self.by_id: Dict[str, List[int]] = {}
+        self._engines: List[Optional[FrozenSet[str]]] = []
+        self._compat: List[list] = []
+        for i, p in enumerate(self.patches):
+            self.by_id.setdefault(p.get("id"), []).append(i)
+            engines = p.get("engines")
+            self._engines.append(frozenset(str(e).lower() for e in engines) if isinstance(engines, list) else None)
+            self._compat.append(p.get("compatible_ecu", []))
+
+        # términos de compatible_ecu ya normalizados: (TÉRMINO, familia, índice)
+        self._terms: List[Tuple[str, str, int]] = []
+        for i, compat in enumerate(self._compat):
+            for c in compat or []:
+                if c:
+                    cc = str(c).strip().upper()
+                    self._terms.append((cc, normalize_ecu_family(cc), i))
+
+        self._lock = threading.Lock()
+        self._by_family: Dict[str, FrozenSet[int]] = {}
+        self._by_ecu: Dict[str, FrozenSet[int]] = {}
+        self._by_query: Dict[Tuple[str, str], Tuple[int, ...]] = {}
+
+        # precalcula las familias declaradas en el catálogo (las que más se consultan)
+        for _, fam, _ in self._terms:
+            self._family(fam)
+
+    def _family(self, fam: str) -> FrozenSet[int]:
+        """Índices de parches con algún compatible_ecu de la familia `fam` (memorizado)."""
+        hit = self._by_family.get(fam)
+        if hit is not None:
+            return hit
+        res = frozenset(i for _, f, i in self._terms if fam and f == fam)
+        with self._lock:
+            if len(self._by_family) >= MAX_MEMO:
+                self._by_family.clear()
+            self._by_family[fam] = res
+        return res
+
+    def _extra(self, d: str, skip: FrozenSet[int]) -> FrozenSet[int]:
+        """Match exacto/substring (ecu_matches) de los parches que la familia no cubre (memorizado por ECU)."""
+        if not d:
+            return frozenset()
+        hit = self._by_ecu.get(d)
+        if hit is not None:
+            return hit
+        res = frozenset(i for cc, _, i in self._terms if i not in skip and (cc in d or d in cc))
+        with self._lock:
+            if len(self._by_ecu) >= MAX_MEMO:
+                self._by_ecu.clear()
+            self._by_ecu[d] = res
+        return res
+
+    def compatible(self, ecu: str) -> FrozenSet[int]:
+        """Índices de parches cuyo compatible_ecu acepta `ecu` (mismo criterio que ecu_matches)."""
+        d = str(ecu or "").strip().upper()
+        fam = self._family(normalize_ecu_family(d))
+        return fam | self._extra(d, fam)
+
+    def _engine_ok(self, i: int, engine: str) -> bool:
+        engines = self._engines[i]
+        return not engine or engines is None or engine in engines
+
+    def query(self, ecu: str, engine: str) -> List[dict]:
+        """Copias de los parches compatibles con la ECU y el engine, en el orden de global.json."""
+        d = str(ecu or "").strip().upper()
+        eng = (engine or "").lower()
+        # memo por familia: variantes de la misma ECU comparten entrada
+        key = (normalize_ecu_family(d), eng)
+        idxs = self._by_query.get(key)
+        if idxs is None:
+            idxs = tuple(sorted(i for i in self._family(key[0]) if self._engine_ok(i, eng)))
+            with self._lock:
+                if len(self._by_query) >= MAX_MEMO:
+                    self._by_query.clear()
+                self._by_query[key] = idxs
+        extra = [i for i in self._extra(d, self._family(key[0])) if self._engine_ok(i, eng)]
+        if extra:
+            idxs = tuple(sorted(idxs + tuple(extra)))
+        # el índice es compartido entre requests: nunca se entregan los dicts internos
+        return [copy.deepcopy(self.patches[i]) for i in idxs]
+
+    def find(self, ecu: str, engine: str, patch_id: str) -> Optional[dict]:
+        compat = self.compatible(ecu)
+        eng = (engine or "").lower()
+        for i in self.by_id.get(patch_id, ()):
+            if i in compat and self._engine_ok(i, eng):
+                return copy.deepcopy(self.patches[i])
+        return None
+
+
+class CatalogStore:
+    def __init__(self, candidates: Sequence[Path]):
+        self.candidates = list(candidates)
+        self._lock = threading.Lock()
+        self._path: Optional[Path] = None
+        self._sig: Optional[Tuple[int, int]] = None
+        self._index: Optional[CatalogIndex] = None
+
+    def _stat(self) -> Tuple[Path, os.stat_result]:
+        if self._path is not None:
+            try:
+                return self._path, os.stat(self._path)
+            except FileNotFoundError:
+                pass
+        for p in self.candidates:
+            try:
+                return p, os.stat(p)
+            except FileNotFoundError:
+                continue
+        raise FileNotFoundError(
+            "global.json no encontrado. Esperado en static/global.json o static/patches/global.json"
+        )
+
+    def get(self) -> CatalogIndex:
+        path, st = self._stat()
+        sig = (st.st_mtime_ns, st.st_size)
+        index = self._index
+        if index is not None and path == self._path and sig == self._sig:
+            return index
+
+        with self._lock:
+            if self._index is not None and path == self._path and sig == self._sig:
+                return self._index
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    cfg = json.load(f)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"global.json inválido ({path}): {e}")
+            self._index = CatalogIndex(cfg, path)
+            self._path, self._sig = path, sig
+            # log útil para Render (solo al cargar/recargar)
+            print(f"[ECU FORGE X] global.json loaded from: {path}")
+            return self._index
+
+
+CATALOG = CatalogStore(CANDIDATES)
+
+
+def get_catalog() -> CatalogIndex:
+    return CATALOG.get()
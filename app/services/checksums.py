@@ -0,0 +1,224 @@
+# app/services/checksums.py
+# Corrección de checksums por bloque para los `post` de las recetas. Cada bloque
+# ([start, end), algoritmo, offset donde se guarda) se recalcula de forma incremental:
+# a partir del valor guardado en el stock y de los bytes que cambiaron las ops
+# (WriteLog), sin volver a leer el bloque. CRC32 usa la linealidad del CRC
+# (crc(M') = crc(M) ^ crc_raw(M ^ M') desplazado al final del bloque) y las sumas
+# solo suman la diferencia de las palabras tocadas: el costo es proporcional a los
+# bytes cambiados, no al tamaño del binario.
+#
+# Si una op cambió el tamaño del buffer los offsets del mapa ya no valen nada
+# seguro: se recalcula todo completo (igual que con `full: true`).
+from __future__ import annotations
+
+import zlib
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import Any, Iterable, List, Mapping, Optional, Tuple
+
+from app.services.dirty_ranges import DirtyRanges
+
+try:
+    import numpy as np
+except Exception:  # sin NumPy las sumas completas van palabra por palabra (mismo resultado, más lento)
+    np = None
+
+# algoritmo → (tamaño de palabra, ancho por defecto del valor guardado)
+ALGOS = {"crc32": (1, 4), "sum8": (1, 1), "sum16": (2, 2), "sum32": (4, 4)}
+_ENDIAN = {"le": "little", "be": "big", "little": "little", "big": "big"}
+
+
+@dataclass(frozen=True)
+class ChecksumBlock:
+    name: str
+    algo: str
+    start: int
+    end: int                    # exclusivo
+    at: int                     # offset del valor guardado (fuera del bloque)
+    width: int
+    endian: str                 # "little" | "big"
+
+
+def _int(v: Any) -> int:
+    return int(v, 0) if isinstance(v, str) else int(v)
+
+
+def parse_blocks(raw: Iterable[Mapping[str, Any]], default_algo: str = "crc32") -> Tuple[ChecksumBlock, ...]:
+    """Bloques de checksums.json / de la receta → ChecksumBlock validados (ValueError si no)."""
+    out = []
+    for i, b in enumerate(raw or ()):
+        algo = b.get("algo", default_algo)
+        if algo not in ALGOS:
+            raise ValueError(f"checksum: algoritmo desconocido {algo!r}")
+        word, width = ALGOS[algo]
+        blk = ChecksumBlock(
+            name=str(b.get("name", f"block{i}")),
+            algo=algo,
+            start=_int(b["start"]),
+            end=_int(b["end"]),
+            at=_int(b["at"]),
+            width=_int(b.get("width", width)),
+            endian=_ENDIAN.get(str(b.get("endian", "le")).lower(), ""),
+        )
+        if not blk.endian:
+            raise ValueError(f"checksum {blk.name}: endian inválido")
+        if blk.end <= blk.start or (blk.end - blk.start) % word:
+            raise ValueError(f"checksum {blk.name}: rango inválido para {algo}")
+        if blk.at < blk.end and blk.at + blk.width > blk.start:
+            raise ValueError(f"checksum {blk.name}: el valor no puede guardarse dentro del bloque")
+        out.append(blk)
+    return tuple(out)
+
+
+# -----------------------------
+# Registro de escrituras
+# -----------------------------
+class WriteLog:
+    """Bytes originales de cada rango que escribieron las ops (para el cálculo incremental)."""
+
+    def __init__(self) -> None:
+        self._writes: List[Tuple[int, bytes]] = []
+        self.dirty = DirtyRanges()
+        self.resized = False
+
+    def __bool__(self) -> bool:
+        return bool(self.dirty)
+
+    def record(self, start: int, old: bytes) -> None:
+        """Llamar con los bytes que había en [start, start+len(old)) antes de escribir."""
+        if old:
+            self._writes.append((start, bytes(old)))
+            self.dirty.add(start, start + len(old))
+
+    def original(self, buf, start: int, end: int) -> bytes:
+        """Contenido de buf[start:end] antes de cualquier escritura registrada."""
+        out = bytearray(buf[start:end])
+        # de la última a la primera: gana lo que había antes de la primera escritura
+        for s, old in reversed(self._writes):
+            a, b = max(s, start), min(s + len(old), end)
+            if a < b:
+                out[a - start:b - start] = old[a - s:b - s]
+        return bytes(out)
+
+    def ranges_in(self, start: int, end: int) -> List[Tuple[int, int]]:
+        """Rangos escritos (fusionados) que caen dentro de [start, end), recortados."""
+        merged = self.dirty.merged()
+        j = bisect_left([e for _, e in merged], start + 1)
+        out = []
+        for s, e in merged[j:]:
+            if s >= end:
+                break
+            out.append((max(s, start), min(e, end)))
+        return out
+
+
+# -----------------------------
+# CRC32 (zlib): aritmética en GF(2) para desplazar un CRC n bytes en O(log n)
+# -----------------------------
+_POLY = 0xEDB88320
+
+
+def _multmodp(a: int, b: int) -> int:
+    m, p = 1 << 31, 0
+    while True:
+        if a & m:
+            p ^= b
+            if (a & (m - 1)) == 0:
+                return p
+        m >>= 1
+        b = (b >> 1) ^ _POLY if b & 1 else b >> 1
+
+
+# _X2N[k] = x^(2^k) mod P
+_X2N = [1 << 30]
+for _ in range(31):
+    _X2N.append(_multmodp(_X2N[-1], _X2N[-1]))
+
+
+def _shift_zeros(crc: int, n: int) -> int:
+    """CRC lineal (sin init/xorout) de un mensaje seguido de n bytes en cero."""
+    p, k = 1 << 31, 3                   # x^0; n bytes = n * 2^3 bits
+    while n:
+        if n & 1:
+            p = _multmodp(_X2N[k & 31], p)
+        n >>= 1
+        k += 1
+    return _multmodp(p, crc)
+
+
+def _crc_raw(data: bytes) -> int:
+    # parte lineal: crc32 = crc_raw ^ crc32(ceros del mismo largo)
+    return zlib.crc32(data) ^ zlib.crc32(bytes(len(data)))
+
+
+def _xor(a: bytes, b: bytes) -> bytes:
+    return (int.from_bytes(a, "little") ^ int.from_bytes(b, "little")).to_bytes(len(a), "little")
+
+
+# -----------------------------
+# Cálculo
+# -----------------------------
+def _full(buf, blk: ChecksumBlock) -> int:
+    data = memoryview(buf)[blk.start:blk.end]
+    try:
+        if blk.algo == "crc32":
+            return zlib.crc32(data) & 0xFFFFFFFF
+        word = ALGOS[blk.algo][0]
+        if np is not None:
+            dt = np.dtype(f"u{word}").newbyteorder("<" if blk.endian == "little" else ">")
+            return int(np.frombuffer(data, dtype=dt).sum(dtype=np.uint64))
+        if word == 1:
+            return sum(data)
+        return sum(int.from_bytes(data[i:i + word], blk.endian) for i in range(0, len(data), word))
+    finally:
+        data.release()
+
+
+def _incremental(buf, blk: ChecksumBlock, log: WriteLog, old_value: int) -> int:
+    ranges = log.ranges_in(blk.start, blk.end)
+    if blk.algo == "crc32":
+        crc = old_value
+        for s, e in ranges:
+            delta = _xor(log.original(buf, s, e), bytes(buf[s:e]))
+            crc ^= _shift_zeros(_crc_raw(delta), blk.end - e)
+        return crc
+    word = ALGOS[blk.algo][0]
+    total = old_value
+    for s, e in ranges:
+        # alineado a palabras contadas desde el inicio del bloque
+        s -= (s - blk.start) % word
+        e += -(e - blk.start) % word
+        old, new = log.original(buf, s, e), buf[s:e]
+        for i in range(0, e - s, word):
+            total += int.from_bytes(new[i:i + word], blk.endian) - int.from_bytes(old[i:i + word], blk.endian)
+    return total
+
+
+def fix_blocks(buf, blocks: Iterable[ChecksumBlock], log: Optional[WriteLog] = None, *,
+               full: bool = False) -> List[dict]:
+    """
+    Recalcula y escribe (en el lugar) los checksums de `blocks`, en orden: un bloque
+    puede cubrir el valor guardado de uno anterior. Con `log` solo se tocan los
+    bloques que las ops modificaron; sin log (o `full`) se recalculan todos.
+    """
+    full = full or log is None or log.resized
+    out = []
+    for blk in blocks:
+        if blk.end > len(buf) or blk.at + blk.width > len(buf):
+            raise ValueError(f"checksum {blk.name}: fuera del BIN")
+        mask = (1 << (8 * blk.width)) - 1
+        if full:
+            value = _full(buf, blk) & mask
+        else:
+            if not log.ranges_in(blk.start, blk.end):
+                continue
+            # valor del stock: el bloque está cubierto por él antes de las ops
+            old_value = int.from_bytes(log.original(buf, blk.at, blk.at + blk.width), blk.endian)
+            value = _incremental(buf, blk, log, old_value) & mask
+        raw = value.to_bytes(blk.width, blk.endian)
+        if log is not None:
+            log.record(blk.at, bytes(buf[blk.at:blk.at + blk.width]))
+        buf[blk.at:blk.at + blk.width] = raw
+        out.append({"name": blk.name, "algo": blk.algo, "at": blk.at, "value": f"{value:0{2 * blk.width}X}",
+                    "incremental": not full})
+    return out
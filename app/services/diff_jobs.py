@@ -0,0 +1,287 @@
+# app/services/diff_jobs.py
+# diff (sparse o bsdiff) de /admin/diff2patch en un pool de procesos propio (no bloquea el event loop).
+# - admisión por presupuesto de memoria estimada + nº de workers
+# - caché por (sha256 stock, sha256 mod): un par idéntico nunca se vuelve a diffear
+# - estado en DATA_DIR/diff/jobs/<id>.json (pollable desde cualquier worker)
+from __future__ import annotations
+
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+
+from app.services.metrics import observe_stage, register_collector, stats_collector
+from app.services.patch_engine import SPARSE_MAGIC, detect_format, diff_files
+from app.services.storage import DATA_DIR
+
+DIFF_DIR = DATA_DIR / "diff"
+STAGING_DIR = DIFF_DIR / "staging"
+CACHE_DIR = DIFF_DIR / "cache"
+JOBS_DIR = DIFF_DIR / "jobs"
+
+DIFF_WORKERS = int(os.getenv("DIFF_WORKERS", "1"))
+DIFF_MEM_BUDGET = int(os.getenv("DIFF_MEM_MB", "1024")) * 1024 * 1024
+DIFF_QUEUE_MAX = int(os.getenv("DIFF_QUEUE_MAX", "16"))
+DIFF_MAX_ATTEMPTS = 2
+
+# finalize(job, patch_path) -> result: instala el parche y arma la respuesta (en el proceso API)
+Finalize = Callable[[dict, Path], dict]
+
+
+class QueueFull(Exception):
+    pass
+
+
+def estimate_mem(stock_size: int, mod_size: int) -> int:
+    # bsdiff4: arrays de sufijos I y V (int64) sobre el stock + copias de stock/mod/parche.
+    # Es el peor caso: un par del mismo tamaño suele resolverse con sparse (~2x el stock)
+    return 17 * stock_size + 2 * mod_size
+
+
+def cache_path(stock_sha: str, mod_sha: str) -> Path:
+    # el formato (sparse/bsdiff) va en el magic del archivo, no en la extensión
+    return CACHE_DIR / stock_sha[:2] / f"{stock_sha}_{mod_sha}.patch"
+
+
+def _patch_format(path: Path) -> str:
+    try:
+        with open(path, "rb") as f:
+            return detect_format(f.read(len(SPARSE_MAGIC)))
+    except (OSError, ValueError):
+        return "unknown"
+
+
+def new_staging_dir() -> Path:
+    STAGING_DIR.mkdir(parents=True, exist_ok=True)
+    return Path(tempfile.mkdtemp(dir=STAGING_DIR))
+
+
+# -----------------------------
+# job.json
+# -----------------------------
+def _job_path(job_id: str) -> Path:
+    return JOBS_DIR / f"{Path(job_id).name}.json"
+
+
+def load_diff_job(job_id: str) -> Optional[dict]:
+    try:
+        return json.loads(_job_path(job_id).read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _save_diff_job(job: dict) -> None:
+    JOBS_DIR.mkdir(parents=True, exist_ok=True)
+    p = _job_path(job["id"])
+    fd, tmp = tempfile.mkstemp(dir=JOBS_DIR, prefix=".job-")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(job, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, p)
+
+
+# -----------------------------
+# Cola
+# -----------------------------
+class DiffJobQueue:
+    def __init__(self, workers: int = DIFF_WORKERS, mem_budget: int = DIFF_MEM_BUDGET,
+                 max_pending: int = DIFF_QUEUE_MAX):
+        self.workers = max(1, workers)
+        self.mem_budget = mem_budget
+        self.max_pending = max_pending
+
+        self._cv = threading.Condition()
+        self._pending: deque = deque()
+        self._running = 0
+        self._mem_in_use = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_gen = 0
+        self._thread: Optional[threading.Thread] = None
+
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.completed = 0
+        self.failed = 0
+
+    # ---------- pool ----------
+    def _get_pool(self):
+        with self._cv:
+            if self._pool is None:
+                ctx = multiprocessing.get_context(os.getenv("DIFF_MP_START", "spawn"))
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx)
+                self._pool_gen += 1
+            return self._pool, self._pool_gen
+
+    def _reset_pool(self, gen: int) -> None:
+        with self._cv:
+            if self._pool is not None and self._pool_gen == gen:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    # ---------- API ----------
+    def submit(self, meta: dict, stock_path: Path, mod_path: Path, finalize: Finalize) -> Tuple[dict, "Future[dict]"]:
+        """
+        Encola un diff. `meta` debe traer base/mod con sha256 y size_bytes;
+        stock/mod viven en un dir de staging propio (new_staging_dir) que se borra al terminar.
+        Devuelve (job, future): el future (del lado API) resuelve con el job terminado.
+        """
+        stock_sha, mod_sha = meta["base"]["sha256"], meta["mod"]["sha256"]
+        job = {
+            "id": str(uuid.uuid4()),
+            "state": "queued",
+            "cached": False,
+            "attempts": 0,
+            "mem_estimate": estimate_mem(meta["base"]["size_bytes"], meta["mod"]["size_bytes"]),
+            "queued_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "error": None,
+            "meta": meta,
+            "result": None,
+        }
+        done: "Future[dict]" = Future()
+        item = (job, Path(stock_path), Path(mod_path), cache_path(stock_sha, mod_sha), finalize, done)
+
+        # caché: mismo par → sin diff ni pool
+        if item[3].exists():
+            self._complete(item, cached=True)
+            return job, done
+
+        with self._cv:
+            if len(self._pending) >= self.max_pending:
+                raise QueueFull("diff queue full")
+            _save_diff_job(job)
+            self._pending.append(item)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._dispatch_loop, name="diff-jobs", daemon=True)
+                self._thread.start()
+            self._cv.notify()
+        return job, done
+
+    def stats(self) -> dict:
+        with self._cv:
+            lookups = self.cache_hits + self.cache_misses
+            return {
+                "workers": self.workers,
+                "queue_depth": len(self._pending),
+                "running": self._running,
+                "mem_in_use": self._mem_in_use,
+                "mem_budget": self.mem_budget,
+                "completed": self.completed,
+                "failed": self.failed,
+                "cache_hits": self.cache_hits,
+                "cache_misses": self.cache_misses,
+                "cache_hit_rate": round(self.cache_hits / lookups, 4) if lookups else None,
+            }
+
+    # ---------- dispatcher ----------
+    def _admissible(self, cost: int) -> bool:
+        if self._running >= self.workers:
+            return False
+        # un job más grande que el presupuesto corre solo (si no, nunca saldría)
+        return self._running == 0 or self._mem_in_use + cost <= self.mem_budget
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            with self._cv:
+                while not self._pending or not self._admissible(self._pending[0][0]["mem_estimate"]):
+                    self._cv.wait()
+                item = self._pending.popleft()
+
+            job, stock_path, mod_path, out, finalize, done = item
+            # un job idéntico pudo terminar mientras éste esperaba
+            if out.exists():
+                self._complete(item, cached=True)
+                continue
+
+            with self._cv:
+                self._running += 1
+                self._mem_in_use += job["mem_estimate"]
+            job["state"] = "running"
+            job["attempts"] += 1
+            job["started_at"] = time.time()
+            _save_diff_job(job)
+
+            gen = 0
+            try:
+                pool, gen = self._get_pool()
+                fut = pool.submit(diff_files, stock_path, mod_path, out)
+            except Exception as e:
+                self._on_done(item, gen, exc=e)
+                continue
+            fut.add_done_callback(partial(self._on_future, item, gen))
+
+    def _on_future(self, item, gen: int, fut) -> None:
+        try:
+            fut.result()
+        except Exception as e:
+            self._on_done(item, gen, exc=e)
+        else:
+            self._on_done(item, gen)
+
+    def _on_done(self, item, gen: int, exc: Optional[BaseException] = None) -> None:
+        job = item[0]
+        with self._cv:
+            self._running -= 1
+            self._mem_in_use -= job["mem_estimate"]
+            self._cv.notify()
+
+        if isinstance(exc, BrokenProcessPool):
+            self._reset_pool(gen)
+            if job["attempts"] < DIFF_MAX_ATTEMPTS:
+                job.update(state="queued", error="worker crashed, retrying")
+                _save_diff_job(job)
+                with self._cv:
+                    self._pending.appendleft(item)
+                    self._cv.notify()
+                return
+            exc = RuntimeError("worker crashed")
+
+        if exc is not None:
+            self._fail(item, exc)
+        else:
+            # etapa por formato producido: build_patch elige sparse cuando alcanza
+            observe_stage(f"diff_{_patch_format(item[3])}", time.time() - job["started_at"])
+            self._complete(item, cached=False)
+
+    def _complete(self, item, *, cached: bool) -> None:
+        job, stock_path, _, out, finalize, done = item
+        job["cached"] = cached
+        try:
+            result = finalize(job, out)
+        except Exception as e:
+            self._fail(item, e)
+            return
+        job.update(state="done", result=result, error=None, finished_at=time.time())
+        _save_diff_job(job)
+        with self._cv:
+            self.completed += 1
+            if cached:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+        shutil.rmtree(stock_path.parent, ignore_errors=True)
+        done.set_result(job)
+
+    def _fail(self, item, exc: BaseException) -> None:
+        job, stock_path, _, _, _, done = item
+        job.update(state="failed", error=str(exc) or exc.__class__.__name__, finished_at=time.time())
+        _save_diff_job(job)
+        with self._cv:
+            self.failed += 1
+        shutil.rmtree(stock_path.parent, ignore_errors=True)
+        done.set_result(job)
+
+
+DIFF_JOBS = DiffJobQueue()
+register_collector(stats_collector("diff_jobs", DIFF_JOBS.stats,
+                                   counters=("completed", "failed", "cache_hits", "cache_misses")))
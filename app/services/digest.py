@@ -0,0 +1,29 @@
+# app/services/digest.py
+# Huella incremental (sha256 + CRC32/CVN + bytes) calculada mientras se escribe/lee un stream.
+from __future__ import annotations
+
+import hashlib
+import zlib
+
+
+class StreamDigest:
+    def __init__(self) -> None:
+        self._sha = hashlib.sha256()
+        self._crc = 0
+        self.size = 0
+
+    def update(self, chunk) -> None:
+        self._sha.update(chunk)
+        self._crc = zlib.crc32(chunk, self._crc)
+        self.size += len(chunk)
+
+    @property
+    def sha256(self) -> str:
+        return self._sha.hexdigest()
+
+    @property
+    def cvn_crc32(self) -> str:
+        return f"{self._crc & 0xFFFFFFFF:08X}"
+
+    def as_dict(self) -> dict:
+        return {"sha256": self.sha256, "cvn_crc32": self.cvn_crc32, "bytes": self.size}
@@ -0,0 +1,49 @@
+# app/services/dirty_ranges.py
+# Rangos escritos por ops ya aplicadas; permite revalidar solo esas ventanas.
+from __future__ import annotations
+
+from bisect import bisect_left
+from typing import List, Tuple
+
+
+class DirtyRanges:
+    def __init__(self) -> None:
+        self._ranges: List[Tuple[int, int]] = []
+        self._starts: List[int] = []
+        self._ends: List[int] = []
+        self._merged = True
+
+    def __bool__(self) -> bool:
+        return bool(self._ranges)
+
+    def add(self, start: int, end: int) -> None:
+        if end > start:
+            self._ranges.append((start, end))
+            self._merged = False
+
+    def clear(self) -> None:
+        self._ranges = []
+        self._starts = []
+        self._ends = []
+        self._merged = True
+
+    def merged(self) -> List[Tuple[int, int]]:
+        if not self._merged:
+            starts: List[int] = []
+            ends: List[int] = []
+            for s, e in sorted(self._ranges):
+                if ends and s <= ends[-1]:
+                    ends[-1] = max(ends[-1], e)
+                else:
+                    starts.append(s)
+                    ends.append(e)
+            self._ranges = list(zip(starts, ends))
+            self._starts, self._ends = starts, ends
+            self._merged = True
+        return self._ranges
+
+    def touches(self, pos: int, size: int) -> bool:
+        """¿La ventana [pos, pos+size) intersecta algún rango escrito?"""
+        self.merged()
+        j = bisect_left(self._ends, pos + 1)
+        return j < len(self._starts) and self._starts[j] < pos + size
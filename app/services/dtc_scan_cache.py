@@ -0,0 +1,111 @@
+# app/services/dtc_scan_cache.py
+# Resultados de dtc_scanner por sha256 de la imagen, en disco (compartidos entre
+# workers): DATA_DIR/dtc_scan/<sha256[:2]>/<sha256>.json. Al escribir recetas DTC-off
+# se consulta la misma imagen muchas veces; solo el primer pedido la escanea.
+# Resultados de otra SCANNER_VERSION se ignoran (se vuelve a escanear).
+from __future__ import annotations
+
+import json
+import os
+import re
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from app.services.dtc_scanner import SCANNER_VERSION, scan_file
+from app.services.metrics import register_collector, stats_collector
+from app.services.storage import DATA_DIR
+
+DTC_SCAN_DIR = DATA_DIR / "dtc_scan"
+
+_SHA_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def valid_sha256(sha256: str) -> bool:
+    return bool(_SHA_RE.match(sha256 or ""))
+
+
+def _atomic_write(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+class DtcScanCache:
+    def __init__(self, root: Path = DTC_SCAN_DIR):
+        self.root = Path(root)
+        self._lock = threading.Lock()
+        # un lock por sha256 en curso: pedidos simultáneos de la misma imagen escanean una vez
+        self._inflight: Dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.scans = 0
+
+    def path(self, sha256: str) -> Path:
+        return self.root / sha256[:2] / f"{sha256}.json"
+
+    def _read(self, sha256: str) -> Optional[dict]:
+        try:
+            res = json.loads(self.path(sha256).read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return None
+        return res if res.get("scanner") == SCANNER_VERSION else None
+
+    def get(self, sha256: str) -> Optional[dict]:
+        sha256 = sha256.lower()
+        res = self._read(sha256) if valid_sha256(sha256) else None
+        with self._lock:
+            if res is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return res
+
+    def put(self, sha256: str, result: dict) -> None:
+        _atomic_write(self.path(sha256.lower()), json.dumps(result, ensure_ascii=False).encode("utf-8"))
+
+    def scan(self, path, sha256: str) -> Tuple[dict, bool]:
+        """(resultado, cached): escanea `path` (mmap) solo si no hay resultado para su sha256."""
+        sha256 = sha256.lower()
+        if not valid_sha256(sha256):
+            raise ValueError("sha256 inválido")
+        res = self.get(sha256)
+        if res is not None:
+            return res, True
+
+        with self._lock:
+            lock = self._inflight.setdefault(sha256, threading.Lock())
+        try:
+            with lock:
+                # otro pedido pudo terminar el mismo escaneo mientras esperábamos
+                res = self._read(sha256)
+                if res is not None:
+                    return res, True
+                res = dict(scan_file(path), sha256=sha256)
+                self.put(sha256, res)
+                with self._lock:
+                    self.scans += 1
+                return res, False
+        finally:
+            with self._lock:
+                if self._inflight.get(sha256) is lock and not lock.locked():
+                    del self._inflight[sha256]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "scans": self.scans,
+                    "inflight": len(self._inflight)}
+
+
+DTC_SCAN_CACHE = DtcScanCache()
+register_collector(stats_collector("dtc_scan_cache", DTC_SCAN_CACHE.stats, counters=("hits", "misses", "scans")))
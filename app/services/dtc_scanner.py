@@ -0,0 +1,318 @@
+# app/services/dtc_scanner.py
+# Escáner de DTCs sobre el BIN (base de tools/scan_dtc_ascii.py y de /admin/dtc_scan).
+# - ASCII: secuencias tipo "P0301"/"U0100" agrupadas en clusters (< CLUSTER_GAP bytes
+#   entre inicios), con rango de offsets, cantidad y muestras
+# - binario: tablas de códigos u16 (codificación SAE: 2 bits de sistema P/C/B/U,
+#   2 bits del primer dígito, 3 nibbles) en LE y BE, detectadas como corridas de
+#   valores plausibles
+# Recorre el archivo por mmap en ventanas de SCAN_CHUNK con solape: memoria acotada
+# aunque el BIN sea grande. Con NumPy las dos detecciones son comparaciones sobre
+# arrays; sin NumPy caemos a regex / struct (mismo resultado, más lento).
+# Sin efectos al importar (no toca DATA_DIR): lo usa también la CLI. La caché por
+# sha256 de la API está en dtc_scan_cache.py.
+from __future__ import annotations
+
+import mmap
+import os
+import re
+import struct
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from app.services.metrics import observe_stage
+
+try:
+    import numpy as np
+except Exception:  # sin NumPy: regex para ASCII y struct para las tablas
+    np = None
+
+SCANNER_VERSION = 1
+SCAN_CHUNK = int(os.getenv("DTC_SCAN_CHUNK_MB", "4")) * 1024 * 1024
+
+PAT = re.compile(rb"[PBCU][0-9][0-9A-F][0-9A-F][0-9A-F]")  # P0301, U0100, etc. (hex/dec mixto)
+DTC_LEN = 5
+CLUSTER_GAP = 64            # inicios a <= 64 bytes → mismo cluster
+CLUSTER_SAMPLES = 6
+MAX_CLUSTERS = int(os.getenv("DTC_SCAN_MAX_CLUSTERS", "2000"))
+
+# tablas u16: corridas de al menos TABLE_MIN_LEN códigos plausibles, con variedad
+# (los mapas de calibración repiten valores) y sin paso constante (ejes)
+TABLE_MIN_LEN = int(os.getenv("DTC_TABLE_MIN_LEN", "8"))
+TABLE_MIN_DISTINCT = 0.75
+TABLE_SAMPLES = 8
+MAX_TABLES = int(os.getenv("DTC_SCAN_MAX_TABLES", "500"))
+
+_SYSTEMS = "PCBU"
+
+
+def decode_u16(v: int) -> str:
+    """u16 SAE → texto ("P0301", "U0100")."""
+    return f"{_SYSTEMS[v >> 14]}{(v >> 12) & 3}{v & 0xFFF:03X}"
+
+
+def _plausible(v: int) -> bool:
+    # en tablas reales casi todo es P0100..P3999 o U0xxx con dígitos decimales;
+    # aceptar hex o C/B dispararía con cualquier mapa de u16 chicos
+    n2, n1, n0 = (v >> 8) & 0xF, (v >> 4) & 0xF, v & 0xF
+    if n2 > 9 or n1 > 9 or n0 > 9:
+        return False
+    system, first = v >> 14, (v >> 12) & 3
+    if system == 0:
+        return v >= 0x0100
+    if system == 3:
+        return first == 0 and (v & 0xFFF) != 0
+    return False
+
+
+_PLAUSIBLE = bytes(_plausible(v) for v in range(0x10000))
+_PLAUSIBLE_NP = np.frombuffer(_PLAUSIBLE, dtype=np.bool_) if np is not None else None
+
+if np is not None:
+    _DIGIT = np.zeros(256, dtype=np.bool_)
+    _DIGIT[list(b"0123456789")] = True
+    _HEX = _DIGIT.copy()
+    _HEX[list(b"ABCDEF")] = True
+
+
+# -----------------------------
+# Ventanas
+# -----------------------------
+def _windows(size: int, chunk: int, overlap: int) -> Iterator[Tuple[int, int, int]]:
+    """(inicio, fin propio, fin con solape): un match se cuenta en la ventana donde empieza."""
+    start = 0
+    while start < size:
+        own = min(size, start + chunk)
+        yield start, own, min(size, own + overlap)
+        start = own
+
+
+# -----------------------------
+# ASCII
+# -----------------------------
+def _ascii_hits(view, base: int, own: int, pos: int) -> List[int]:
+    """
+    Offsets (absolutos) de secuencias DTC que empiezan en [max(base, pos), own).
+    Puede devolver matches solapados: _Clusters descarta igual que re.finditer.
+    """
+    n = len(view)
+    if n < DTC_LEN:
+        return []
+    if np is None:
+        limit = own - base
+        out = []
+        for m in PAT.finditer(view, max(0, pos - base)):
+            if m.start() >= limit:
+                break
+            out.append(base + m.start())
+        return out
+    a = np.frombuffer(view, dtype=np.uint8)
+    k = n - DTC_LEN + 1
+    # filtro por el primer byte antes de mirar el resto: casi todo queda afuera
+    head = a[:k]
+    cand = np.flatnonzero((head == 0x50) | (head == 0x55) | ((head - np.uint8(0x42)) <= 1))  # P U B C
+    if cand.size == 0:
+        return []
+    ok = _DIGIT[a[cand + 1]]
+    for j in (2, 3, 4):
+        ok &= _HEX[a[cand + j]]
+    hits = cand[ok]
+    hits = hits[hits < own - base]
+    return (hits + base).tolist()
+
+
+class _Clusters:
+    """Agrupado en línea (no guarda todos los matches)."""
+
+    def __init__(self, buf, max_clusters: int) -> None:
+        self.buf = buf
+        self.max_clusters = max_clusters
+        self.items: List[dict] = []
+        self.count = 0
+        self.truncated = False
+        self.next_free = 0
+        self._cur: Optional[dict] = None
+
+    def add(self, off: int) -> None:
+        # sin solapes, como re.finditer ("P0B0123" → solo "P0B01")
+        if off < self.next_free:
+            return
+        self.next_free = off + DTC_LEN
+        self.count += 1
+        cur = self._cur
+        if cur is not None and off - cur["_last"] <= CLUSTER_GAP:
+            cur["_last"] = off
+            cur["count"] += 1
+            if len(cur["samples"]) < CLUSTER_SAMPLES:
+                cur["samples"].append(self._code(off))
+            return
+        self._close()
+        self._cur = {"start": off, "_last": off, "count": 1, "samples": [self._code(off)]}
+
+    def _code(self, off: int) -> str:
+        return bytes(self.buf[off:off + DTC_LEN]).decode("ascii")
+
+    def _close(self) -> None:
+        cur, self._cur = self._cur, None
+        if cur is None:
+            return
+        if len(self.items) >= self.max_clusters:
+            self.truncated = True
+            return
+        cur["end"] = cur.pop("_last") + DTC_LEN
+        self.items.append({"start": cur["start"], "end": cur["end"], "count": cur["count"],
+                           "samples": cur["samples"]})
+
+    def result(self) -> dict:
+        self._close()
+        return {"count": self.count, "clusters": self.items, "truncated": self.truncated}
+
+
+# -----------------------------
+# Tablas u16
+# -----------------------------
+def _mask(view, endian: str):
+    if np is not None:
+        words = np.frombuffer(view, dtype=np.dtype("u2").newbyteorder(endian), count=len(view) // 2)
+        return _PLAUSIBLE_NP[words]
+    fmt = endian + "H"
+    return [_PLAUSIBLE[v] for (v,) in struct.iter_unpack(fmt, view[:len(view) // 2 * 2])]
+
+
+def _runs(mask, min_len: int) -> List[Tuple[int, int]]:
+    """Corridas [i, j) de True con largo >= min_len o que tocan un borde de la ventana."""
+    n = len(mask)
+    if np is not None:
+        # sobre los índices True (pocos) en vez de diff sobre toda la máscara
+        idx = np.flatnonzero(mask)
+        if idx.size == 0:
+            return []
+        breaks = np.flatnonzero(np.diff(idx) != 1)
+        starts = idx[np.concatenate(([0], breaks + 1))]
+        ends = idx[np.concatenate((breaks, [idx.size - 1]))] + 1
+        keep = (ends - starts >= min_len) | (starts == 0) | (ends == n)
+        return list(zip(starts[keep].tolist(), ends[keep].tolist()))
+    out, start = [], None
+    for i, v in enumerate(list(mask) + [False]):
+        if v and start is None:
+            start = i
+        elif not v and start is not None:
+            if i - start >= min_len or start == 0 or i == n:
+                out.append((start, i))
+            start = None
+    return out
+
+
+def _table(buf, start: int, end: int, endian: str) -> Optional[dict]:
+    """Corrida de u16 plausibles [start, end) (bytes) → tabla, o None si parece un mapa/eje."""
+    n = (end - start) // 2
+    if n < TABLE_MIN_LEN:
+        return None
+    values = [v for (v,) in struct.iter_unpack(endian + "H", bytes(buf[start:end]))]
+    distinct = len(set(values))
+    if distinct < TABLE_MIN_DISTINCT * n:
+        return None
+    steps = {b - a for a, b in zip(values, values[1:])}
+    if len(steps) == 1:
+        return None
+    return {
+        "start": start,
+        "end": end,
+        "endian": "le" if endian == "<" else "be",
+        "count": n,
+        "distinct": distinct,
+        "samples": [decode_u16(v) for v in values[:TABLE_SAMPLES]],
+    }
+
+
+class _TableRuns:
+    """Corridas alineadas a 2 bytes por endian, fusionadas entre ventanas."""
+
+    def __init__(self) -> None:
+        self.runs: Dict[str, List[List[int]]] = {"<": [], ">": []}
+
+    def feed(self, view, base: int) -> None:
+        # base par: las ventanas propias miden SCAN_CHUNK (par), sin solape
+        # las corridas cortas solo interesan si pueden seguir en la ventana vecina
+        for endian, runs in self.runs.items():
+            for i, j in _runs(_mask(view, endian), TABLE_MIN_LEN):
+                s, e = base + 2 * i, base + 2 * j
+                if runs and runs[-1][1] == s:
+                    runs[-1][1] = e
+                else:
+                    runs.append([s, e])
+
+    def tables(self, buf, max_tables: int) -> Tuple[List[dict], bool]:
+        out = []
+        for endian, runs in self.runs.items():
+            for s, e in runs:
+                t = _table(buf, s, e, endian)
+                if t is not None:
+                    out.append(t)
+        out.sort(key=lambda t: (t["start"], t["endian"]))
+        # códigos con dígitos chicos también son plausibles con los bytes invertidos:
+        # si la misma zona da tabla en LE y en BE se marcan las dos como ambiguas
+        for t in out:
+            t["ambiguous"] = False
+        last = {"le": None, "be": None}
+        for t in out:
+            other = last["be" if t["endian"] == "le" else "le"]
+            if other is not None and other["end"] > t["start"]:
+                t["ambiguous"] = other["ambiguous"] = True
+            if last[t["endian"]] is None or t["end"] > last[t["endian"]]["end"]:
+                last[t["endian"]] = t
+        return out[:max_tables], len(out) > max_tables
+
+
+# -----------------------------
+# API
+# -----------------------------
+def scan_buffer(buf, *, chunk: int = SCAN_CHUNK, max_clusters: int = MAX_CLUSTERS,
+                max_tables: int = MAX_TABLES) -> dict:
+    """
+    Escanea `buf` (bytes / bytearray / mmap) por ventanas de `chunk` bytes:
+      {"size", "ascii": {"count", "clusters": [{start, end, count, samples}], "truncated"},
+       "tables": [{start, end, endian, count, distinct, samples, ambiguous}], "tables_truncated"}
+    """
+    t0 = time.perf_counter()
+    chunk = max(2, chunk - chunk % 2)
+    size = len(buf)
+    mv = memoryview(buf)
+    clusters = _Clusters(buf, max_clusters)
+    tables = _TableRuns()
+    try:
+        for base, own, stop in _windows(size, chunk, DTC_LEN - 1):
+            view = mv[base:stop]
+            try:
+                for off in _ascii_hits(view, base, own, clusters.next_free):
+                    clusters.add(off)
+                own_view = view[:own - base]
+                try:
+                    tables.feed(own_view, base)
+                finally:
+                    own_view.release()
+            finally:
+                view.release()
+        found, tables_truncated = tables.tables(buf, max_tables)
+    finally:
+        mv.release()
+    observe_stage("dtc_scan", time.perf_counter() - t0)
+    return {
+        "scanner": SCANNER_VERSION,
+        "size": size,
+        "ascii": clusters.result(),
+        "tables": found,
+        "tables_truncated": tables_truncated,
+        "elapsed_ms": round((time.perf_counter() - t0) * 1000, 2),
+    }
+
+
+def scan_file(path, **kw) -> dict:
+    """scan_buffer sobre un mmap del archivo (no se lee entero a memoria)."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return scan_buffer(b"", **kw)
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return scan_buffer(mm, **kw)
+        finally:
+            mm.close()
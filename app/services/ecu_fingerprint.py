@@ -0,0 +1,325 @@
+# app/services/ecu_fingerprint.py
+# Detector de familia / part number / SW en una sola pasada sobre el binario.
+# Todos los marcadores de static/data/ecu_patterns.json y ecu_families.json se
+# compilan en un único autómata (alternancia de regex, los más largos primero);
+# el índice se reconstruye solo si cambia mtime/size de alguno de los dos archivos.
+#
+# Las strings de identificación viven en corridas ASCII ([0-9A-Z._-]); con NumPy se
+# ubican esas corridas con una máscara vectorizada y el autómata corre solo sobre
+# ellas (el padding 0xFF y los mapas de calibración no llegan a la regex).
+# Antes, un prefiltro por anclas: cada marcador tiene un literal de >= 3 bytes, así
+# que alguno de sus pares de bytes cae en offset par; una tabla de 64K pares sobre
+# la vista uint16 del buffer da los pocos puntos de donde se expanden las corridas.
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+import time
+from bisect import bisect_right
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except Exception:  # sin NumPy: las corridas se buscan con una regex (mismo resultado, más lento)
+    np = None
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+DATA_DIR = REPO_ROOT / "static" / "data"
+PATTERNS_FILE = DATA_DIR / "ecu_patterns.json"
+FAMILIES_FILE = DATA_DIR / "ecu_families.json"
+
+# comodín de los marcadores ("0281xxxxxx"): un dígito ASCII
+WILDCARD = "x"
+# corridas más cortas que esto no pueden contener ningún marcador útil
+MIN_RUN = 3
+# tope de matches devueltos (un dump con miles de copias del mismo string)
+MAX_MATCHES = 64
+
+_RUN_CHARS = b"0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ._-"
+# byte → 1 si pertenece a una corrida de identificación (bytes.translate, en C)
+_RUN_TABLE = bytes(1 if c in _RUN_CHARS else 0 for c in range(256))
+_RUN_RE = re.compile(rb"[0-9A-Z._\-]{%d,}" % MIN_RUN)
+_RUN_TAIL = re.compile(rb"[0-9A-Z._\-]*")
+_RUN_SEP = b"\x00"
+# ventana para buscar hacia atrás el inicio de una corrida
+_RUN_BACK = 256
+_DIGITS = frozenset(b"0123456789")
+
+
+@dataclass(frozen=True)
+class Marker:
+    kind: str                   # "family" | "pn" | "sw"
+    template: str               # tal cual en el JSON (con comodines)
+    family: Optional[str]
+    desc: Optional[str] = None
+    # pn/sw del mismo registro de ecu_patterns.json (un SW conocido implica su PN)
+    pn: Optional[str] = None
+    sw: Optional[str] = None
+
+
+def _load_json_docs(path: Path) -> list:
+    """
+    Lee un JSON que puede traer varios arrays concatenados (ecu_patterns.json se
+    editó a mano agregando bloques). Archivo ausente → lista vacía.
+    """
+    try:
+        text = path.read_text(encoding="utf-8-sig")
+    except FileNotFoundError:
+        return []
+    dec = json.JSONDecoder()
+    out: list = []
+    i, n = 0, len(text)
+    while True:
+        while i < n and text[i].isspace():
+            i += 1
+        if i >= n:
+            return out
+        try:
+            doc, i = dec.raw_decode(text, i)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"{path.name} inválido: {e}")
+        out.extend(doc if isinstance(doc, list) else [doc])
+
+
+def _token(template: str) -> bytes:
+    return re.escape(template.encode("ascii")).replace(WILDCARD.encode(), b"[0-9]")
+
+
+def _numeric_edges(template: str) -> Tuple[bool, bool]:
+    # números sueltos: que no sean el pedazo de una cifra más larga
+    return template[:1] in "0123456789" + WILDCARD, template[-1:] in "0123456789" + WILDCARD
+
+
+class FingerprintIndex:
+    """Autómata compilado para una versión de los archivos de patrones."""
+
+    def __init__(self, patterns: Sequence[dict], families: Sequence[str]):
+        markers: Dict[Tuple[str, str], Marker] = {}
+
+        for block in patterns:
+            fam = (block.get("ecu_family") or "").strip() or None
+            for p in block.get("patterns") or []:
+                pn = (p.get("pn") or "").strip() or None
+                sw = (p.get("sw") or "").strip() or None
+                # registros con ambos valores y sin comodines: uno identifica al otro
+                exact = pn and sw and WILDCARD not in pn and WILDCARD not in sw
+                for kind, value in (("sw", sw), ("pn", pn)):
+                    if value and (kind, value) not in markers:
+                        markers[(kind, value)] = Marker(
+                            kind, value, fam, p.get("desc"),
+                            pn=pn if exact else None, sw=sw if exact else None,
+                        )
+
+        for f in families:
+            f = str(f).strip()
+            if f and ("family", f) not in markers:
+                markers[("family", f)] = Marker("family", f, f)
+
+        # más largos primero: en la misma posición gana el marcador más específico
+        # (EDC17C81 antes que EDC17, SW1037527034 antes que 1037527034)
+        self.markers: List[Marker] = sorted(markers.values(), key=lambda m: (-len(m.template), m.kind))
+        self._edges = [_numeric_edges(m.template) for m in self.markers]
+        # alternancia sin grupos de captura ni lookarounds: `re` los recorre ~20x más
+        # lento. El marcador se identifica después (dict por valor exacto o, para los
+        # que tienen comodines, fullmatch) y los bordes numéricos se validan aparte.
+        self._exact: Dict[bytes, int] = {}
+        self._wild: List[Tuple[re.Pattern, int]] = []
+        for i, m in enumerate(self.markers):
+            if WILDCARD in m.template:
+                self._wild.append((re.compile(_token(m.template)), i))
+            else:
+                self._exact.setdefault(m.template.encode("ascii"), i)
+        self.regex = None
+        if self.markers:
+            self.regex = re.compile(b"|".join(b"(?:%s)" % _token(m.template) for m in self.markers))
+        self._pairs = _anchor_pairs(self.markers)
+
+    def _marker_index(self, value: bytes) -> int:
+        i = self._exact.get(value)
+        if i is None:
+            i = next(i for rx, i in self._wild if rx.fullmatch(value))
+        return i
+
+    def scan(self, data) -> List[Tuple[int, Marker, str]]:
+        """(offset, marcador, valor leído) en orden de offset, hasta MAX_MATCHES."""
+        if self.regex is None or not data:
+            return []
+        buf = bytes(data) if not isinstance(data, bytes) else data
+        starts, ends = _ascii_runs(buf) if self._pairs is None else _anchored_runs(buf, self._pairs)
+        if not starts:
+            return []
+        # un solo texto con las corridas separadas por 0x00 → una sola pasada de la regex
+        text = _RUN_SEP.join(buf[s:e] for s, e in zip(starts, ends))
+        bases, pos = [], 0
+        for s, e in zip(starts, ends):
+            bases.append(pos)
+            pos += e - s + 1
+
+        out = []
+        for m in self.regex.finditer(text):
+            i = self._marker_index(m.group())
+            lead, trail = self._edges[i]
+            a, b = m.span()
+            if (lead and a > 0 and text[a - 1] in _DIGITS) or (trail and b < len(text) and text[b] in _DIGITS):
+                continue
+            r = bisect_right(bases, a) - 1
+            out.append((starts[r] + (a - bases[r]), self.markers[i], m.group().decode("ascii")))
+            if len(out) >= MAX_MATCHES:
+                break
+        return out
+
+
+def _ascii_runs(buf: bytes) -> Tuple[List[int], List[int]]:
+    """Corridas [start, end) de bytes [0-9A-Z._-] con largo >= MIN_RUN."""
+    if np is None:
+        spans = [m.span() for m in _RUN_RE.finditer(buf)]
+        return [a for a, _ in spans], [b for _, b in spans]
+    mask = np.frombuffer(buf.translate(_RUN_TABLE), dtype=np.bool_)
+    edges = np.flatnonzero(mask[1:] != mask[:-1]) + 1
+    bounds = np.concatenate(([0], edges, [len(mask)]))
+    # las corridas alternan verdadero/falso empezando por mask[0]
+    first = 0 if mask[0] else 1
+    starts = bounds[first:-1:2]
+    ends = bounds[first + 1::2]
+    keep = (ends - starts) >= MIN_RUN
+    return starts[keep].tolist(), ends[keep].tolist()
+
+
+def _anchor_pairs(markers: Sequence[Marker]):
+    """
+    Tabla uint16 → bool con los pares de bytes del literal más largo de cada marcador.
+    None (se recorren todas las corridas) sin NumPy o si algún literal tiene < 3 bytes.
+    """
+    if np is None or not markers:
+        return None
+    table = np.zeros(1 << 16, dtype=np.bool_)
+    for m in markers:
+        lit = max(m.template.split(WILDCARD), key=len).encode("ascii")
+        if any(c not in _RUN_CHARS for c in m.template.replace(WILDCARD, "0").encode("ascii")):
+            continue  # no cabe en una corrida: nunca matchea
+        if len(lit) < 3:
+            return None
+        for a, b in zip(lit, lit[1:]):
+            table[(a << 8) | b] = True
+    return table
+
+
+def _run_start(buf: bytes, i: int) -> int:
+    while i > 0:
+        lo = max(0, i - _RUN_BACK)
+        k = buf[lo:i].translate(_RUN_TABLE).rfind(b"\x00")
+        if k >= 0:
+            return lo + k + 1
+        i = lo
+    return 0
+
+
+def _anchored_runs(buf: bytes, pairs) -> Tuple[List[int], List[int]]:
+    """Como _ascii_runs, pero solo las corridas que contienen un par de anclas en offset par."""
+    even = np.frombuffer(buf, dtype=">u2", count=len(buf) // 2)
+    starts: List[int] = []
+    ends: List[int] = []
+    end = -1
+    for i in (np.flatnonzero(pairs[even]) * 2).tolist():
+        if i < end:
+            continue  # misma corrida que el ancla anterior
+        a, end = _run_start(buf, i), _RUN_TAIL.match(buf, i).end()
+        if end - a >= MIN_RUN:
+            starts.append(a)
+            ends.append(end)
+    return starts, ends
+
+
+def _resolve(matches: List[Tuple[int, Marker, str]]) -> dict:
+    # familia: la que respaldan los PN/SW conocidos; si no hay, el nombre más específico
+    fam_votes: Dict[str, int] = {}
+    for _, mk, _ in matches:
+        if mk.kind != "family" and mk.family:
+            fam_votes[mk.family] = fam_votes.get(mk.family, 0) + 1
+    family = None
+    if fam_votes:
+        family = max(fam_votes, key=lambda f: (fam_votes[f], len(f)))
+    else:
+        names = [mk.template for _, mk, _ in matches if mk.kind == "family"]
+        if names:
+            family = max(names, key=len)
+
+    def best(kind: str) -> Tuple[Optional[str], Optional[Marker]]:
+        # de la familia elegida > exacto (sin comodines) > menor offset
+        cands = [(off, mk, value) for off, mk, value in matches if mk.kind == kind]
+        if not cands:
+            return None, None
+        _, mk, value = min(cands, key=lambda c: (c[1].family != family, WILDCARD in c[1].template, c[0]))
+        return value, mk
+
+    sw, sw_mk = best("sw")
+    pn, pn_mk = best("pn")
+    # un SW del catálogo fija su PN; le gana a un PN leído solo por comodines
+    if sw_mk is not None and sw_mk.pn and (pn_mk is None or WILDCARD in pn_mk.template):
+        pn = sw_mk.pn
+    if sw is None and pn_mk is not None:
+        sw = pn_mk.sw
+    desc = next((mk.desc for mk in (sw_mk, pn_mk) if mk is not None and mk.desc), None)
+
+    return {
+        "family": family,
+        "part_number": pn,
+        "sw_id": sw,
+        "desc": desc,
+        "matches": [
+            {"kind": mk.kind, "value": value, "family": mk.family, "offset": off}
+            for off, mk, value in matches
+        ],
+    }
+
+
+class FingerprintStore:
+    def __init__(self, patterns_path: Path, families_path: Path):
+        self.paths = (patterns_path, families_path)
+        self._lock = threading.Lock()
+        self._sig: Optional[tuple] = None
+        self._index: Optional[FingerprintIndex] = None
+
+    def _signature(self) -> tuple:
+        sig = []
+        for p in self.paths:
+            try:
+                st = os.stat(p)
+                sig.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                sig.append(None)
+        return tuple(sig)
+
+    def get(self) -> FingerprintIndex:
+        sig = self._signature()
+        index = self._index
+        if index is not None and sig == self._sig:
+            return index
+
+        with self._lock:
+            if self._index is not None and sig == self._sig:
+                return self._index
+            patterns = [b for b in _load_json_docs(self.paths[0]) if isinstance(b, dict)]
+            families = [f for f in _load_json_docs(self.paths[1]) if isinstance(f, str)]
+            self._index = FingerprintIndex(patterns, families)
+            self._sig = sig
+            print(f"[ECU FORGE X] ecu fingerprint index: {len(self._index.markers)} markers")
+            return self._index
+
+
+FINGERPRINTS = FingerprintStore(PATTERNS_FILE, FAMILIES_FILE)
+
+
+def detect_fingerprint(data) -> dict:
+    """
+    Familia, part number y SW del binario + offsets de cada marcador encontrado.
+    Campos en None si no hay evidencia (quien llama decide el fallback).
+    """
+    t0 = time.perf_counter()
+    res = _resolve(FINGERPRINTS.get().scan(data))
+    res["scan_ms"] = round((time.perf_counter() - t0) * 1000, 3)
+    return res
@@ -1,79 +1,222 @@
+# app/services/families.py
+# Registro de familias de static/patches: se carga una vez (nombres en mayúsculas,
+# labels de meta.json, pn/sw de detectors.json, archivos de parche) y se invalida
+# cuando cambia el mtime de PATCH_ROOT, de alguna carpeta de familia o de sus
+# meta.json/detectors.json/checksums.json. La revalidación (stat) corre como mucho cada
+# FAMILIES_RECHECK_S segundos: entre medio, detectar/listar no toca el disco.
 from pathlib import Path
-import json, re
-from typing import Optional, Dict, Any
+import json, os, threading, time
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List, Tuple
+
+from app.services.checksums import ChecksumBlock, parse_blocks
+from app.services.recipe_registry import load_recipe
 
 PATCH_ROOT = Path("static/patches")
+FAMILIES_RECHECK_S = float(os.getenv("FAMILIES_RECHECK_S", "2"))
+
+# heurística por nombre de archivo (en este orden)
+NAME_KEYS = ["EDC","MED","MG1","MD1","DCM","SID","MEVD","ME7"]
+
+
+@dataclass(frozen=True)
+class Family:
+    name: str
+    upper: str
+    label: str
+    engine_default: Optional[str]
+    overrides: Dict[str, Any]
+    detectors: Tuple[str, ...]          # pn/sw de detectors.json, en orden
+    patch_files: Tuple[Path, ...]       # .yml / .sparse / .bsdiff de la carpeta
+    # checksums.json: {"edc17_bosch": [{"algo", "start", "end", "at", ...}, ...], ...}
+    checksums: Dict[str, Tuple[ChecksumBlock, ...]]
+    # mapas que no se pudieron leer → error ("*" = el archivo entero)
+    checksum_errors: Dict[str, str]
+
+
+def _read_json(p: Path, default):
+    try:
+        return json.loads(p.read_text())
+    except FileNotFoundError:
+        return default
+
+
+def _load_checksums(d: Path) -> Tuple[Dict[str, Tuple[ChecksumBlock, ...]], Dict[str, str]]:
+    # un checksums.json roto no tiene que tumbar el registro: el error queda en la
+    # familia y aparece recién cuando una receta pide ese mapa
+    maps: Dict[str, Tuple[ChecksumBlock, ...]] = {}
+    errors: Dict[str, str] = {}
+    try:
+        raw = _read_json(d / "checksums.json", {}) or {}
+        if not isinstance(raw, dict):
+            raise ValueError("se esperaba un objeto {nombre: [bloques]}")
+    except ValueError as e:
+        print(f"[ECU FORGE X] {d.name}/checksums.json inválido: {e}")
+        return maps, {"*": str(e)}
+    for k, v in raw.items():
+        try:
+            maps[k] = parse_blocks(v)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            print(f"[ECU FORGE X] {d.name}/checksums.json: mapa '{k}' inválido: {e!r}")
+            errors[k] = repr(e) if isinstance(e, KeyError) else str(e)
+    return maps, errors
+
+
+def _load_family(d: Path) -> Family:
+    meta = _read_json(d / "meta.json", {}) or {}
+    detectors = []
+    for r in _read_json(d / "detectors.json", []) or []:
+        for k in ("pn", "sw"):
+            if r.get(k):
+                detectors.append(r[k])
+    files = tuple(p for p in d.iterdir() if p.suffix in (".yml", ".sparse", ".bsdiff"))
+    checksums, checksum_errors = _load_checksums(d)
+    return Family(
+        name=d.name,
+        upper=d.name.upper(),
+        label=meta.get("label", d.name),
+        engine_default=meta.get("engine_default"),
+        overrides=meta.get("overrides", {}),
+        detectors=tuple(detectors),
+        patch_files=files,
+        checksums=checksums,
+        checksum_errors=checksum_errors,
+    )
+
+
+class FamilyIndex:
+    """Vista inmutable de PATCH_ROOT en un momento dado."""
+
+    def __init__(self, families: List[Family]):
+        self.families = families
+        self.by_name: Dict[str, Family] = {f.name: f for f in families}
+        self.listing = [
+            {"family": f.name, "label": f.label, "engine_default": f.engine_default} for f in families
+        ]
+        # (familia, pn/sw) en el orden original de búsqueda
+        self.detectors = [(f.name, s) for f in families for s in f.detectors]
+        # clave heurística → primera carpeta que la contiene
+        self.by_key: Dict[str, str] = {}
+        for key in NAME_KEYS:
+            for f in families:
+                if key in f.upper:
+                    self.by_key[key] = f.name
+                    break
+
+
+def _signature(root: Path) -> tuple:
+    try:
+        sig = [os.stat(root).st_mtime_ns]
+        dirs = [e for e in os.scandir(root) if e.is_dir()]
+    except FileNotFoundError:
+        return ()
+    for e in sorted(dirs, key=lambda e: e.name):
+        sig.append((e.name, e.stat().st_mtime_ns))
+        # editar un JSON en el lugar no cambia el mtime de la carpeta
+        for fn in ("meta.json", "detectors.json", "checksums.json"):
+            try:
+                sig.append(os.stat(os.path.join(e.path, fn)).st_mtime_ns)
+            except FileNotFoundError:
+                sig.append(None)
+    return tuple(sig)
+
+
+class FamilyRegistry:
+    def __init__(self, root: Path, recheck_s: float = FAMILIES_RECHECK_S):
+        self.root = root
+        self.recheck_s = recheck_s
+        self._lock = threading.Lock()
+        self._sig: Optional[tuple] = None
+        self._index: Optional[FamilyIndex] = None
+        self._checked_at = 0.0
+
+    def get(self) -> FamilyIndex:
+        index = self._index
+        if index is not None and time.monotonic() - self._checked_at < self.recheck_s:
+            return index
+
+        with self._lock:
+            now = time.monotonic()
+            if self._index is not None and now - self._checked_at < self.recheck_s:
+                return self._index
+            sig = _signature(self.root)
+            if self._index is None or sig != self._sig:
+                families = []
+                if sig:
+                    for d in sorted(self.root.iterdir(), key=lambda p: p.name):
+                        if d.is_dir():
+                            families.append(_load_family(d))
+                self._index = FamilyIndex(families)
+                self._sig = sig
+            self._checked_at = now
+            return self._index
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._index = None
+            self._sig = None
+
+
+FAMILIES = FamilyRegistry(PATCH_ROOT)
+
 
 def list_families() -> list[dict]:
-    out = []
-    for d in PATCH_ROOT.iterdir():
-        if not d.is_dir(): continue
-        meta = d / "meta.json"
-        label = d.name
-        engine = None
-        if meta.exists():
-            m = json.loads(meta.read_text())
-            label = m.get("label", label)
-            engine = m.get("engine_default")
-        out.append({"family": d.name, "label": label, "engine_default": engine})
-    return out
+    return [dict(f) for f in FAMILIES.get().listing]
 
 def detect_family(ecu_type: str|None, filename: str|None, bin_text: str|None) -> Optional[str]:
+    idx = FAMILIES.get()
     # 1) por ecu_type
-    for d in PATCH_ROOT.iterdir():
-        if not d.is_dir(): continue
-        if ecu_type and d.name.upper() in ecu_type.upper():
-            return d.name
+    if ecu_type:
+        ecu_up = ecu_type.upper()
+        for f in idx.families:
+            if f.upper in ecu_up:
+                return f.name
     # 2) por detectors.json
-    for d in PATCH_ROOT.iterdir():
-        if not d.is_dir(): continue
-        det = d / "detectors.json"
-        if not det.exists(): continue
-        arr = json.loads(det.read_text())
-        for r in arr:
-            if r.get("pn") and bin_text and r["pn"] in bin_text:
-                return d.name
-            if r.get("sw") and bin_text and r["sw"] in bin_text:
-                return d.name
+    if bin_text:
+        for name, needle in idx.detectors:
+            if needle in bin_text:
+                return name
     # 3) heurística por nombre archivo
     src = (filename or "").upper()
-    for key in ["EDC","MED","MG1","MD1","DCM","SID","MEVD","ME7"]:
-        if key in src:
+    for key in NAME_KEYS:
+        if key in src and key in idx.by_key:
             # si hay carpeta con ese prefijo, úsala
-            for d in PATCH_ROOT.iterdir():
-                if d.is_dir() and key in d.name.upper():
-                    return d.name
+            return idx.by_key[key]
     return None
 
+def checksum_blocks(family: str, name: str) -> Optional[Tuple[ChecksumBlock, ...]]:
+    """Mapa de bloques `name` de checksums.json de la familia (None si no existe, ValueError si está roto)."""
+    fam = FAMILIES.get().by_name.get(family.upper())
+    if fam is None:
+        return None
+    err = fam.checksum_errors.get(name) or fam.checksum_errors.get("*")
+    if err is not None:
+        raise ValueError(f"checksums.json de {fam.name} inválido ({name}): {err}")
+    return fam.checksums.get(name)
+
 def list_patches_for_family(family: str, brand: str|None=None) -> list[dict]:
-    fam_dir = PATCH_ROOT / family.upper()
-    if not fam_dir.exists(): return []
-    meta_path = fam_dir / "meta.json"
-    overrides: Dict[str, Any] = {}
-    if meta_path.exists():
-        meta = json.loads(meta_path.read_text())
-        overrides = meta.get("overrides", {})
+    fam = FAMILIES.get().by_name.get(family.upper())
+    if fam is None: return []
+    overrides = fam.overrides
     items = []
-    for p in fam_dir.iterdir():
-        if p.suffix in (".yml",".bsdiff"):
-            pid = p.stem
-            label = pid.replace("_"," ").upper()
-            engine = None
-            price = None
-            # si es YAML, lee label/engine
-            if p.suffix == ".yml":
-                try:
-                    import yaml
-                    r = yaml.safe_load(p.read_text(encoding="utf-8"))
-                    label = r.get("label", label)
-                    engine = r.get("engine")
-                except: pass
-            # overrides por marca
-            if brand and brand in overrides:
-                o = overrides[brand]
-                if "rename" in o and pid in o["rename"]:
-                    label = o["rename"][pid]
-                if "price" in o and pid in o["price"]:
-                    price = o["price"][pid]
-            items.append({"id": pid, "label": label, "engine": engine, "price": price})
+    for p in fam.patch_files:
+        pid = p.stem
+        label = pid.replace("_"," ").upper()
+        engine = None
+        price = None
+        # si es YAML, lee label/engine (registro de recetas: cacheado por mtime/size)
+        if p.suffix == ".yml":
+            try:
+                r = load_recipe(p)
+                label = r.get("label", label)
+                engine = r.get("engine")
+            except: pass
+        # overrides por marca
+        if brand and brand in overrides:
+            o = overrides[brand]
+            if "rename" in o and pid in o["rename"]:
+                label = o["rename"][pid]
+            if "price" in o and pid in o["price"]:
+                price = o["price"][pid]
+        items.append({"id": pid, "label": label, "engine": engine, "price": price})
     return sorted(items, key=lambda x: x["label"])
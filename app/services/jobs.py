@@ -0,0 +1,366 @@
+# app/services/jobs.py
+# Cola de jobs de parcheo: create_order encola y responde al instante; un pool de
+# procesos ejecuta apply_patch fuera del threadpool de la API.
+# Estado en orders/<id>/job.json (visible desde cualquier worker de uvicorn):
+# queued → running → done | failed
+# Cada job guarda el proceso dueño ("owner"), que mantiene un flock en
+# DATA_DIR/jobs/owners/<owner>.lock mientras vive: al arrancar, recover_orphans marca
+# como failed los jobs queued/running cuyo dueño ya no existe (la cola está en memoria).
+from __future__ import annotations
+
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from pathlib import Path
+from typing import List, Optional
+
+from app.services.metrics import observe_stage, register_collector, stats_collector
+from app.services.mod_variants import load_manifest, publish
+from app.services.output_cache import OUTPUT_CACHE
+from app.services.storage import DATA_DIR, ORDERS_DIR
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin flock no se puede saber si el dueño sigue vivo
+    fcntl = None
+
+PATCH_WORKERS = int(os.getenv("PATCH_WORKERS", "2"))
+PATCH_QUEUE_MAX = int(os.getenv("PATCH_QUEUE_MAX", "100"))
+PATCH_MAX_ATTEMPTS = int(os.getenv("PATCH_MAX_ATTEMPTS", "2"))
+OWNERS_DIR = DATA_DIR / "jobs" / "owners"
+
+
+class QueueFull(Exception):
+    pass
+
+
+# -----------------------------
+# job.json
+# -----------------------------
+def job_path(order_id: str) -> Path:
+    return ORDERS_DIR / order_id / "job.json"
+
+
+def load_job(order_id: str) -> Optional[dict]:
+    try:
+        with open(job_path(order_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def download_ready(order: dict) -> bool:
+    """Pagada y con el mod del job generado; órdenes sin job (flujos previos) usan su flag."""
+    job = load_job(order.get("id") or "")
+    if job is None:
+        return bool(order.get("download_ready"))
+    return bool(order.get("paid")) and job.get("state") == "done"
+
+
+def save_job(order_id: str, job: dict) -> None:
+    p = job_path(order_id)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=p.parent, prefix=".job-")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(job, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, p)
+
+
+# -----------------------------
+# Trabajo (corre en el proceso hijo)
+# -----------------------------
+def run_patch_job(sha256: str, patch: dict, out_path: str, offsets: Optional[List[int]] = None) -> dict:
+    from fastapi import HTTPException
+    from app.services.analysis_store import ANALYSIS_STORE
+    from app.services.patcher import apply_patch
+
+    t0 = time.perf_counter()
+    data = ANALYSIS_STORE.blob(sha256)
+    if data is None:
+        raise RuntimeError("analysis blob not found")
+    t1 = time.perf_counter()
+    try:
+        # única copia de la orden: el blob (mmap) → un bytearray que las acciones mutan
+        # offsets precalculados en analyze: las acciones escriben sin buscar
+        mod = apply_patch(data, patch, offsets)
+    except HTTPException as e:
+        # HTTPException no viaja bien entre procesos
+        raise RuntimeError(str(e.detail))
+    finally:
+        if hasattr(data, "close"):
+            data.close()
+    t2 = time.perf_counter()
+
+    out = Path(out_path)
+    tmp = out.with_name(out.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(mod)  # directo desde el buffer
+    os.replace(tmp, out)
+    t3 = time.perf_counter()
+    # gzip/zstd + manifest (sha256 → ETag) una sola vez, al generar el mod
+    manifest = publish(out, mod)
+    t4 = time.perf_counter()
+    # las métricas viven en el proceso API: los tiempos viajan en el resultado
+    timings = {"blob_load": t1 - t0, "patch_apply": t2 - t1, "disk_write": t3 - t2, "publish_variants": t4 - t3}
+    return {"bytes": len(mod), "sha256": manifest["sha256"], "timings": timings}
+
+
+# -----------------------------
+# Cola
+# -----------------------------
+class PatchJobQueue:
+    def __init__(self, workers: int = PATCH_WORKERS, max_pending: int = PATCH_QUEUE_MAX,
+                 max_attempts: int = PATCH_MAX_ATTEMPTS):
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+
+        self._cv = threading.Condition()
+        self._pending: deque = deque()
+        self._running = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_gen = 0
+        self._thread: Optional[threading.Thread] = None
+        # dueño de los jobs de este proceso (el lock se toma en el primer submit: los
+        # hijos del pool también importan este módulo)
+        self.owner = uuid.uuid4().hex
+        self._owner_fd: Optional[int] = None
+
+        self.completed = 0
+        self.recovered = 0
+        self.failed = 0
+        self.retried = 0
+        self.run_s_total = 0.0
+        self.run_s_max = 0.0
+
+    # ---------- pool ----------
+    def _new_pool(self) -> ProcessPoolExecutor:
+        ctx = multiprocessing.get_context(os.getenv("PATCH_MP_START", "spawn"))
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx)
+
+    def _get_pool(self):
+        with self._cv:
+            if self._pool is None:
+                self._pool = self._new_pool()
+                self._pool_gen += 1
+            return self._pool, self._pool_gen
+
+    def _reset_pool(self, gen: int) -> None:
+        # un worker murió: el pool queda roto, se recrea una sola vez por generación
+        with self._cv:
+            if self._pool is not None and self._pool_gen == gen:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    # ---------- dueño / huérfanos ----------
+    def _claim_owner(self) -> None:
+        if self._owner_fd is not None or fcntl is None:
+            return
+        OWNERS_DIR.mkdir(parents=True, exist_ok=True)
+        fd = os.open(OWNERS_DIR / f"{self.owner}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._owner_fd = fd
+
+    def _owner_alive(self, owner: Optional[str]) -> bool:
+        if owner == self.owner:
+            return True
+        if not owner:
+            return False    # jobs anteriores a este campo: su proceso ya no está
+        if fcntl is None:
+            return True     # sin flock no hay forma de saberlo: no se toca
+        lock = OWNERS_DIR / f"{owner}.lock"
+        try:
+            fd = os.open(lock, os.O_RDWR)
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+        try:
+            lock.unlink()  # dueño muerto: el lock ya no sirve
+        except FileNotFoundError:
+            pass
+        return False
+
+    def recover_orphans(self) -> int:
+        """Jobs queued/running de procesos que ya no existen → failed. Devuelve cuántos."""
+        recovered = 0
+        alive: dict = {}
+        for p in ORDERS_DIR.glob("*/job.json"):
+            order_id = p.parent.name
+            job = load_job(order_id)
+            if job is None or job.get("state") not in ("queued", "running"):
+                continue
+            owner = job.get("owner")
+            if owner not in alive:
+                alive[owner] = self._owner_alive(owner)
+            if alive[owner]:
+                continue
+            job.update(state="failed", error="interrupted: server restarted before the job finished",
+                       finished_at=time.time())
+            save_job(order_id, job)
+            recovered += 1
+        if recovered:
+            print(f"[ECU FORGE X] patch jobs: {recovered} job(s) huérfanos marcados como failed")
+        with self._cv:
+            self.recovered += recovered
+        return recovered
+
+    # ---------- API ----------
+    def submit(self, order_id: str, sha256: str, patch: dict, out_path: str,
+               cache_key: Optional[str] = None, offsets: Optional[List[int]] = None) -> dict:
+        now = time.time()
+        job = {
+            "order_id": order_id,
+            "state": "queued",
+            "cached": False,
+            "attempts": 0,
+            "queued_at": now,
+            "started_at": None,
+            "finished_at": None,
+            "run_s": None,
+            "error": None,
+            "result": None,
+            "owner": self.owner,
+        }
+        # mismo input + mismo parche + misma receta → mod ya generado, sin pasar por el pool
+        if cache_key and OUTPUT_CACHE.link_into(cache_key, Path(out_path)):
+            manifest = load_manifest(Path(out_path)) or {}
+            job.update(state="done", cached=True, finished_at=now, run_s=0.0,
+                       result={"bytes": os.path.getsize(out_path), "sha256": manifest.get("sha256")})
+            save_job(order_id, job)
+            return job
+
+        with self._cv:
+            if len(self._pending) >= self.max_pending:
+                raise QueueFull("patch queue full")
+            self._claim_owner()
+            save_job(order_id, job)
+            self._pending.append((order_id, sha256, patch, out_path, cache_key, offsets, job))
+            self._ensure_dispatcher()
+            self._cv.notify()
+        return job
+
+    def stats(self) -> dict:
+        with self._cv:
+            done = self.completed + self.failed
+            return {
+                "workers": self.workers,
+                "queue_depth": len(self._pending),
+                "running": self._running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "retried": self.retried,
+                "recovered": self.recovered,
+                "run_s_avg": round(self.run_s_total / done, 4) if done else None,
+                "run_s_max": round(self.run_s_max, 4),
+            }
+
+    # ---------- dispatcher ----------
+    def _ensure_dispatcher(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._dispatch_loop, name="patch-jobs", daemon=True)
+            self._thread.start()
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            with self._cv:
+                while not self._pending or self._running >= self.workers:
+                    self._cv.wait()
+                item = self._pending.popleft()
+                self._running += 1
+
+            order_id, sha256, patch, out_path, cache_key, offsets, job = item
+            job["state"] = "running"
+            job["attempts"] += 1
+            job["started_at"] = time.time()
+            if job["attempts"] == 1:
+                observe_stage("patch_queue_wait", job["started_at"] - job["queued_at"])
+            save_job(order_id, job)
+
+            gen = 0
+            try:
+                pool, gen = self._get_pool()
+                fut = pool.submit(run_patch_job, sha256, patch, out_path, offsets)
+            except Exception as e:
+                self._finish(item, gen, exc=e)
+                continue
+            fut.add_done_callback(partial(self._on_done, item, gen))
+
+    def _on_done(self, item, gen: int, fut) -> None:
+        try:
+            res = fut.result()
+        except Exception as e:
+            self._finish(item, gen, exc=e)
+        else:
+            self._finish(item, gen, result=res)
+
+    def _cache_output(self, item) -> None:
+        # en el proceso API (no en el hijo): la contabilidad de bytes de OUTPUT_CACHE
+        # y su desalojo son de un solo proceso
+        out_path, cache_key = item[3], item[4]
+        if not cache_key:
+            return
+        t0 = time.perf_counter()
+        try:
+            OUTPUT_CACHE.put(cache_key, Path(out_path))
+        except Exception as e:
+            # sin caché el mod igual está listo: no falla el job
+            print(f"[ECU FORGE X] output cache: no se pudo guardar {cache_key[:12]}: {e}")
+        observe_stage("output_cache_put", time.perf_counter() - t0)
+
+    def _finish(self, item, gen: int, *, result: Optional[dict] = None, exc: Optional[BaseException] = None) -> None:
+        order_id, job = item[0], item[-1]
+        now = time.time()
+        run_s = now - (job["started_at"] or now)
+        retry = False
+
+        if exc is None:
+            for name, secs in (result or {}).pop("timings", {}).items():
+                observe_stage(name, secs)
+            self._cache_output(item)
+            job.update(state="done", result=result, error=None)
+        elif isinstance(exc, BrokenProcessPool):
+            self._reset_pool(gen)
+            if job["attempts"] < self.max_attempts:
+                retry = True
+                job.update(state="queued", error="worker crashed, retrying")
+            else:
+                job.update(state="failed", error="worker crashed")
+        else:
+            job.update(state="failed", error=str(exc) or exc.__class__.__name__)
+
+        if not retry:
+            job["finished_at"] = now
+            job["run_s"] = round(run_s, 4)
+            observe_stage("patch_job", run_s)
+        save_job(order_id, job)
+
+        with self._cv:
+            self._running -= 1
+            if retry:
+                self.retried += 1
+                self._pending.appendleft(item)
+            else:
+                self.run_s_total += run_s
+                self.run_s_max = max(self.run_s_max, run_s)
+                if job["state"] == "done":
+                    self.completed += 1
+                else:
+                    self.failed += 1
+            self._cv.notify()
+
+
+PATCH_JOBS = PatchJobQueue()
+register_collector(stats_collector("patch_jobs", PATCH_JOBS.stats, counters=("completed", "failed", "retried", "recovered")))
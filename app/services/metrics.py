@@ -0,0 +1,204 @@
+# app/services/metrics.py
+# Métricas en formato de exposición de Prometheus (text/plain 0.0.4), sin dependencias.
+# - histogramas de latencia por router/ruta (middleware ASGI) y por etapa del pipeline
+# - gauges calculados al momento del scrape (colectores registrados por cada subsistema)
+# Los valores son por proceso: con varios workers de uvicorn cada uno expone los suyos.
+from __future__ import annotations
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# segundos: de 1 ms a 60 s (uploads/bsdiff de varios MB caen en la cola)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# (nombre, help, tipo, [(labels, valor)])
+Sample = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+Collector = Callable[[], Iterable[Sample]]
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # labels → [conteos por bucket (+Inf al final), suma, total]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labelvalues)
+            if s is None:
+                s = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            s[0][i] += 1
+            s[1] += value
+            s[2] += 1
+
+    @contextmanager
+    def time(self, *labelvalues: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, *labelvalues)
+
+    def expose(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(k, list(v[0]), v[1], v[2]) for k, v in self._series.items()]
+        for key, counts, total, n in sorted(series):
+            acc = 0
+            for le, c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                le_label = 'le="%s"' % _fmt_value(le)
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labels, key, le_label)} {acc}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labels, key)} {total!r}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labels, key)} {n}")
+        return out
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._histograms: List[Histogram] = []
+        self._collectors: List[Collector] = []
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        h = Histogram(*args, **kwargs)
+        with self._lock:
+            self._histograms.append(h)
+        return h
+
+    def register_collector(self, fn: Collector) -> None:
+        with self._lock:
+            if fn not in self._collectors:
+                self._collectors.append(fn)
+
+    def expose(self) -> str:
+        lines: List[str] = []
+        for h in list(self._histograms):
+            lines.extend(h.expose())
+        for fn in list(self._collectors):
+            try:
+                samples = list(fn())
+            except Exception as e:  # un colector roto no tumba el scrape
+                print(f"[ECU FORGE X] metrics collector {getattr(fn, '__name__', fn)} falló: {e}")
+                continue
+            for name, help, typ, values in samples:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {typ}")
+                for labels, v in values:
+                    lines.append(f"{name}{_fmt_labels(list(labels), list(labels.values()))} {_fmt_value(v)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = REGISTRY.histogram(
+    "efx_http_request_duration_seconds",
+    "Latencia de requests HTTP por router/ruta (hasta terminar de enviar el body)",
+    labels=("router", "route", "method", "status"),
+)
+STAGE_LATENCY = REGISTRY.histogram(
+    "efx_stage_duration_seconds",
+    "Duración de etapas internas del pipeline (upload, hash, detección, catálogo, parche, escritura)",
+    labels=("stage",),
+)
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    STAGE_LATENCY.observe(seconds, stage)
+
+
+def stage(name: str):
+    """with stage("hash"): ... → observa la duración en efx_stage_duration_seconds."""
+    return STAGE_LATENCY.time(name)
+
+
+def register_collector(fn: Collector) -> None:
+    REGISTRY.register_collector(fn)
+
+
+def stats_collector(prefix: str, fn: Callable[[], dict], *, counters: Sequence[str] = ()) -> Collector:
+    """
+    Colector a partir de un stats() existente: cada valor numérico → efx_<prefix>_<clave>
+    (gauge; las claves en `counters` se exponen como counter con sufijo _total).
+    """
+    def collect() -> Iterable[Sample]:
+        for key, v in fn().items():
+            if isinstance(v, bool) or not isinstance(v, (int, float)):
+                continue
+            if key in counters:
+                yield (f"efx_{prefix}_{key}_total", f"{prefix} {key}", "counter", [({}, v)])
+            else:
+                yield (f"efx_{prefix}_{key}", f"{prefix} {key}", "gauge", [({}, v)])
+    collect.__name__ = f"{prefix}_collector"
+    return collect
+
+
+def render() -> str:
+    return REGISTRY.expose()
+
+
+# -----------------------------
+# Middleware ASGI
+# -----------------------------
+def _route_labels(scope) -> Tuple[str, str]:
+    route = scope.get("route")
+    if route is None:
+        # sin ruta → no usar el path crudo (cardinalidad sin límite)
+        return "unmatched", "unmatched"
+    tags = getattr(route, "tags", None)
+    router = tags[0] if tags else (getattr(route, "name", None) or "app")
+    return str(router), getattr(route, "path", "") or "unmatched"
+
+
+class MetricsMiddleware:
+    """ASGI puro (no BaseHTTPMiddleware): no bufferiza bodies ni rompe streaming/Range."""
+
+    def __init__(self, app, skip_paths: Sequence[str] = ("/metrics",)):
+        self.app = app
+        self.skip_paths = frozenset(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path") in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        status: Optional[int] = None
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            router, route = _route_labels(scope)
+            REQUEST_LATENCY.observe(time.perf_counter() - t0, router, route, scope.get("method", ""),
+                                    str(status or 500))
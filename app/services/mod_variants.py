@@ -0,0 +1,82 @@
+# app/services/mod_variants.py
+# Variantes de descarga de un mod, generadas una sola vez al producirlo:
+#   output.mod.bin.gz / .zst  (las imágenes ECU son casi todo padding 0xFF/0x00 → 3–10x)
+#   output.mod.bin.json       (manifest: sha256 para ETag fuerte, tamaños, variantes)
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Optional
+
+try:
+    import zstandard
+except ImportError:  # opcional: sin zstd se sirve gzip/identity
+    zstandard = None
+
+MANIFEST_SUFFIX = ".json"
+# (content-coding, sufijo), en orden de preferencia
+ENCODINGS = (("zstd", ".zst"), ("gzip", ".gz"))
+SIDECARS = tuple(suffix for _, suffix in ENCODINGS) + (MANIFEST_SUFFIX,)
+
+# solo vale la pena guardar la variante si ahorra al menos esto
+MIN_RATIO = 0.9
+
+
+def _sidecar(mod_path: Path, suffix: str) -> Path:
+    return mod_path.with_name(mod_path.name + suffix)
+
+
+def _compress(encoding: str, data) -> Optional[bytes]:
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return None
+
+
+def _atomic_write(path: Path, data: bytes) -> None:
+    tmp = path.with_name(path.name + f".{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def publish(mod_path: Path, data: Optional[bytes] = None) -> dict:
+    """Escribe variantes comprimidas + manifest junto al mod. Devuelve el manifest."""
+    mod_path = Path(mod_path)
+    if data is None:
+        data = mod_path.read_bytes()
+
+    manifest = {
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "bytes": len(data),
+        "variants": {},
+    }
+    for encoding, suffix in ENCODINGS:
+        comp = _compress(encoding, data)
+        if comp is None or len(comp) > len(data) * MIN_RATIO:
+            continue
+        _atomic_write(_sidecar(mod_path, suffix), comp)
+        manifest["variants"][encoding] = {"suffix": suffix, "bytes": len(comp)}
+
+    _atomic_write(_sidecar(mod_path, MANIFEST_SUFFIX),
+                  json.dumps(manifest, ensure_ascii=False).encode("utf-8"))
+    return manifest
+
+
+def load_manifest(mod_path: Path) -> Optional[dict]:
+    try:
+        return json.loads(_sidecar(Path(mod_path), MANIFEST_SUFFIX).read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def variant_path(mod_path: Path, encoding: str, manifest: dict) -> Optional[Path]:
+    v = (manifest.get("variants") or {}).get(encoding)
+    if not v:
+        return None
+    p = _sidecar(Path(mod_path), v["suffix"])
+    return p if p.exists() else None
@@ -0,0 +1,189 @@
+# app/services/multi_pattern.py
+# Búsqueda multi-patrón en una sola pasada para ops find_hex / patch.
+from __future__ import annotations
+
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from app.services.dirty_ranges import DirtyRanges
+
+try:
+    import numpy as np
+except Exception:  # sin NumPy: un find por patrón (mismo resultado)
+    np = None
+
+OnWrite = Callable[[int, int], None]
+
+# con pocos patrones, N búsquedas `find` en C siguen siendo más rápidas que el barrido
+# (tools/bench: multi_pattern.scalar_N vs multi_pattern.sweep_N; en 8M el barrido
+# cuesta lo mismo que ~6 finds: empata en 6 patrones y gana de ahí en adelante)
+VECTOR_MIN_PATTERNS = 6
+# paso del muestreo de 2-gramas para elegir el ancla más rara de cada patrón
+HIST_STRIDE = 7
+
+
+def _find_scalar(buf, pat: bytes, start: int = 0, end: Optional[int] = None) -> List[int]:
+    """Todas las ocurrencias (incluso solapadas) de `pat` dentro de buf[start:end]."""
+    out = []
+    if not pat:
+        return out
+    end = len(buf) if end is None else min(end, len(buf))
+    i = buf.find(pat, max(0, start), end)
+    while i != -1:
+        out.append(i)
+        i = buf.find(pat, i + 1, end)
+    return out
+
+
+class PatternSet:
+    """
+    Autómata de q-gramas compilado una vez por receta.
+
+    Un único barrido vectorizado sobre las vistas uint16 (offsets pares e impares,
+    sin copiar) marca los 2-gramas ancla; cada patrón se ancla en su 2-grama más
+    raro (histograma de una muestra del buffer), de modo que el padding 0xFF/0x00
+    no dispara candidatos. Los candidatos se
+    verifican byte a byte como arrays. Devuelve todas las ocurrencias, incluidas
+    las solapadas; la selección (greedy / count) la hace quien llama.
+    """
+
+    def __init__(self, patterns: Sequence[bytes]):
+        self.patterns: List[bytes] = []
+        self._index: Dict[bytes, int] = {}
+        self.slots: List[int] = []          # op -> patrón único
+        for p in patterns:
+            p = bytes(p)
+            if p not in self._index:
+                self._index[p] = len(self.patterns)
+                self.patterns.append(p)
+            self.slots.append(self._index[p])
+
+    def find_all(self, buf) -> List[List[int]]:
+        """Ocurrencias por op (en el orden de construcción), ordenadas por offset."""
+        uniq = self._find_unique(buf)
+        return [uniq[s] for s in self.slots]
+
+    def _find_unique(self, buf) -> List[List[int]]:
+        n = len(buf)
+        if np is None or n < 2 or len(self.patterns) < VECTOR_MIN_PATTERNS:
+            return [_find_scalar(buf, p) for p in self.patterns]
+        return self._sweep(buf)
+
+    def _sweep(self, buf) -> List[List[int]]:
+        n = len(buf)
+        arr = np.frombuffer(buf, dtype=np.uint8)
+        out: List[List[int]] = [[] for _ in self.patterns]
+
+        multi = [(pi, p) for pi, p in enumerate(self.patterns) if 2 <= len(p) <= n]
+        for pi, p in enumerate(self.patterns):
+            if len(p) == 1:
+                out[pi] = np.flatnonzero(arr == p[0]).tolist()
+
+        if multi:
+            even = np.frombuffer(buf, dtype=">u2", count=n // 2)
+            odd = np.frombuffer(buf, dtype=">u2", offset=1, count=(n - 1) // 2)
+            hist = np.bincount(even[::HIST_STRIDE], minlength=65536)
+            anchors: Dict[int, List[Tuple[int, int]]] = {}
+            for pi, p in multi:
+                k = min(range(len(p) - 1), key=lambda k: hist[(p[k] << 8) | p[k + 1]])
+                anchors.setdefault((p[k] << 8) | p[k + 1], []).append((pi, k))
+
+            table = np.zeros(65536, dtype=bool)
+            table[list(anchors)] = True
+            cand = np.concatenate((np.flatnonzero(table[even]) * 2, np.flatnonzero(table[odd]) * 2 + 1))
+            cand.sort()
+            cand_keys = (arr[cand].astype(np.uint16) << 8) | arr[cand + 1]
+            del even, odd
+
+            for gram, items in anchors.items():
+                pos = cand[cand_keys == gram] if len(anchors) > 1 else cand
+                for pi, k in items:
+                    p = self.patterns[pi]
+                    s = pos - k
+                    s = s[(s >= 0) & (s <= n - len(p))]
+                    for j, b in enumerate(p):
+                        if not s.size:
+                            break
+                        if j != k and j != k + 1:
+                            s = s[arr[s + j] == b]
+                    out[pi] = s.tolist()
+        del arr
+        return out
+
+    def find_in(self, buf, slot: int, start: int, end: int) -> List[int]:
+        return _find_scalar(buf, self.patterns[slot], start, end)
+
+
+class FusedHexSearch:
+    """
+    Pre-escaneo fusionado de todas las ops hex de una receta (misma idea que
+    FusedNumberSearch): una pasada al pedir la primera op, y luego solo se
+    revalidan las ventanas tocadas por ops anteriores. Las ocurrencias que una
+    op anterior pisó o creó quedan en `overlaps` como (op, offset).
+    """
+
+    def __init__(self, patterns: Sequence[bytes]):
+        self.patterns = PatternSet(patterns)
+        self._hits: List[List[int]] = [[] for _ in self.patterns.slots]
+        self.dirty = DirtyRanges()
+        self.overlaps: List[Tuple[int, int]] = []
+        self._stale = True
+
+    def mark(self, start: int, end: int) -> None:
+        self.dirty.add(start, end)
+
+    def invalidate(self) -> None:
+        self._stale = True
+
+    def occurrences(self, qi: int, buf) -> List[int]:
+        if self._stale:
+            self._hits = self.patterns.find_all(buf)
+            self.dirty.clear()
+            self._stale = False
+
+        base = self._hits[qi]
+        if not self.dirty:
+            return base
+
+        slot = self.patterns.slots[qi]
+        L = len(self.patterns.patterns[slot])
+        keep, touched = [], set()
+        for h in base:
+            if self.dirty.touches(h, L):
+                touched.add(h)
+            else:
+                keep.append(h)
+        fresh = set()
+        for s, e in self.dirty.merged():
+            fresh.update(self.patterns.find_in(buf, slot, s - L + 1, e + L - 1))
+        # solape = ocurrencia que desapareció o que apareció; las que siguen igual no cuentan
+        self.overlaps.extend((qi, h) for h in sorted(touched ^ fresh))
+        return sorted(fresh.union(keep))
+
+    def overlap_report(self, op_index: Sequence[int]) -> List[dict]:
+        """overlaps como [{"op": índice de la op en la receta, "offset"}] (op_index: qi → índice)."""
+        return [{"op": op_index[qi], "offset": off} for qi, off in self.overlaps]
+
+
+def replace_occurrences(buf, occ: Sequence[int], find_len: int, repl: bytes, *,
+                        limit: Optional[int] = None, on_write: Optional[OnWrite] = None) -> int:
+    """
+    Reemplaza en orden de offset, sin solapes dentro de la misma op (el siguiente
+    match se busca después del reemplazo, igual que el bucle `find` clásico).
+    Soporta reemplazos de otro largo desplazando los offsets siguientes.
+    """
+    cnt = 0
+    delta = 0
+    nxt = 0
+    for s in occ:
+        if s < nxt:
+            continue
+        if limit is not None and cnt >= limit:
+            break
+        j = s + delta
+        buf[j:j + find_len] = repl
+        if on_write is not None:
+            on_write(j, j + len(repl))
+        delta += len(repl) - find_len
+        nxt = s + find_len
+        cnt += 1
+    return cnt
@@ -0,0 +1,207 @@
+# app/services/numeric_search.py
+# Búsqueda numérica vectorizada para ops `value_find`: vistas tipadas (u8…f64, LE/BE,
+# cada fase de alineación) sobre el buffer y comparación tol/scale como arrays.
+from __future__ import annotations
+
+import struct
+from dataclasses import dataclass
+from math import gcd
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.services.dirty_ranges import DirtyRanges
+
+try:
+    import numpy as np
+except Exception:  # sin NumPy caemos al escaneo escalar (mismo resultado, más lento)
+    np = None
+
+SIZE_MAP = {"u8": 1, "i8": 1, "u16": 2, "i16": 2, "u32": 4, "i32": 4, "f32": 4, "f64": 8}
+_STRUCT_CODE = {"u8": "B", "i8": "b", "u16": "H", "i16": "h", "u32": "I", "i32": "i", "f32": "f", "f64": "d"}
+_DTYPE_CODE = {"u8": "u1", "i8": "i1", "u16": "u2", "i16": "i2", "u32": "u4", "i32": "i4", "f32": "f4", "f64": "f8"}
+# elementos por bloque: los temporales (máscaras, astype a f64) quedan acotados a
+# unos pocos MB aunque el buffer sea un mmap de cientos de MB
+SCAN_WINDOW = 4 * 1024 * 1024
+
+_INT_RANGE = {
+    "u8": (0, 0xFF), "i8": (-0x80, 0x7F),
+    "u16": (0, 0xFFFF), "i16": (-0x8000, 0x7FFF),
+    "u32": (0, 0xFFFFFFFF), "i32": (-0x80000000, 0x7FFFFFFF),
+}
+
+
+@dataclass(frozen=True)
+class NumberQuery:
+    """Consulta numérica ya normalizada (valor escalado, endian resuelto)."""
+    kind: str
+    endian: str                 # "<" o ">"
+    target: float               # valor * scale
+    tol: float
+    align: Optional[int] = None
+
+    @classmethod
+    def build(cls, kind: str, target: float, *, endian: str = "le", tol=0,
+              align=None, scale=None) -> "NumberQuery":
+        k = kind.lower()
+        if k not in SIZE_MAP:
+            raise ValueError(f"tipo no soportado: {kind}")
+        e = "<" if endian.lower().startswith("le") else ">"
+        target_eff = target * float(scale) if scale not in (None, 1) else target
+        return cls(kind=k, endian=e, target=target_eff, tol=tol or 0, align=align or None)
+
+    @property
+    def size(self) -> int:
+        return SIZE_MAP[self.kind]
+
+    @property
+    def is_float(self) -> bool:
+        return self.kind in ("f32", "f64")
+
+    @property
+    def int_bounds(self) -> Tuple[int, int]:
+        return int(self.target - self.tol), int(self.target + self.tol)
+
+    def value_at(self, buf, i: int):
+        return struct.unpack_from(self.endian + _STRUCT_CODE[self.kind], buf, i)[0]
+
+    def accepts(self, val) -> bool:
+        if self.is_float:
+            return abs(float(val) - float(self.target)) <= float(self.tol)
+        lo, hi = self.int_bounds
+        return lo <= int(val) <= hi
+
+
+def pack_number(kind: str, value: float, endian: str = "le") -> bytes:
+    """Empaqueta número según tipo/endian."""
+    e = "<" if endian.lower().startswith("le") else ">"
+    k = kind.lower()
+    if   k == "u8":  return struct.pack("B", int(value) & 0xFF)
+    elif k == "i8":  return struct.pack("b", int(value))
+    elif k == "u16": return struct.pack(e+"H", int(value) & 0xFFFF)
+    elif k == "i16": return struct.pack(e+"h", int(value))
+    elif k == "u32": return struct.pack(e+"I", int(value) & 0xFFFFFFFF)
+    elif k == "i32": return struct.pack(e+"i", int(value))
+    elif k == "f32": return struct.pack(e+"f", float(value))
+    elif k == "f64": return struct.pack(e+"d", float(value))
+    else:
+        raise ValueError(f"tipo numérico no soportado: {kind}")
+
+
+def scan_scalar(buf, q: NumberQuery, start: int = 0, stop: Optional[int] = None) -> List[int]:
+    """Escaneo byte a byte (referencia). `stop` es el último offset inclusive."""
+    limit = len(buf) - q.size
+    if stop is None or stop > limit:
+        stop = limit
+    hits = []
+    for i in range(max(0, start), stop + 1):
+        if q.align and (i % q.align) != 0:
+            continue
+        if q.accepts(q.value_at(buf, i)):
+            hits.append(i)
+    return hits
+
+
+def _mask(view, q: NumberQuery):
+    if q.is_float:
+        with np.errstate(invalid="ignore", over="ignore"):
+            return np.abs(view.astype(np.float64) - float(q.target)) <= float(q.tol)
+    lo, hi = q.int_bounds
+    dmin, dmax = _INT_RANGE[q.kind]
+    if lo > dmax or hi < dmin:
+        return None
+    lo, hi = max(lo, dmin), min(hi, dmax)
+    if lo == hi:
+        return view == lo
+    return (view >= lo) & (view <= hi)
+
+
+def find_numbers(buf, queries: Sequence[NumberQuery]) -> List[List[int]]:
+    """
+    Resuelve todas las consultas en una pasada: cada vista tipada (dtype+endian+fase)
+    se construye una sola vez y se evalúa contra todas las consultas que la usan.
+    Devuelve, por consulta, la lista ordenada de offsets (idéntica a `scan_scalar`).
+    """
+    if np is None:
+        return [scan_scalar(buf, q) for q in queries]
+
+    n = len(buf)
+    groups: Dict[str, List[int]] = {}
+    for qi, q in enumerate(queries):
+        groups.setdefault(q.endian + _DTYPE_CODE[q.kind], []).append(qi)
+
+    found: List[List] = [[] for _ in queries]
+    for dtype, idxs in groups.items():
+        sz = queries[idxs[0]].size
+        for phase in range(sz):
+            count = (n - phase) // sz
+            if count <= 0:
+                break
+            # fases incompatibles con el align de la consulta no pueden tener hits
+            wanted = [qi for qi in idxs
+                      if not queries[qi].align or phase % gcd(sz, queries[qi].align) == 0]
+            if not wanted:
+                continue
+            step = max(1, SCAN_WINDOW // sz)
+            for first in range(0, count, step):
+                base = phase + first * sz
+                view = np.frombuffer(buf, dtype=dtype, count=min(step, count - first), offset=base)
+                for qi in wanted:
+                    m = _mask(view, queries[qi])
+                    if m is None:
+                        continue
+                    offs = np.flatnonzero(m) * sz + base
+                    if queries[qi].align:
+                        offs = offs[offs % queries[qi].align == 0]
+                    if offs.size:
+                        found[qi].append(offs)
+                del view
+
+    out = []
+    for parts in found:
+        if not parts:
+            out.append([])
+            continue
+        offs = np.sort(np.concatenate(parts)) if len(parts) > 1 else parts[0]
+        out.append(offs.tolist())
+    return out
+
+
+class FusedNumberSearch:
+    """
+    Pre-escaneo fusionado de todas las ops numéricas de una receta.
+
+    Las ops se siguen aplicando en orden: las escrituras previas se registran con
+    `mark()` y al pedir los hits de una op se revalidan solo las ventanas tocadas.
+    Si el buffer cambia de largo (reemplazo hex de distinto tamaño) hay que llamar
+    `invalidate()` y las consultas restantes se re-escanean en una pasada.
+    """
+
+    def __init__(self, queries: Sequence[NumberQuery]):
+        self.queries = list(queries)
+        self._hits: List[List[int]] = [[] for _ in self.queries]
+        self.dirty = DirtyRanges()
+        self._stale = True
+
+    def mark(self, start: int, end: int) -> None:
+        self.dirty.add(start, end)
+
+    def invalidate(self) -> None:
+        self._stale = True
+
+    def hits(self, qi: int, buf) -> List[int]:
+        if self._stale:
+            res = find_numbers(buf, self.queries[qi:])
+            self._hits[qi:] = res
+            self.dirty.clear()
+            self._stale = False
+
+        base = self._hits[qi]
+        if not self.dirty:
+            return base
+
+        q = self.queries[qi]
+        sz = q.size
+        keep = [h for h in base if not self.dirty.touches(h, sz)]
+        fresh = []
+        for s, e in self.dirty.merged():
+            fresh.extend(scan_scalar(buf, q, s - sz + 1, e - 1))
+        return sorted(set(keep).union(fresh))
@@ -0,0 +1,175 @@
+# app/services/output_cache.py
+# Caché de mods direccionada por contenido: (sha256 de entrada, patch id, hash de la receta).
+# - blobs en DATA_DIR/mods/<key[:2]>/<key>.bin, compartidos entre workers/procesos
+# - hit → hardlink al dir de la orden (sin pasar por el motor de parches)
+# - tope en bytes con desalojo por antigüedad de uso (mtime se renueva en cada hit)
+# - las variantes de descarga (.gz/.zst/.json, ver mod_variants) viajan con el blob
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Optional
+
+from app.services.metrics import register_collector, stats_collector
+from app.services.mod_variants import SIDECARS
+from app.services.recipe_registry import load_recipe
+from app.services.storage import DATA_DIR
+
+OUTPUT_DIR = DATA_DIR / "mods"
+OUTPUT_CACHE_BYTES = int(os.getenv("OUTPUT_CACHE_MB", "2048")) * 1024 * 1024
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+
+
+def recipe_version(patch_def: dict) -> str:
+    """Hash de lo que ejecuta el motor: la definición del parche + el YAML que referencia (si existe)."""
+    h = hashlib.sha256(json.dumps(patch_def, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+    yml = (patch_def.get("files") or {}).get("yml")
+    if yml:
+        p = REPO_ROOT / str(yml).lstrip("/")
+        if p.is_file():
+            h.update(load_recipe(p).digest.encode("ascii"))
+    return h.hexdigest()
+
+
+def output_key(input_sha256: str, patch_def: dict) -> str:
+    raw = f"{input_sha256}:{patch_def.get('id')}:{recipe_version(patch_def)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _sidecar(p: Path, suffix: str) -> Path:
+    return p.with_name(p.name + suffix)
+
+
+def _link_or_copy(src: Path, dst: Path) -> None:
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(dst.name + f".{os.getpid()}.lnk")
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)  # otro filesystem / sin hardlinks
+    os.replace(tmp, dst)
+
+
+class OutputCache:
+    def __init__(self, root: Path, *, max_bytes: int = OUTPUT_CACHE_BYTES):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._total: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.bin"
+
+    def _entries(self):
+        out = []
+        for p in self.root.glob("*/*.bin"):
+            try:
+                mtime = p.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            out.append((mtime, self._entry_size(p), p))
+        return out
+
+    def _entry_size(self, p: Path) -> int:
+        size = 0
+        for q in (p, *(_sidecar(p, s) for s in SIDECARS)):
+            try:
+                size += q.stat().st_size
+            except FileNotFoundError:
+                pass
+        return size
+
+    @staticmethod
+    def _link_sidecars(src: Path, dst: Path) -> None:
+        for suffix in SIDECARS:
+            try:
+                _link_or_copy(_sidecar(src, suffix), _sidecar(dst, suffix))
+            except FileNotFoundError:
+                continue
+
+    def link_into(self, key: str, dest: Path) -> bool:
+        """Hit: enlaza el mod cacheado en `dest` y devuelve True. Miss: False."""
+        p = self.path(key)
+        try:
+            _link_or_copy(p, dest)
+            self._link_sidecars(p, dest)
+            os.utime(p)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def put(self, key: str, src: Path) -> None:
+        """Registra un mod recién generado (hardlink, sin copiar bytes) y aplica el tope."""
+        p = self.path(key)
+        if p.exists():
+            return
+        # sidecars primero: cuando aparece el .bin la entrada ya está completa
+        self._link_sidecars(Path(src), p)
+        _link_or_copy(Path(src), p)
+        with self._lock:
+            if self._total is not None:
+                self._total += self._entry_size(p)
+        self._evict()
+
+    def _evict(self) -> None:
+        with self._lock:
+            if self._total is not None and self._total <= self.max_bytes:
+                return
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            if total > self.max_bytes:
+                # más viejos primero; el dir de la orden conserva su propio link
+                for _, size, p in sorted(entries, key=lambda e: e[0]):
+                    try:
+                        p.unlink()
+                    except FileNotFoundError:
+                        continue
+                    for suffix in SIDECARS:
+                        try:
+                            _sidecar(p, suffix).unlink()
+                        except FileNotFoundError:
+                            pass
+                    total -= size
+                    self.evictions += 1
+                    if total <= self.max_bytes:
+                        break
+            self._total = total
+
+    def counters(self) -> dict:
+        """Contadores en memoria, sin recorrer el disco (para /metrics).
+        put/desalojo corren en el proceso API (jobs._finish), así que evictions es de acá."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "max_bytes": self.max_bytes}
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            entries = self._entries()
+            return {
+                "entries": len(entries),
+                "bytes": sum(size for _, size, _ in entries),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+OUTPUT_CACHE = OutputCache(OUTPUT_DIR)
+register_collector(stats_collector("output_cache", OUTPUT_CACHE.counters, counters=("hits", "misses", "evictions")))
@@ -0,0 +1,96 @@
+# app/services/password_hasher.py
+# bcrypt fuera del event loop y fuera del threadpool compartido de la API: un
+# executor propio con N hilos (bcrypt libera el GIL) y un tope de pedidos en vuelo.
+# Una ráfaga de logins hace cola acá (o recibe 503) en vez de ocupar los hilos que
+# usan las descargas y las órdenes.
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Tuple
+
+from passlib.context import CryptContext
+
+from app.services.metrics import observe_stage, register_collector, stats_collector
+
+AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", "2"))
+# en vuelo = corriendo + esperando; por encima se rechaza (503) en vez de encolar sin fin
+AUTH_HASH_QUEUE_MAX = int(os.getenv("AUTH_HASH_QUEUE_MAX", "64"))
+
+
+class HasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self, workers: int = AUTH_HASH_WORKERS, max_pending: int = AUTH_HASH_QUEUE_MAX):
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_s_total = 0.0
+        self.hash_s_total = 0.0
+
+    async def _run(self, op: str, fn: Callable, *args) -> Tuple[object, dict]:
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HasherBusy("password hasher busy")
+            self.pending += 1
+
+        submitted = time.perf_counter()
+
+        def job():
+            started = time.perf_counter()
+            res = fn(*args)
+            return res, started - submitted, time.perf_counter() - started
+
+        try:
+            res, wait_s, hash_s = await asyncio.wrap_future(self._pool.submit(job))
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+        observe_stage("auth_hash_wait", wait_s)
+        observe_stage(f"auth_{op}", hash_s)
+        with self._lock:
+            self.completed += 1
+            self.wait_s_total += wait_s
+            self.hash_s_total += hash_s
+        return res, {"hash_wait": wait_s, op: hash_s}
+
+    async def hash(self, password: str) -> Tuple[str, dict]:
+        """(hash bcrypt, tiempos {"hash_wait", "hash"} en segundos)."""
+        return await self._run("hash", self.ctx.hash, password)
+
+    async def verify(self, password: str, password_hash: str) -> Tuple[bool, dict]:
+        """(¿coincide?, tiempos {"hash_wait", "verify"} en segundos)."""
+        return await self._run("verify", self.ctx.verify, password, password_hash)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "pending": self.pending,
+                "max_pending": self.max_pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "wait_s_avg": round(self.wait_s_total / self.completed, 4) if self.completed else None,
+                "hash_s_avg": round(self.hash_s_total / self.completed, 4) if self.completed else None,
+            }
+
+
+HASHER = PasswordHasher()
+register_collector(stats_collector("auth_hasher", HASHER.stats, counters=("completed", "rejected")))
+
+
+def server_timing(timings: dict) -> str:
+    """Header Server-Timing (ms) con la espera en cola y el tiempo de bcrypt."""
+    return ", ".join(f"{k};dur={v * 1000:.1f}" for k, v in timings.items())
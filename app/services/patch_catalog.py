@@ -1,7 +1,8 @@
 # app/services/patch_catalog.py
 from pathlib import Path
-from typing import List, Dict, Any, Optional
-import yaml
+from typing import List, Dict, Any, Mapping, Optional
+
+from app.services.recipe_registry import load_recipe
 
 PATCHES_ROOT = Path("static/patches")
 
@@ -10,7 +11,7 @@ def _to_usd(price_like: Any) -> Optional[float]:
         return None
     if isinstance(price_like, (int, float)):
         return float(price_like)
-    if isinstance(price_like, dict):
+    if isinstance(price_like, Mapping):
         if "USD" in price_like and price_like["USD"] is not None:
             try:
                 return float(price_like["USD"])
@@ -31,8 +32,7 @@ def list_recipes_for_family(family: str, engine: str = "auto") -> Dict[str, Any]
 
     for yml in sorted(folder.glob("*.yml")):
         try:
-            with yml.open("r", encoding="utf-8") as fh:
-                data = yaml.safe_load(fh) or {}
+            data = load_recipe(yml)
         except Exception:
             continue
 
@@ -1,28 +1,206 @@
 import hashlib
+import os
+import shutil
+import struct
 import bsdiff4
 from pathlib import Path
 
+try:
+    import numpy as np
+except Exception:  # sin NumPy el diff sparse compara por bloques en Python (mismo resultado, más lento)
+    np = None
+
+# -----------------------------
+# Formatos de parche
+# -----------------------------
+# bsdiff: cualquier par de archivos. sparse: solo stock/mod del mismo tamaño (lo típico
+# en un tuning): lista de corridas (offset, bytes viejos, bytes nuevos). Crear y aplicar
+# un sparse es ~O(bytes cambiados); al aplicar se verifican los bytes viejos de cada
+# corrida en vez de hashear el stock entero.
+#
+# patch.sparse:
+#   cabecera  "EFXSPRS1" | base_size u64 | n_runs u32 | sha256(corridas) | sha256(mod)
+#   corridas  offset u64 | len u32 | old[len] | new[len]     (little endian)
+PATCH_FORMATS = ("sparse", "bsdiff")
+PATCH_FILES = {"sparse": "patch.sparse", "bsdiff": "patch.bsdiff"}
+
+SPARSE_MAGIC = b"EFXSPRS1"
+BSDIFF_MAGIC = b"BSDIFF40"
+_SPARSE_HEADER = struct.Struct("<8sQI32s32s")
+_SPARSE_RUN = struct.Struct("<QI")
+# dos corridas separadas por <= 6 bytes iguales se funden: repetir 2*6 bytes sale
+# igual que la cabecera (12 bytes) de una corrida nueva
+SPARSE_MERGE_GAP = _SPARSE_RUN.size // 2
+# por debajo de este tamaño el sparse se queda sin correr bsdiff (la diferencia de
+# tamaño no paga segundos de CPU y ~17x el stock en RAM); por encima se corren ambos
+# y se guarda el más chico
+SPARSE_PREFER_BYTES = int(os.getenv("SPARSE_PREFER_KB", "64")) * 1024
+# bloque de comparación: acota los temporales (máscara bool) con binarios grandes
+_DIFF_WINDOW = 4 * 1024 * 1024
+
 def sha256(data: bytes) -> str:
     return hashlib.sha256(data).hexdigest()
 
-def create_patch(stock: bytes, mod: bytes, out_dir: Path) -> dict:
+def detect_format(head: bytes) -> str:
+    """Formato de un parche por sus primeros bytes."""
+    if head.startswith(SPARSE_MAGIC):
+        return "sparse"
+    if head.startswith(BSDIFF_MAGIC):
+        return "bsdiff"
+    raise ValueError("Formato de parche desconocido")
+
+def _changed_runs(stock: bytes, mod: bytes) -> list:
+    """Corridas [start, end) donde stock y mod difieren (ya fundidas por SPARSE_MERGE_GAP)."""
+    n = len(stock)
+    if np is not None:
+        a = np.frombuffer(stock, dtype=np.uint8)
+        b = np.frombuffer(mod, dtype=np.uint8)
+        parts = [np.flatnonzero(a[i:i + _DIFF_WINDOW] != b[i:i + _DIFF_WINDOW]) + i
+                 for i in range(0, n, _DIFF_WINDOW)]
+        idx = np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+        if not len(idx):
+            return []
+        cut = np.flatnonzero(np.diff(idx) > SPARSE_MERGE_GAP + 1)
+        starts = idx[np.concatenate(([0], cut + 1))]
+        ends = idx[np.concatenate((cut, [len(idx) - 1]))] + 1
+        return list(zip(starts.tolist(), ends.tolist()))
+
+    runs = []
+    block = 4096
+    for i in range(0, n, block):
+        if stock[i:i + block] == mod[i:i + block]:
+            continue
+        for j in range(i, min(i + block, n)):
+            if stock[j] != mod[j]:
+                if runs and j - runs[-1][1] <= SPARSE_MERGE_GAP:
+                    runs[-1][1] = j + 1
+                else:
+                    runs.append([j, j + 1])
+    return [tuple(r) for r in runs]
+
+def sparse_diff(stock: bytes, mod: bytes) -> bytes:
+    if len(stock) != len(mod):
+        raise ValueError("sparse requiere STOCK y MOD del mismo tamaño")
+    body = bytearray()
+    runs = _changed_runs(stock, mod)
+    for start, end in runs:
+        body += _SPARSE_RUN.pack(start, end - start)
+        body += stock[start:end]
+        body += mod[start:end]
+    header = _SPARSE_HEADER.pack(SPARSE_MAGIC, len(stock), len(runs),
+                                 hashlib.sha256(body).digest(), hashlib.sha256(mod).digest())
+    return header + bytes(body)
+
+def _sparse_runs(patch: bytes):
+    """Valida cabecera y hash de las corridas; devuelve (base_size, sha256 mod, [(offset, old, new)])."""
+    mv = memoryview(patch)
+    if len(mv) < _SPARSE_HEADER.size:
+        raise ValueError("Parche sparse truncado")
+    magic, base_size, n_runs, body_hash, mod_hash = _SPARSE_HEADER.unpack_from(mv)
+    if magic != SPARSE_MAGIC:
+        raise ValueError("Formato de parche desconocido")
+    body = mv[_SPARSE_HEADER.size:]
+    if hashlib.sha256(body).digest() != body_hash:
+        raise ValueError("Parche sparse corrupto")
+    runs, p = [], 0
+    for _ in range(n_runs):
+        off, ln = _SPARSE_RUN.unpack_from(body, p)
+        p += _SPARSE_RUN.size
+        runs.append((off, body[p:p + ln], body[p + ln:p + 2 * ln]))
+        p += 2 * ln
+    if p != len(body):
+        raise ValueError("Parche sparse corrupto")
+    return base_size, mod_hash, runs
+
+def apply_sparse(buf: bytearray, patch: bytes, verify_mod: bool = False) -> bytearray:
+    """
+    Aplica un parche sparse sobre `buf` en el lugar. El STOCK se valida por tamaño y
+    por los bytes viejos de cada corrida (nada se escribe si alguno no coincide);
+    `verify_mod` además hashea el resultado completo contra el sha256 del MOD.
+    """
+    base_size, mod_hash, runs = _sparse_runs(patch)
+    if len(buf) != base_size:
+        raise ValueError("STOCK no coincide con el parche")
+    with memoryview(buf) as mv:
+        for off, old, _ in runs:
+            if mv[off:off + len(old)] != old:
+                raise ValueError(f"STOCK no coincide con el parche (offset 0x{off:X})")
+        for off, _, new in runs:
+            mv[off:off + len(new)] = new
+    if verify_mod and hashlib.sha256(buf).digest() != mod_hash:
+        raise ValueError("Resultado no coincide con el MOD")
+    return buf
+
+def build_patch(stock: bytes, mod: bytes, formats=PATCH_FORMATS) -> tuple:
+    """(formato, bytes) del artefacto más chico entre `formats` (ver SPARSE_PREFER_BYTES)."""
+    best = None
+    if "sparse" in formats and len(stock) == len(mod):
+        best = ("sparse", sparse_diff(stock, mod))
+        if len(best[1]) <= SPARSE_PREFER_BYTES:
+            return best
+    if "bsdiff" in formats:
+        patch_bytes = bsdiff4.diff(stock, mod)
+        if best is None or len(patch_bytes) < len(best[1]):
+            best = ("bsdiff", patch_bytes)
+    if best is None:
+        raise ValueError("sparse requiere STOCK y MOD del mismo tamaño")
+    return best
+
+def _write_patch(out_dir: Path, fmt: str) -> Path:
+    # un re-diff puede cambiar de formato: no dejar el artefacto anterior al lado
+    for other, name in PATCH_FILES.items():
+        if other != fmt:
+            (out_dir / name).unlink(missing_ok=True)
+    return out_dir / PATCH_FILES[fmt]
+
+def create_patch(stock: bytes, mod: bytes, out_dir: Path, formats=PATCH_FORMATS) -> dict:
     out_dir.mkdir(parents=True, exist_ok=True)
 
     base_hash = sha256(stock)
-    patch_bytes = bsdiff4.diff(stock, mod)
+    fmt, patch_bytes = build_patch(stock, mod, formats)
 
-    (out_dir / "patch.bsdiff").write_bytes(patch_bytes)
+    _write_patch(out_dir, fmt).write_bytes(patch_bytes)
     (out_dir / "base.sha256").write_text(base_hash)
 
     meta = {
         "base_sha256": base_hash,
         "base_size": len(stock),
-        "patch_size": len(patch_bytes)
+        "patch_size": len(patch_bytes),
+        "format": fmt,
     }
 
     return meta
 
+def diff_files(stock_path: Path, mod_path: Path, out_path: Path) -> int:
+    """Parche (sparse o bsdiff) de dos archivos a out_path (escritura atómica). Pensado para correr en un worker."""
+    _, patch_bytes = build_patch(Path(stock_path).read_bytes(), Path(mod_path).read_bytes())
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out_path.with_name(out_path.name + f".{os.getpid()}.tmp")
+    tmp.write_bytes(patch_bytes)
+    os.replace(tmp, out_path)
+    return len(patch_bytes)
+
+def install_patch(patch_path: Path, base_hash: str, base_size: int, out_dir: Path) -> dict:
+    """Copia un parche ya generado (p.ej. desde la caché) al directorio del parche."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with open(patch_path, "rb") as f:
+        fmt = detect_format(f.read(len(SPARSE_MAGIC)))
+    shutil.copyfile(patch_path, _write_patch(out_dir, fmt))
+    (out_dir / "base.sha256").write_text(base_hash)
+    return {
+        "base_sha256": base_hash,
+        "base_size": base_size,
+        "patch_size": os.path.getsize(patch_path),
+        "format": fmt,
+    }
+
 def apply_patch(stock: bytes, patch_dir: Path) -> bytes:
+    sparse = patch_dir / PATCH_FILES["sparse"]
+    if sparse.exists():
+        # los bytes viejos de cada corrida validan el STOCK: sin hashear el binario entero
+        return apply_sparse(bytearray(stock), sparse.read_bytes())
+
     expected = (patch_dir / "base.sha256").read_text().strip()
     current = sha256(stock)
 
@@ -1,15 +1,38 @@
 from pathlib import Path
-import json, yaml, zlib, bsdiff4
+import json, bsdiff4
 
-PATCH_ROOT = Path("static/patches")
+from app.services.checksums import ALGOS, WriteLog, fix_blocks, parse_blocks
+from app.services.families import checksum_blocks
+from app.services.multi_pattern import FusedHexSearch, replace_occurrences
+from app.services.patch_engine import apply_sparse
+from app.services.recipe_registry import CompiledRecipe, HexOp, WriteOp, load_recipe
 
-def _to_bytes(hexstr: str) -> bytes:
-    return bytes(int(x,16) for x in hexstr.split())
+PATCH_ROOT = Path("static/patches")
 
-def _crc32(data: bytes) -> int:
-    return zlib.crc32(data) & 0xffffffff
+def _fix_checksums(bin_bytes: bytearray, step, family: str | None, log: WriteLog) -> list:
+    """
+    Un `post: - checksum:` de la receta. Bloques: `blocks` de la propia receta o el
+    mapa `type` de static/patches/<familia>/checksums.json.
+    """
+    typ = step.get("type")
+    if step.get("blocks"):
+        blocks = parse_blocks(step["blocks"], default_algo=typ if typ in ALGOS else "crc32")
+    else:
+        blocks = checksum_blocks(family, typ) if family else None
+        if blocks is None:
+            # como antes de los mapas: sin bloques no hay nada que escribir, se sigue
+            if typ not in ALGOS:
+                print(f"[ECU FORGE X] checksum '{typ}' sin mapa para la familia {family}: se omite")
+            return []
+    return fix_blocks(bin_bytes, blocks, log, full=bool(step.get("full")))
 
-def _apply_yaml(bin_bytes: bytearray, recipe: dict) -> bytes:
+def _apply_yaml(bin_bytes: bytearray, recipe: CompiledRecipe, family: str | None = None,
+                report: dict | None = None) -> bytes:
+    """
+    Aplica la receta. Si se pasa `report`, report["overlaps"] lista los matches de
+    `patch` sobre bytes que pisó o creó una op anterior ([{"op", "offset"}]); con
+    `on_overlap: error` en la receta esos solapes son un ValueError.
+    """
     g = recipe.get("guards", {})
     if g.get("min_size") and len(bin_bytes) < int(g["min_size"]):
         raise ValueError("BIN demasiado pequeño")
@@ -18,30 +41,48 @@ def _apply_yaml(bin_bytes: bytearray, recipe: dict) -> bytes:
         # sólo validatorio; puedes relajar si quieres
         pass
 
-    for step in recipe.get("ops", []):
-        if "patch" in step:
-            pat = _to_bytes(step["patch"]["find_hex"])
-            rep = _to_bytes(step["patch"]["replace_hex"])
-            count = int(step["patch"].get("count", 1))
-            hits = 0
-            idx = bin_bytes.find(pat)
-            while idx != -1 and hits < count:
-                bin_bytes[idx:idx+len(pat)] = rep
-                hits += 1
-                idx = bin_bytes.find(pat, idx+len(rep))
-            if hits < count:
+    steps = recipe.ops
+    # todos los find_hex de la receta se buscan en un solo barrido
+    find_index = [i for i, op in enumerate(steps) if isinstance(op, HexOp) and op.key == "patch"]
+    finds = [steps[i] for i in find_index]
+    search = FusedHexSearch([op.find for op in finds]) if finds else None
+    pi = 0
+    # bytes originales de lo que escriben las ops: los checksums se corrigen solo ahí
+    log = WriteLog()
+
+    for op in steps:
+        before = len(bin_bytes)
+        if isinstance(op, HexOp) and op.key == "patch":
+            def on_write(a, b, old=op.find):
+                search.mark(a, b)
+                if b - a == len(old):
+                    log.record(a, old)  # lo reemplazado es justo el patrón buscado
+
+            hits = replace_occurrences(bin_bytes, search.occurrences(pi, bin_bytes), len(op.find), op.repl,
+                                       limit=op.count, on_write=on_write)
+            pi += 1
+            if hits < op.count:
                 raise ValueError("Patrón no encontrado las veces requeridas")
-        elif "write" in step:
-            at = int(step["write"]["at"], 0)
-            data = _to_bytes(step["write"]["hex"])
-            bin_bytes[at:at+len(data)] = data
+        elif isinstance(op, WriteOp):
+            log.record(op.at, bin_bytes[op.at:op.at+len(op.data)])
+            bin_bytes[op.at:op.at+len(op.data)] = op.data
+            if search is not None:
+                search.mark(op.at, op.at+len(op.data))
+        if len(bin_bytes) != before:
+            log.resized = True
+            if search is not None:
+                search.invalidate()
+
+    overlaps = search.overlap_report(find_index) if search is not None else []
+    if overlaps and recipe.get("on_overlap") == "error":
+        raise ValueError(f"{len(overlaps)} match(es) solapados entre ops "
+                         f"(op {overlaps[0]['op']} @ 0x{overlaps[0]['offset']:X})")
+    if report is not None:
+        report["overlaps"] = overlaps
 
     for post in recipe.get("post", []):
         if "checksum" in post:
-            typ = post["checksum"].get("type")
-            if typ == "crc32":
-                _ = _crc32(bin_bytes)  # si necesitas escribirlo, añade write_at
-            # TODO: edc17_bosch, etc.
+            _fix_checksums(bin_bytes, post["checksum"], family or g.get("family"), log)
 
     return bytes(bin_bytes)
 
@@ -53,16 +94,20 @@ def apply_patch(family: str, patch_id: str, stock_bin: bytes) -> bytes:
     # 1) YAML
     yml = fam_dir / f"{patch_id}.yml"
     if yml.exists():
-        recipe = yaml.safe_load(yml.read_text(encoding="utf-8"))
-        return _apply_yaml(bytearray(stock_bin), recipe)
+        return _apply_yaml(bytearray(stock_bin), load_recipe(yml), family)
+
+    # 2) sparse (mismo tamaño): valida los bytes viejos de cada corrida, sin hashear el BIN
+    sp = fam_dir / f"{patch_id}.sparse"
+    if sp.exists():
+        return bytes(apply_sparse(bytearray(stock_bin), sp.read_bytes()))
 
-    # 2) bsdiff
+    # 3) bsdiff
     bsd = fam_dir / f"{patch_id}.bsdiff"
     if bsd.exists():
         patch_data = bsd.read_bytes()
         return bsdiff4.patch(stock_bin, patch_data)
 
-    # 3) overlay opcional
+    # 4) overlay opcional
     ovl = fam_dir / f"{patch_id}.bin"
     meta = fam_dir / f"{patch_id}.meta.json"
     if ovl.exists() and meta.exists():
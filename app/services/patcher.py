@@ -1,37 +1,66 @@
 # app/services/patcher.py
+# Pipeline de acciones sobre UN buffer mutable por orden: las acciones escriben en el
+# lugar (memoryview, sin redimensionar) y el resultado se vuelca a disco desde ese
+# mismo buffer. Sirve cualquier buffer con find + slicing (bytearray o mmap escribible).
+from typing import Optional, Sequence, Union
+import mmap
+
 from fastapi import HTTPException
 
-def patch_in_padding(data: bytes, needle: bytes, write_ascii: str, max_scan_tail: int = 1048576) -> bytes:
-    b = bytearray(data)
-    tail_start = max(0, len(b) - max_scan_tail)
-    tail = bytes(b[tail_start:])
+Buffer = Union[bytearray, mmap.mmap]
 
-    idx = tail.find(needle)
-    if idx < 0:
+def patch_in_padding_inplace(buf: Buffer, needle: bytes, write_ascii: str, max_scan_tail: int = 1048576,
+                             at: Optional[int] = None) -> int:
+    """
+    Escribe `write_ascii` dentro del primer bloque `needle` de la cola. Devuelve el offset.
+    `at`: offset ya resuelto en analyze (services/applicability); si el needle sigue
+    ahí se escribe sin buscar.
+    """
+    tail_start = max(0, len(buf) - max_scan_tail)
+    if at is not None and at >= tail_start and buf[at:at+len(needle)] == needle:
+        abs_idx = at
+    else:
+        # find con offset de inicio: sin copiar la cola
+        abs_idx = buf.find(needle, tail_start)
+    if abs_idx < 0:
         raise HTTPException(status_code=400, detail="No padding region found for demo patch")
 
-    abs_idx = tail_start + idx
     payload = write_ascii.encode("ascii", errors="strict")
 
     if len(payload) > len(needle):
         raise HTTPException(status_code=400, detail="Payload too long for needle block")
 
-    # sobrescribe dentro del bloque
-    b[abs_idx:abs_idx+len(payload)] = payload
+    # sobrescribe dentro del bloque (memoryview: nunca cambia el tamaño del buffer)
+    with memoryview(buf) as mv:
+        mv[abs_idx:abs_idx+len(payload)] = payload
+    return abs_idx
+
+def patch_in_padding(data: bytes, needle: bytes, write_ascii: str, max_scan_tail: int = 1048576) -> bytes:
+    # compat: versión inmutable (una copia); el pipeline usa patch_in_padding_inplace
+    b = bytearray(data)
+    patch_in_padding_inplace(b, needle, write_ascii, max_scan_tail)
     return bytes(b)
 
-def apply_patch(data: bytes, patch_def: dict) -> bytes:
-    out = data
-    for act in patch_def.get("actions", []):
+def apply_actions(buf: Buffer, patch_def: dict, offsets: Optional[Sequence[int]] = None) -> Buffer:
+    """Aplica todas las acciones sobre `buf` en el lugar y lo devuelve (`offsets`: uno por acción)."""
+    for i, act in enumerate(patch_def.get("actions", [])):
         t = act.get("type")
         if t == "patch_in_padding":
             needle = bytes.fromhex(act["needle_hex"])
-            out = patch_in_padding(
-                out,
+            patch_in_padding_inplace(
+                buf,
                 needle=needle,
                 write_ascii=act["write_ascii"],
-                max_scan_tail=int(act.get("max_scan_tail", 1048576))
+                max_scan_tail=int(act.get("max_scan_tail", 1048576)),
+                at=offsets[i] if offsets is not None and i < len(offsets) else None,
             )
         else:
             raise HTTPException(status_code=400, detail=f"Unknown action type: {t}")
-    return out
+    return buf
+
+def apply_patch(data, patch_def: dict, offsets: Optional[Sequence[int]] = None) -> bytearray:
+    """
+    Una sola copia por orden: `data` (bytes, mmap de solo lectura...) se copia a un
+    bytearray y todas las acciones trabajan sobre él. Devuelve ese bytearray.
+    """
+    return apply_actions(bytearray(data), patch_def, offsets)
@@ -0,0 +1,186 @@
+# app/services/recipe_registry.py
+# Registro compartido de recetas YAML compiladas: se parsean una vez, con los
+# patrones hex ya decodificados y los valores numéricos ya empaquetados.
+# Se invalida solo cuando cambia mtime/size del archivo.
+# Las ops se compilan recién al aplicar (primer acceso a `ops`): para listar una
+# receta alcanza con que el YAML parsee, igual que antes del registro.
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import threading
+from dataclasses import dataclass
+from functools import cached_property
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional, Tuple, Union
+
+import yaml
+
+from app.services.numeric_search import NumberQuery, pack_number
+
+
+# -------------------------------
+# Ops compiladas
+# -------------------------------
+@dataclass(frozen=True)
+class HexOp:
+    key: str                    # "find_hex" (tools) o "patch" (patch_exec)
+    find: bytes
+    repl: bytes
+    expect: Optional[int] = None
+    count: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class WriteOp:
+    at: int
+    data: bytes
+
+
+@dataclass(frozen=True)
+class NumberOp:
+    query: NumberQuery
+    repl: bytes
+    kind: str
+    value: float
+    tol: float
+    expect: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class UnknownOp:
+    raw: Mapping[str, Any]
+
+
+Op = Union[HexOp, WriteOp, NumberOp, UnknownOp]
+
+
+@dataclass(frozen=True)
+class CompiledRecipe:
+    path: str
+    data: Mapping[str, Any]     # YAML congelado (mappings de solo lectura + tuplas)
+    digest: str                 # sha256 del archivo: identifica la versión de la receta
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.data.get(key, default)
+
+    @cached_property
+    def ops(self) -> Tuple[Op, ...]:
+        # una op mal formada falla al aplicar la receta (KeyError/ValueError), no al listarla
+        return tuple(_compile_op(op) for op in self.data.get("ops") or ())
+
+
+# -------------------------------
+# Compilación
+# -------------------------------
+def _hex_lenient(s: str) -> bytes:
+    # dialecto tools/patch_apply: cualquier no-hex separa bytes
+    s = re.sub(r"[^0-9A-Fa-f]", " ", s or "")
+    return bytes(int(p, 16) for p in s.split() if p)
+
+
+def _hex_strict(hexstr: str) -> bytes:
+    # dialecto patch_exec: bytes separados por espacios
+    return bytes(int(x, 16) for x in hexstr.split())
+
+
+def _freeze(obj: Any) -> Any:
+    if isinstance(obj, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in obj.items()})
+    if isinstance(obj, list):
+        return tuple(_freeze(v) for v in obj)
+    return obj
+
+
+def _compile_number(vf: Mapping[str, Any]) -> NumberOp:
+    kind = vf["kind"]
+    value = float(vf["value"])
+    endian = vf.get("endian", "le")
+    tol = float(vf.get("tol", 0))
+    scale = vf.get("scale")
+    replace_value = float(vf.get("replace_value", value))
+    replace_scale = vf.get("replace_scale", scale)
+    q = NumberQuery.build(kind, value, endian=endian, tol=tol, align=vf.get("align"), scale=scale)
+    repl = pack_number(kind, replace_value * (float(replace_scale) if replace_scale not in (None, 1) else 1),
+                       endian=endian)
+    return NumberOp(query=q, repl=repl, kind=kind, value=value, tol=tol, expect=vf.get("expect"))
+
+
+def _compile_op(op: Mapping[str, Any]) -> Op:
+    if "find_hex" in op:
+        return HexOp("find_hex", _hex_lenient(op["find_hex"]), _hex_lenient(op.get("replace_hex", "")),
+                     expect=op.get("expect"))
+    if "value_find" in op:
+        return _compile_number(op["value_find"])
+    if "patch" in op:
+        p = op["patch"]
+        return HexOp("patch", _hex_strict(p["find_hex"]), _hex_strict(p["replace_hex"]),
+                     count=int(p.get("count", 1)))
+    if "write" in op:
+        w = op["write"]
+        return WriteOp(int(w["at"], 0), _hex_strict(w["hex"]))
+    return UnknownOp(op)
+
+
+def compile_recipe(path: Union[str, Path], raw: bytes) -> CompiledRecipe:
+    data = yaml.safe_load(raw.decode("utf-8")) or {}
+    if not isinstance(data, dict):
+        raise ValueError(f"receta inválida (se esperaba un mapping): {path}")
+    return CompiledRecipe(path=str(path), data=_freeze(data), digest=hashlib.sha256(raw).hexdigest())
+
+
+# -------------------------------
+# Registro
+# -------------------------------
+class RecipeRegistry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[Tuple[int, int], CompiledRecipe]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, path: Union[str, Path]) -> CompiledRecipe:
+        key = os.path.abspath(path)
+        st = os.stat(key)
+        sig = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached and cached[0] == sig:
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+
+        with open(key, "rb") as f:
+            raw = f.read()
+        rec = compile_recipe(path, raw)
+        with self._lock:
+            self._entries[key] = (sig, rec)
+        return rec
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else None,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+
+REGISTRY = RecipeRegistry()
+
+
+def load_recipe(path: Union[str, Path]) -> CompiledRecipe:
+    return REGISTRY.load(path)
+
+
+def registry_stats() -> dict:
+    return REGISTRY.stats()
@@ -0,0 +1,121 @@
+# app/services/sqlite_pool.py
+# Pool acotado de conexiones SQLite en modo WAL: lectores concurrentes sin bloquear
+# al escritor, y sin pagar sqlite3.connect + PRAGMAs en cada request.
+# El esquema se inicializa en la primera conexión (no al importar el módulo).
+from __future__ import annotations
+
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class SQLitePool:
+    def __init__(self, path: Path, *, size: int = 4, acquire_timeout: float = 5.0,
+                 init: Optional[Callable[[sqlite3.Connection], None]] = None):
+        self.path = Path(path)
+        self.size = max(1, size)
+        self.acquire_timeout = acquire_timeout
+        self._init = init
+        self._initialized = False
+        self._lock = threading.Lock()
+        # LIFO: la conexión más reciente (páginas calientes) sale primero
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self.created = 0
+        self.in_use = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.wait_s_total = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        con = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+        con.row_factory = sqlite3.Row
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        return con
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            con = self._idle.get_nowait()
+        except queue.Empty:
+            con = None
+            with self._lock:
+                if self.created < self.size:
+                    self.created += 1
+                    create = True
+                else:
+                    create = False
+                    self.waits += 1
+            if create:
+                try:
+                    con = self._connect()
+                except Exception:
+                    with self._lock:
+                        self.created -= 1
+                    raise
+            else:
+                t0 = time.perf_counter()
+                try:
+                    con = self._idle.get(timeout=self.acquire_timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self.timeouts += 1
+                    raise PoolTimeout(f"sin conexiones libres en {self.path.name}")
+                finally:
+                    with self._lock:
+                        self.wait_s_total += time.perf_counter() - t0
+
+        if not self._initialized and self._init is not None:
+            try:
+                with self._lock:
+                    if not self._initialized:
+                        self._init(con)
+                        self._initialized = True
+            except Exception:
+                self._idle.put(con)
+                raise
+        with self._lock:
+            self.in_use += 1
+        return con
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """with POOL.connection() as con: ... (rollback si hay excepción; la conexión vuelve al pool)."""
+        con = self._acquire()
+        try:
+            yield con
+        except Exception:
+            con.rollback()
+            raise
+        finally:
+            with self._lock:
+                self.in_use -= 1
+            self._idle.put(con)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": self.size,
+                "open": self.created,
+                "in_use": self.in_use,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+                "wait_s_total": round(self.wait_s_total, 4),
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+                self.created -= 1
@@ -1,8 +1,10 @@
 from __future__ import annotations
 
-import os, json
+import os, json, sqlite3, threading, weakref
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional, Tuple
+
+from app.services.metrics import register_collector
 
 DATA_DIR = Path(os.getenv("DATA_DIR", "/storage/efx"))
 DATA_DIR.mkdir(parents=True, exist_ok=True)
@@ -10,6 +12,9 @@ DATA_DIR.mkdir(parents=True, exist_ok=True)
 ORDERS_DIR = DATA_DIR / "orders"
 ORDERS_DIR.mkdir(parents=True, exist_ok=True)
 
+# índice SQLite (WAL) de order.json: listados y filtros sin recorrer el disco
+ORDERS_DB = DATA_DIR / "orders.db"
+
 def order_dir(order_id: str) -> Path:
     d = ORDERS_DIR / order_id
     d.mkdir(parents=True, exist_ok=True)
@@ -18,10 +23,116 @@ def order_dir(order_id: str) -> Path:
 def order_json_path(order_id: str) -> Path:
     return order_dir(order_id) / "order.json"
 
+# -----------------------------
+# Índice de órdenes
+# -----------------------------
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = False
+# conexiones vivas: se suma al abrir y se resta cuando el hilo dueño termina
+OPEN_CONNECTIONS = 0
+_conn_lock = threading.Lock()
+
+def _price_of(data: dict) -> Optional[float]:
+    price = data.get("price_usd")
+    try:
+        return float(price) if price is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def _index_row(data: dict) -> tuple:
+    return (
+        data.get("id"),
+        data.get("owner_email"),
+        data.get("status"),
+        1 if data.get("paid") else 0,
+        data.get("created_at") or "",
+        _price_of(data),
+    )
+
+def _connect() -> sqlite3.Connection:
+    global OPEN_CONNECTIONS
+    # check_same_thread=False solo para poder cerrarla desde el finalizador; la usa su hilo
+    con = sqlite3.connect(ORDERS_DB, timeout=5.0, check_same_thread=False)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    with _conn_lock:
+        OPEN_CONNECTIONS += 1
+    return con
+
+def _close(con: sqlite3.Connection) -> None:
+    global OPEN_CONNECTIONS
+    try:
+        con.close()
+    finally:
+        with _conn_lock:
+            OPEN_CONNECTIONS -= 1
+
+class _ThreadConn:
+    """Conexión de un hilo: al terminar el hilo se libera su threading.local y se cierra."""
+    def __init__(self, con: sqlite3.Connection):
+        self.con = con
+        weakref.finalize(self, _close, con)
+
+def _init_index(con: sqlite3.Connection) -> None:
+    con.executescript("""
+      CREATE TABLE IF NOT EXISTS orders(
+        id TEXT PRIMARY KEY,
+        owner_email TEXT,
+        status TEXT,
+        paid INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT NOT NULL DEFAULT '',
+        price REAL
+      );
+      CREATE INDEX IF NOT EXISTS ix_orders_owner ON orders(owner_email, created_at DESC, id DESC);
+      CREATE INDEX IF NOT EXISTS ix_orders_created ON orders(created_at DESC, id DESC);
+      CREATE INDEX IF NOT EXISTS ix_orders_status ON orders(status, created_at DESC, id DESC);
+    """)
+    # migración: primera vez con órdenes previas en disco → backfill
+    if con.execute("SELECT COUNT(*) FROM orders").fetchone()[0] == 0:
+        rebuild_order_index(con)
+
+def index_db() -> sqlite3.Connection:
+    global _initialized
+    holder = getattr(_local, "holder", None)
+    if holder is None:
+        holder = _local.holder = _ThreadConn(_connect())
+    con = holder.con
+    if not _initialized:
+        with _init_lock:
+            if not _initialized:
+                _init_index(con)
+                _initialized = True
+    return con
+
+def rebuild_order_index(con: Optional[sqlite3.Connection] = None) -> int:
+    con = con or index_db()
+    rows = []
+    for p in ORDERS_DIR.glob("*/order.json"):
+        try:
+            with open(p, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            continue
+        data.setdefault("id", p.parent.name)
+        rows.append(_index_row(data))
+    with con:
+        con.executemany("INSERT OR REPLACE INTO orders VALUES(?,?,?,?,?,?)", rows)
+    return len(rows)
+
+def _index_order(data: dict) -> None:
+    con = index_db()
+    with con:
+        con.execute("INSERT OR REPLACE INTO orders VALUES(?,?,?,?,?,?)", _index_row(data))
+
+# -----------------------------
+# order.json
+# -----------------------------
 def save_order(order_id: str, data: dict) -> None:
     p = order_json_path(order_id)
     with open(p, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
+    _index_order({**data, "id": data.get("id") or order_id})
 
 def load_order(order_id: str) -> Optional[dict]:
     p = order_json_path(order_id)
@@ -30,14 +141,49 @@ def load_order(order_id: str) -> Optional[dict]:
     with open(p, "r", encoding="utf-8") as f:
         return json.load(f)
 
-def iter_orders(limit: int = 200):
-    # devuelve dicts de order.json, más nuevos primero
-    files = sorted(ORDERS_DIR.glob("*/order.json"), key=lambda p: p.stat().st_mtime, reverse=True)
-    for p in files[:limit]:
-        try:
-            with open(p, "r", encoding="utf-8") as f:
-                yield json.load(f)
-        except Exception:
-            continue
+def _encode_cursor(created_at: str, order_id: str) -> str:
+    return f"{created_at}|{order_id}"
+
+def _decode_cursor(cursor: str) -> Tuple[str, str]:
+    created_at, _, order_id = cursor.rpartition("|")
+    return created_at, order_id
+
+def query_orders(owner_email: Optional[str] = None, status: Optional[str] = None,
+                 limit: int = 50, cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+    """
+    Órdenes más nuevas primero (created_at, id) usando el índice.
+    Devuelve (orders, next_cursor); next_cursor es None en la última página.
+    """
+    where, args = [], []
+    if owner_email:
+        where.append("owner_email = ?"); args.append(owner_email)
+    if status:
+        where.append("status = ?"); args.append(status)
+    if cursor:
+        where.append("(created_at, id) < (?, ?)"); args.extend(_decode_cursor(cursor))
+    sql = "SELECT id, created_at FROM orders"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+    args.append(int(limit) + 1)
 
+    rows = index_db().execute(sql, args).fetchall()
+    page, more = rows[:limit], len(rows) > limit
+    out = []
+    for oid, _ in page:
+        o = load_order(oid)
+        if o is not None:
+            out.append(o)
+    next_cursor = _encode_cursor(page[-1][1], page[-1][0]) if more and page else None
+    return out, next_cursor
 
+def _storage_metrics():
+    yield ("efx_sqlite_open_connections", "Conexiones SQLite abiertas (índice de órdenes)", "gauge",
+           [({"db": "orders"}, OPEN_CONNECTIONS)])
+
+register_collector(_storage_metrics)
+
+def iter_orders(limit: int = 200):
+    # devuelve dicts de order.json, más nuevos primero (vía índice)
+    orders, _ = query_orders(limit=limit)
+    yield from orders
@@ -0,0 +1,178 @@
+# app/services/token_cache.py
+# Caché de JWT ya verificados para get_current_user: clave = sha256 del token,
+# vigente hasta su `exp` (o TOKEN_CACHE_TTL_S, lo que venga antes), LRU acotado.
+# Un hit evita la verificación de firma y el parseo de claims de python-jose.
+#
+# Revocación por subject: revoke(email, at) invalida los tokens de ese email
+# emitidos hasta `at` inclusive (cambio de rol, logout global). Los tiempos van en
+# milisegundos: con segundos, un token emitido en el mismo segundo que el revoke
+# sobrevivía. Las revocaciones se persisten aparte (auth.db) y un hilo de fondo las
+# trae cada TOKEN_REVOCATION_RECHECK_S (la primera carga es sincrónica): así un revoke
+# hecho en otro worker de uvicorn también aplica acá, sin consultar SQLite en el
+# camino del request.
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+
+TOKEN_CACHE_MAX = int(os.getenv("TOKEN_CACHE_MAX", "10000"))
+TOKEN_CACHE_TTL_S = float(os.getenv("TOKEN_CACHE_TTL_S", "900"))
+TOKEN_REVOCATION_RECHECK_S = float(os.getenv("TOKEN_REVOCATION_RECHECK_S", "2"))
+
+# refresh(since) → [(email, revoked_at_ms)] con revoked_at_ms >= since
+RevocationLoader = Callable[[int], Iterable[Tuple[str, int]]]
+
+
+def _key(token: str) -> bytes:
+    return hashlib.sha256(token.encode("utf-8")).digest()
+
+
+def now_ms() -> int:
+    return time.time_ns() // 1_000_000
+
+
+class TokenCache:
+    def __init__(self, max_entries: int = TOKEN_CACHE_MAX, ttl_s: float = TOKEN_CACHE_TTL_S,
+                 recheck_s: float = TOKEN_REVOCATION_RECHECK_S):
+        self.max_entries = max(1, max_entries)
+        self.ttl_s = ttl_s
+        self.recheck_s = recheck_s
+        self._lock = threading.Lock()
+        # clave → (vence, usuario, email, emitido en ms)
+        self._entries: "OrderedDict[bytes, Tuple[float, dict, str, Optional[int]]]" = OrderedDict()
+        self._by_subject: Dict[str, Set[bytes]] = {}
+        self._revoked: Dict[str, int] = {}
+        self._loader: Optional[RevocationLoader] = None
+        self._loaded_until = 0
+        self._refresher: Optional[threading.Thread] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # ---------- revocaciones ----------
+    def set_loader(self, loader: RevocationLoader) -> None:
+        self._loader = loader
+
+    def _ensure_refresher(self) -> None:
+        # perezoso: importar el módulo (p.ej. en hijos de un pool) no arranca hilos
+        if self._loader is None or self._refresher is not None:
+            return
+        with self._lock:
+            if self._refresher is not None:
+                return
+            self._refresher = threading.Thread(target=self._refresh_loop, name="token-revocations",
+                                               daemon=True)
+        self.refresh()
+        self._refresher.start()
+
+    def _refresh_loop(self) -> None:
+        while True:
+            time.sleep(self.recheck_s)
+            self.refresh()
+
+    def refresh(self) -> None:
+        """Trae revocaciones nuevas del loader (lo llama el hilo de fondo)."""
+        if self._loader is None:
+            return
+        since = self._loaded_until
+        try:
+            rows = list(self._loader(since))
+        except Exception as e:
+            # se reintenta en el próximo recheck; lo ya cargado sigue valiendo
+            print(f"[ECU FORGE X] token cache: no se pudieron leer revocaciones: {e}")
+            return
+        for email, at in rows:
+            self.revoke(email, int(at))
+            self._loaded_until = max(self._loaded_until, int(at))
+
+    def revoke(self, email: str, at: Optional[int] = None) -> None:
+        """Tokens de `email` emitidos en o antes de `at` (ms) dejan de valer (y salen de la caché)."""
+        at = now_ms() if at is None else int(at)
+        with self._lock:
+            if at <= self._revoked.get(email, 0):
+                return
+            self._revoked[email] = at
+            for k in self._by_subject.pop(email, ()):
+                self._entries.pop(k, None)
+
+    def is_revoked(self, email: str, issued_ms: Optional[int]) -> bool:
+        self._ensure_refresher()
+        return self._is_revoked(email, issued_ms)
+
+    def _is_revoked(self, email: str, issued_ms: Optional[int]) -> bool:
+        # tokens sin fecha de emisión no se pueden fechar: con una revocación vigente no valen
+        at = self._revoked.get(email)
+        return at is not None and (issued_ms is None or int(issued_ms) <= at)
+
+    # ---------- caché ----------
+    def get(self, token: str) -> Optional[dict]:
+        self._ensure_refresher()
+        k = _key(token)
+        now = time.time()
+        with self._lock:
+            e = self._entries.get(k)
+            if e is None:
+                self.misses += 1
+                return None
+            expires, user, email, issued = e
+            if expires <= now or self._is_revoked(email, issued):
+                self._drop(k, email)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(k)
+            self.hits += 1
+            return user
+
+    def put(self, token: str, user: dict, *, exp: Optional[int], issued_ms: Optional[int]) -> None:
+        self._ensure_refresher()
+        now = time.time()
+        expires = now + self.ttl_s
+        if exp is not None:
+            expires = min(expires, float(exp))
+        if expires <= now:
+            return
+        k = _key(token)
+        email = user["email"]
+        with self._lock:
+            if self._is_revoked(email, issued_ms):
+                return
+            self._entries[k] = (expires, user, email, issued_ms)
+            self._entries.move_to_end(k)
+            self._by_subject.setdefault(email, set()).add(k)
+            while len(self._entries) > self.max_entries:
+                old, (_, _, old_email, _) = self._entries.popitem(last=False)
+                self._unindex(old, old_email)
+                self.evictions += 1
+
+    def _drop(self, k: bytes, email: str) -> None:
+        self._entries.pop(k, None)
+        self._unindex(k, email)
+
+    def _unindex(self, k: bytes, email: str) -> None:
+        keys = self._by_subject.get(email)
+        if keys is not None:
+            keys.discard(k)
+            if not keys:
+                del self._by_subject[email]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_subject.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "revoked_subjects": len(self._revoked),
+                "hit_rate": round(self.hits / total, 4) if total else None,
+            }
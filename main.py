@@ -1,4 +1,5 @@
 from __future__ import annotations
+from contextlib import asynccontextmanager
 from fastapi.staticfiles import StaticFiles
 
 from fastapi import FastAPI
@@ -10,31 +11,21 @@ from app.routers.public_orders import router as public_orders_router
 from app.routers.downloads import router as downloads_router
 from app.routers.ingest import router as ingest_router
 from app.routers.checkout_public import router as checkout_public_router
+from app.routers.diff2patch import router as diff2patch_router
+from app.routers.metrics import router as metrics_router
+from app.routers.dtc_scan import router as dtc_scan_router
+from app.services.jobs import PATCH_JOBS
+from app.services.metrics import MetricsMiddleware
 
-app = FastAPI()
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=False,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# ✅ mount static
-app.mount("/static", StaticFiles(directory="static"), name="static")
-
-# ✅ routers
-app.include_router(orders_router)
-app.include_router(public_orders_router)
-app.include_router(downloads_router)
-app.include_router(ingest_router)
-app.include_router(checkout_public_router)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # la cola de parcheo vive en memoria: jobs queued/running de un proceso anterior → failed
+    PATCH_JOBS.recover_orphans()
+    yield
 
-@app.get("/health")
-def health():
-    return {"ok": True}
 
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -43,24 +34,21 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
-# -------------------------------------------------------------------
-# STATIC (sirve /static/checkout.html)
-# -------------------------------------------------------------------
+# ✅ mount static
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# -------------------------------------------------------------------
-# ROUTERS
-# -------------------------------------------------------------------
+# ✅ routers
 app.include_router(orders_router)
 app.include_router(public_orders_router)
 app.include_router(downloads_router)
 app.include_router(ingest_router)
 app.include_router(checkout_public_router)
+app.include_router(diff2patch_router)
+app.include_router(metrics_router)
+app.include_router(dtc_scan_router)
 
-# -------------------------------------------------------------------
-# HEALTH
-# -------------------------------------------------------------------
 @app.get("/health")
 def health():
     return {"ok": True}
@@ -0,0 +1,10 @@
+# tests/conftest.py
+# DATA_DIR se lee al importar los servicios: apuntarlo a un directorio temporal
+# antes de que cualquier test importe `app`.
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="efx-tests-")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
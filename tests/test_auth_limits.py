@@ -0,0 +1,63 @@
+# tests/test_auth_limits.py
+import asyncio
+import threading
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.routers import auth
+from app.services.password_hasher import HasherBusy, PasswordHasher
+from app.services.sqlite_pool import PoolTimeout, SQLitePool
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(auth.router)
+    return TestClient(app)
+
+
+def test_hasher_rejects_over_max_pending():
+    hasher = PasswordHasher(workers=1, max_pending=2)
+    gate = threading.Event()
+
+    async def burst():
+        slow = [asyncio.ensure_future(hasher._run("hash", gate.wait, 5)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(HasherBusy):
+            await hasher._run("hash", lambda: None)
+        gate.set()
+        return await asyncio.gather(*slow)
+
+    results = asyncio.run(burst())
+    assert [r for r, _ in results] == [True, True]
+    stats = hasher.stats()
+    assert (stats["pending"], stats["completed"], stats["rejected"]) == (0, 2, 1)
+
+
+def test_full_hasher_returns_503(client, monkeypatch):
+    monkeypatch.setattr(auth, "HASHER", PasswordHasher(workers=1, max_pending=0))
+    r = client.post("/auth/register", json={"email": "busy@test.com", "password": "secret123"})
+    assert r.status_code == 503
+
+
+def test_pool_timeout_when_exhausted(tmp_path):
+    pool = SQLitePool(tmp_path / "a.db", size=1, acquire_timeout=0.05)
+    with pool.connection():
+        with pytest.raises(PoolTimeout):
+            with pool.connection():
+                pass
+    with pool.connection() as con:  # la conexión volvió al pool
+        assert con.execute("SELECT 1").fetchone()[0] == 1
+    assert pool.stats()["timeouts"] == 1 and pool.stats()["in_use"] == 0
+
+
+def test_exhausted_auth_db_returns_503(client, monkeypatch, tmp_path):
+    pool = SQLitePool(tmp_path / "auth.db", size=1, acquire_timeout=0.05, init=auth.init_db)
+    monkeypatch.setattr(auth, "AUTH_DB", pool)
+    with pool.connection():
+        r = client.post("/auth/login", json={"email": "a@test.com", "password": "secret123"})
+    assert r.status_code == 503
+    r = client.post("/auth/login", json={"email": "a@test.com", "password": "secret123"})
+    assert r.status_code == 401
@@ -0,0 +1,47 @@
+# tests/test_catalog_index.py
+import pytest
+
+from app.services.catalog_index import CatalogIndex, ecu_matches
+
+PATCHES = [
+    {"id": "dpf", "compatible_ecu": ["EDC17C81", "EDC17C64"], "engines": ["diesel"]},
+    {"id": "egr", "compatible_ecu": ["EDC17"]},
+    {"id": "vmax", "compatible_ecu": ["MED17.5.2"], "engines": ["petrol"]},
+    {"id": "c64", "compatible_ecu": ["C64"]},
+    {"id": "none", "compatible_ecu": []},
+]
+
+
+@pytest.fixture
+def index():
+    return CatalogIndex({"patches": PATCHES}, path=None)
+
+
+@pytest.mark.parametrize("ecu", ["EDC17C81", "edc17c64-xx", "EDC17", "MED17", "C64", "SID807", "", "DCM6.2"])
+@pytest.mark.parametrize("engine", ["diesel", "petrol", ""])
+def test_query_matches_ecu_matches(index, ecu, engine):
+    expected = [p["id"] for p in PATCHES
+                if ecu_matches(ecu.strip().upper(), p["compatible_ecu"])
+                and (not engine or "engines" not in p or engine in p["engines"])]
+    assert [p["id"] for p in index.query(ecu, engine)] == expected
+
+
+def test_memo_is_keyed_by_family(index):
+    index.query("EDC17C81", "diesel")
+    index.query("EDC17C64", "diesel")
+    index.query("EDC17CP46_X", "diesel")
+    assert [k for k in index._by_query if k[1] == "diesel"] == [("EDC17", "diesel")]
+
+
+def test_results_are_copies(index):
+    index.query("EDC17C81", "diesel")[0]["compatible_ecu"].append("MUTATED")
+    found = index.find("EDC17C81", "diesel", "dpf")
+    found["id"] = "other"
+    assert index.query("EDC17C81", "diesel")[0] == PATCHES[0]
+
+
+def test_repeated_query_does_not_rescan_terms(index):
+    first = index.query("EDC17C64-X", "diesel")
+    index._terms = []  # una segunda consulta igual sale de los memos
+    assert index.query("EDC17C64-X", "diesel") == first
+    assert index.find("edc17c64-x", "diesel", "c64") is not None
@@ -0,0 +1,102 @@
+# tests/test_checksums.py
+import os
+import random
+import zlib
+
+import pytest
+
+from app.services import checksums
+from app.services.checksums import WriteLog, _crc_raw, _shift_zeros, fix_blocks, parse_blocks
+
+SIZE = 16 * 1024
+
+BLOCKS = [
+    {"name": "crc", "algo": "crc32", "start": "0x0000", "end": "0x1000", "at": "0x1000"},
+    {"name": "s8", "algo": "sum8", "start": 0x1100, "end": 0x1900, "at": 0x1900},
+    {"name": "s16", "algo": "sum16", "start": 0x2000, "end": 0x3000, "at": 0x3000, "endian": "be"},
+    {"name": "s32", "algo": "sum32", "start": 0x3100, "end": 0x3900, "at": 0x3900},
+    # cubre el valor guardado del primer bloque: se corrige después
+    {"name": "outer", "algo": "crc32", "start": 0x0000, "end": 0x2000, "at": 0x3A00, "endian": "be"},
+]
+
+
+def _stock():
+    buf = bytearray(os.urandom(SIZE))
+    fix_blocks(buf, parse_blocks(BLOCKS))
+    return buf
+
+
+def _write(buf, log, off, data):
+    log.record(off, bytes(buf[off:off + len(data)]))
+    buf[off:off + len(data)] = data
+
+
+def test_crc_shift_matches_zlib():
+    a, b = os.urandom(100), os.urandom(37)
+    # crc(a || b) desde crc(a): linealidad + desplazamiento por len(b) ceros
+    shifted = _shift_zeros(_crc_raw(a), len(b)) ^ _crc_raw(b) ^ zlib.crc32(bytes(len(a) + len(b)))
+    assert shifted == zlib.crc32(a + b)
+
+
+def test_incremental_equals_full():
+    blocks = parse_blocks(BLOCKS)
+    rnd = random.Random(3)
+    buf, log = _stock(), WriteLog()
+    for _ in range(30):
+        off = rnd.randrange(0x3A00 - 8)
+        _write(buf, log, off, os.urandom(rnd.randint(1, 8)))
+    incremental = fix_blocks(buf, blocks, log)
+
+    full = bytearray(buf)
+    fix_blocks(full, blocks, full=True)
+    assert buf == full
+    assert incremental and all(r["incremental"] for r in incremental)
+
+
+def test_untouched_blocks_are_skipped():
+    blocks = parse_blocks(BLOCKS)
+    buf, log = _stock(), WriteLog()
+    _write(buf, log, 0x3200, b"\x01\x02\x03\x04")
+    assert [r["name"] for r in fix_blocks(buf, blocks, log)] == ["s32"]
+
+
+def test_resized_buffer_recomputes_everything():
+    blocks = parse_blocks(BLOCKS)
+    buf, log = _stock(), WriteLog()
+    _write(buf, log, 0x10, b"\xaa")
+    log.resized = True
+    assert all(not r["incremental"] for r in fix_blocks(buf, blocks, log))
+
+
+def test_full_sum_without_numpy(monkeypatch):
+    blocks = parse_blocks(BLOCKS)
+    buf = _stock()
+    expected = fix_blocks(bytearray(buf), blocks, full=True)
+    monkeypatch.setattr(checksums, "np", None)
+    assert fix_blocks(bytearray(buf), blocks, full=True) == expected
+
+
+@pytest.mark.parametrize("raw", [
+    [{"algo": "md5", "start": 0, "end": 4, "at": 8}],
+    [{"algo": "sum16", "start": 0, "end": 3, "at": 8}],
+    [{"algo": "crc32", "start": 0, "end": 16, "at": 4}],
+    [{"algo": "sum8", "start": 0, "end": 4, "at": 8, "endian": "middle"}],
+])
+def test_parse_blocks_rejects_invalid(raw):
+    with pytest.raises(ValueError):
+        parse_blocks(raw)
+
+
+def test_block_outside_bin():
+    with pytest.raises(ValueError, match="fuera del BIN"):
+        fix_blocks(bytearray(64), parse_blocks([{"start": 0, "end": 32, "at": 64}]))
+
+
+def test_recipe_checksum_without_map_is_skipped():
+    from app.services.patch_exec import _fix_checksums
+
+    buf = bytearray(os.urandom(256))
+    before = bytes(buf)
+    assert _fix_checksums(buf, {"type": "edc17_bosch"}, None, WriteLog()) == []
+    assert _fix_checksums(buf, {"type": "edc17_bosch"}, "NO_SUCH_FAMILY", WriteLog()) == []
+    assert bytes(buf) == before
@@ -0,0 +1,25 @@
+# tests/test_diff2patch.py
+import asyncio
+import io
+
+import pytest
+from starlette.datastructures import UploadFile
+
+from app.routers.diff2patch import diff2patch
+from app.services.diff_jobs import STAGING_DIR
+
+
+class _BrokenUpload(UploadFile):
+    async def read(self, size: int = -1) -> bytes:
+        if self.file.tell():
+            raise ConnectionResetError("client went away")
+        return await super().read(size)
+
+
+def test_failed_upload_removes_staging():
+    before = set(STAGING_DIR.glob("*")) if STAGING_DIR.exists() else set()
+    stock = UploadFile(io.BytesIO(b"\x00" * 4096), filename="stock.bin")
+    mod = _BrokenUpload(io.BytesIO(b"\x01" * (3 * 1024 * 1024)), filename="mod.bin")
+    with pytest.raises(ConnectionResetError):
+        asyncio.run(diff2patch(ecu_type="E", patch_id="p", stock=stock, mod=mod, _={}))
+    assert set(STAGING_DIR.glob("*")) == before
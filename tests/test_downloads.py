@@ -0,0 +1,86 @@
+# tests/test_downloads.py
+import os
+import uuid
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.routers.downloads import _parse_range, router
+from app.services import storage
+
+SIZE = 10_000
+
+
+@pytest.fixture(scope="module")
+def order():
+    oid = str(uuid.uuid4())
+    data = os.urandom(SIZE)
+    mod = storage.order_dir(oid) / "mod.bin"
+    mod.write_bytes(data)
+    storage.save_order(oid, {"id": oid, "download_ready": True, "family": "EDC17",
+                             "patch_option_id": "dtc_off", "paths": {"mod_file_path": str(mod)}})
+    return oid, data
+
+
+@pytest.fixture(scope="module")
+def client():
+    app = FastAPI()
+    app.include_router(router)
+    return TestClient(app, headers={"Accept-Encoding": "identity"})
+
+
+@pytest.mark.parametrize("header,expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=9990-", (9990, SIZE - 1)),
+    ("bytes=-10", (SIZE - 10, SIZE - 1)),
+    ("bytes=100-999999", (100, SIZE - 1)),
+    ("bytes=0-1,5-6", None),        # multi-rango → respuesta completa
+    ("items=0-1", None),
+    ("bytes=5-1", None),
+])
+def test_parse_range(header, expected):
+    assert _parse_range(header, SIZE) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=10000-", "bytes=-0"])
+def test_parse_range_unsatisfiable(header):
+    with pytest.raises(ValueError):
+        _parse_range(header, SIZE)
+
+
+def test_single_range_download(client, order):
+    oid, data = order
+    r = client.get(f"/download/{oid}", headers={"Range": "bytes=100-199"})
+    assert r.status_code == 206
+    assert r.headers["content-range"] == f"bytes 100-199/{SIZE}"
+    assert r.content == data[100:200]
+
+
+def test_suffix_range_and_full_download(client, order):
+    oid, data = order
+    r = client.get(f"/download/{oid}", headers={"Range": "bytes=-16"})
+    assert r.status_code == 206 and r.content == data[-16:]
+    r = client.get(f"/download/{oid}")
+    assert r.status_code == 200 and r.content == data
+    assert r.headers["accept-ranges"] == "bytes"
+
+
+def test_unsatisfiable_range(client, order):
+    oid, _ = order
+    r = client.get(f"/download/{oid}", headers={"Range": f"bytes={SIZE}-"})
+    assert r.status_code == 416
+    assert r.headers["content-range"] == f"bytes */{SIZE}"
+
+
+def test_if_range_mismatch_sends_full_file(client, order):
+    oid, data = order
+    r = client.get(f"/download/{oid}", headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert r.status_code == 200 and r.content == data
+
+
+def test_etag_revalidation(client, order):
+    oid, _ = order
+    etag = client.get(f"/download/{oid}").headers["etag"]
+    r = client.get(f"/download/{oid}", headers={"If-None-Match": etag})
+    assert r.status_code == 304
@@ -0,0 +1,82 @@
+# tests/test_dtc_scanner.py
+import hashlib
+import struct
+
+import pytest
+
+from app.services import dtc_scanner
+from app.services.dtc_scan_cache import DtcScanCache
+from app.services.dtc_scanner import PAT, decode_u16, scan_buffer, scan_file
+
+CODES = [0x0301, 0x0420, 0x0171, 0x0299, 0x1234, 0x0101, 0x2002, 0xC100, 0x0500, 0x0606]
+
+
+def _image() -> bytes:
+    buf = bytearray(b"\xff" * 64 * 1024)
+    ascii_ = b"P0301\x00P0420\x00U0100\x00B1A2F"
+    buf[1000:1000 + len(ascii_)] = ascii_
+    # cruza el borde de una ventana de 4K
+    buf[4096 - 2:4096 + 3] = b"P0171"
+    table = struct.pack("<%dH" % len(CODES), *CODES)
+    buf[0x8000:0x8000 + len(table)] = table
+    return bytes(buf)
+
+
+def test_decode_u16():
+    assert decode_u16(0x0301) == "P0301"
+    assert decode_u16(0xC100) == "U0100"
+
+
+def test_ascii_clusters_match_regex():
+    img = _image()
+    res = scan_buffer(img, chunk=4096)
+    expected = [m.start() for m in PAT.finditer(img)]
+    assert res["ascii"]["count"] == len(expected)
+    assert [c["start"] for c in res["ascii"]["clusters"]] == [1000, 4094]
+    assert res["ascii"]["clusters"][0]["samples"] == ["P0301", "P0420", "U0100", "B1A2F"]
+
+
+def test_u16_table_found():
+    res = scan_buffer(_image(), chunk=4096)
+    le = [t for t in res["tables"] if t["endian"] == "le"]
+    assert le and le[0]["start"] == 0x8000 and le[0]["count"] == len(CODES)
+    assert le[0]["samples"][:2] == ["P0301", "P0420"]
+
+
+@pytest.mark.parametrize("chunk", [2, 4096, 1 << 20])
+def test_window_size_does_not_change_result(chunk):
+    img = _image()
+    ref = scan_buffer(img, chunk=1 << 20)
+    res = scan_buffer(img, chunk=chunk)
+    assert res["ascii"] == ref["ascii"] and res["tables"] == ref["tables"]
+
+
+def test_without_numpy_same_result(monkeypatch):
+    img = _image()
+    ref = scan_buffer(img, chunk=4096)
+    monkeypatch.setattr(dtc_scanner, "np", None)
+    res = scan_buffer(img, chunk=4096)
+    assert res["ascii"] == ref["ascii"] and res["tables"] == ref["tables"]
+
+
+def test_scan_file_and_empty(tmp_path):
+    p = tmp_path / "ecu.bin"
+    p.write_bytes(_image())
+    assert scan_file(p)["ascii"]["count"] == scan_buffer(_image())["ascii"]["count"]
+    (tmp_path / "empty.bin").write_bytes(b"")
+    assert scan_file(tmp_path / "empty.bin")["size"] == 0
+
+
+def test_cache_scans_once(tmp_path):
+    img = _image()
+    sha = hashlib.sha256(img).hexdigest()
+    p = tmp_path / "ecu.bin"
+    p.write_bytes(img)
+    cache = DtcScanCache(tmp_path / "cache")
+    first, cached = cache.scan(p, sha)
+    assert not cached and first["sha256"] == sha
+    again, cached = cache.scan(p, sha.upper())
+    assert cached and again == first
+    assert cache.stats()["scans"] == 1
+    with pytest.raises(ValueError):
+        cache.scan(p, "nope")
@@ -0,0 +1,56 @@
+# tests/test_ecu_fingerprint.py
+import random
+
+import pytest
+
+from app.services import ecu_fingerprint
+from app.services.ecu_fingerprint import FingerprintIndex, detect_fingerprint
+
+PATTERNS = [
+    {"ecu_family": "EDC17C81", "patterns": [
+        {"pn": "0281xxxxxx", "sw": None},
+        {"pn": "0281031234", "sw": "1037527034", "desc": "demo"},
+    ]},
+    {"ecu_family": "MD1CS003", "patterns": [{"pn": None, "sw": "SW8639501"}]},
+]
+FAMILIES = ["EDC17", "EDC17C81", "MD1", "MD1CS003"]
+
+
+def _image(seed: int, size: int = 256 * 1024) -> bytes:
+    rnd = random.Random(seed)
+    buf = bytearray(b"\xff" * size)
+    for _ in range(size // 4):
+        buf[rnd.randrange(size)] = rnd.choice(b"0123456789ABCDEMSW._-\x00")
+    for s in (b"EDC17C81", b"1037527034", b"0281099999", b"MD1", b"SW8639501", b"X1037527034"):
+        i = rnd.randrange(size - len(s))
+        buf[i:i + len(s)] = s
+    return bytes(buf)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_anchor_prefilter_matches_full_run_scan(seed):
+    idx = FingerprintIndex(PATTERNS, FAMILIES)
+    assert idx._pairs is not None
+    img = _image(seed)
+    prefiltered = idx.scan(img)
+    idx._pairs = None
+    assert prefiltered == idx.scan(img)
+
+
+def test_short_literal_disables_prefilter():
+    idx = FingerprintIndex([], ["MD"])
+    assert idx._pairs is None
+    assert [m.template for _, m, _ in idx.scan(b"\x00MD7\x00")] == ["MD"]
+
+
+def test_numeric_edges():
+    idx = FingerprintIndex(PATTERNS, FAMILIES)
+    found = [(v, off) for off, _, v in idx.scan(b"\xff" * 10 + b"91037527034\x00" + b"1037527034")]
+    assert found == [("1037527034", 22)]
+
+
+def test_detect_resolves_pn_from_sw(monkeypatch):
+    monkeypatch.setattr(ecu_fingerprint.FINGERPRINTS, "get", lambda: FingerprintIndex(PATTERNS, FAMILIES))
+    res = detect_fingerprint(b"\xff" * 64 + b"EDC17C81\x00\x00SW1037527034")
+    assert res["family"] == "EDC17C81"
+    assert (res["sw_id"], res["part_number"], res["desc"]) == ("1037527034", "0281031234", "demo")
@@ -0,0 +1,125 @@
+# tests/test_ingest_zip.py
+import io
+import os
+import struct
+import zipfile
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+from app.routers import ingest
+from app.routers.ingest import extract_ecu_from_zip
+
+ECU = os.urandom(64 * 1024)
+
+
+def _zip(members, compression=zipfile.ZIP_DEFLATED) -> bytes:
+    raw = io.BytesIO()
+    with zipfile.ZipFile(raw, "w", compression) as z:
+        for name, data in members:
+            z.writestr(name, data)
+    return raw.getvalue()
+
+
+def _patch_headers(data: bytes, fn) -> bytes:
+    """Aplica `fn(buf, offset, central)` a cada header local y del directorio central."""
+    buf = bytearray(data)
+    for sig, central in ((b"PK\x03\x04", False), (b"PK\x01\x02", True)):
+        pos = buf.find(sig)
+        while pos != -1:
+            fn(buf, pos, central)
+            pos = buf.find(sig, pos + 4)
+    return bytes(buf)
+
+
+def _extract(tmp_path, data: bytes):
+    zp = tmp_path / "upload.zip"
+    zp.write_bytes(data)
+    return extract_ecu_from_zip(zp, tmp_path)
+
+
+def _status(tmp_path, data: bytes) -> int:
+    with pytest.raises(HTTPException) as exc:
+        _extract(tmp_path, data)
+    return exc.value.status_code
+
+
+def test_picks_ecu_member_by_metadata(tmp_path):
+    data = _zip([("readme.txt", b"x" * 500_000), ("dump/ecu.bin", ECU), ("other.dat", b"y" * 1000)])
+    dest, digest = _extract(tmp_path, data)
+    assert dest == tmp_path / "ecu.bin" and dest.read_bytes() == ECU
+    assert digest.size == len(ECU)
+    # solo se extrae el miembro elegido
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["ecu.bin", "upload.zip"]
+
+
+def test_nested_zip_one_level(tmp_path):
+    inner = _zip([("info.nfo", b"n"), ("inner.ori", ECU)])
+    dest, digest = _extract(tmp_path, _zip([("notes.txt", b"t"), ("pack.zip", inner)], zipfile.ZIP_STORED))
+    assert dest.name == "inner.ori" and dest.read_bytes() == ECU
+    assert not (tmp_path / ".nested.zip").exists()
+
+
+def test_nested_zip_inside_nested_is_rejected(tmp_path):
+    deepest = _zip([("ecu.bin", ECU)])
+    data = _zip([("a.zip", _zip([("b.zip", deepest)], zipfile.ZIP_STORED))], zipfile.ZIP_STORED)
+    assert _status(tmp_path, data) == 400
+    assert not (tmp_path / ".nested.zip").exists()
+
+
+def test_too_many_members(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "ZIP_MAX_MEMBERS", 3)
+    data = _zip([(f"f{i}.bin", b"x") for i in range(4)])
+    assert _status(tmp_path, data) == 413
+
+
+def test_total_uncompressed_size(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "ZIP_MAX_TOTAL_BYTES", 100_000)
+    data = _zip([("a.bin", ECU), ("b.bin", ECU)])
+    assert _status(tmp_path, data) == 413
+
+
+def test_compression_ratio(tmp_path):
+    data = _zip([("bomb.bin", b"\x00" * (8 * 1024 * 1024))])
+    assert _status(tmp_path, data) == 413
+    assert not (tmp_path / "bomb.bin").exists()
+
+
+def test_member_larger_than_declared(tmp_path):
+    data = _zip([("ecu.bin", ECU)])
+
+    def shrink(buf, pos, central):
+        off = pos + (24 if central else 22)
+        struct.pack_into("<I", buf, off, 40 * 1024)
+
+    # zipfile corta en el tamaño declarado y el CRC no cierra: nunca queda el dump truncado
+    assert _status(tmp_path, _patch_headers(data, shrink)) == 400
+    assert not (tmp_path / "ecu.bin").exists()
+
+
+def test_encrypted_member(tmp_path):
+    def encrypt(buf, pos, central):
+        off = pos + (8 if central else 6)
+        struct.pack_into("<H", buf, off, struct.unpack_from("<H", buf, off)[0] | 0x1)
+
+    assert _status(tmp_path, _patch_headers(_zip([("ecu.bin", ECU)]), encrypt)) == 400
+
+
+def test_corrupt_stream(tmp_path):
+    data = bytearray(_zip([("ecu.bin", ECU * 2)]))
+    start = data.find(b"ecu.bin") + len("ecu.bin")
+    data[start + 100:start + 400] = b"\xff" * 300
+    assert _status(tmp_path, bytes(data)) == 400
+    assert not (tmp_path / "ecu.bin").exists()
+
+
+def test_endpoint_drops_workdir_on_rejected_zip(monkeypatch):
+    monkeypatch.setattr(ingest, "ZIP_MAX_MEMBERS", 1)
+    app = FastAPI()
+    app.include_router(ingest.router)
+    before = set(ingest.ORDERS_DIR.iterdir())
+    data = _zip([("a.bin", ECU), ("b.bin", ECU)])
+    r = TestClient(app).post("/api/ingest-multipart", files={"file": ("dump.zip", data)})
+    assert r.status_code == 413
+    assert set(ingest.ORDERS_DIR.iterdir()) == before
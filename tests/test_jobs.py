@@ -0,0 +1,117 @@
+# tests/test_jobs.py
+import time
+import uuid
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+from app.routers.orders import confirm_payment_demo
+from app.services import storage
+from app.services.jobs import PatchJobQueue, download_ready, load_job, save_job
+
+ADMIN = {"email": "admin@test", "role": "admin"}
+
+
+def _order(**extra) -> str:
+    oid = str(uuid.uuid4())
+    storage.order_dir(oid)
+    storage.save_order(oid, {"id": oid, "owner_email": "a@test", "status": "pending_payment",
+                             "paid": False, "download_ready": False, **extra})
+    return oid
+
+
+def _job(oid: str, state: str, **extra) -> None:
+    save_job(oid, {"order_id": oid, "state": state, "attempts": 1, "error": None, **extra})
+
+
+class _FlakyPool:
+    """Pool falso: los primeros `crashes` submits terminan con BrokenProcessPool."""
+
+    def __init__(self, outcomes):
+        self.outcomes = outcomes
+
+    def submit(self, fn, *args):
+        fut = Future()
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            fut.set_exception(outcome)
+        else:
+            fut.set_result(outcome)
+        return fut
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+def _run(q: PatchJobQueue, outcomes) -> dict:
+    pools = iter([_FlakyPool(outcomes) for _ in range(len(outcomes))])
+    q._new_pool = lambda: next(pools)
+    oid = _order()
+    q.submit(oid, "0" * 64, {"id": "p"}, str(storage.order_dir(oid) / "output.mod.bin"))
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        job = load_job(oid)
+        # el job se guarda antes de actualizar los contadores de la cola
+        stats = q.stats()
+        if job and job["state"] in ("done", "failed") and stats["completed"] + stats["failed"]:
+            return job
+        time.sleep(0.01)
+    raise AssertionError("job no terminó")
+
+
+def test_broken_pool_is_retried_once():
+    q = PatchJobQueue(workers=1, max_attempts=2)
+    job = _run(q, [BrokenProcessPool("boom"), {"bytes": 1, "sha256": "x", "timings": {}}])
+    assert job["state"] == "done" and job["attempts"] == 2
+    assert q.stats()["retried"] == 1 and q.stats()["completed"] == 1
+
+
+def test_broken_pool_gives_up_after_max_attempts():
+    q = PatchJobQueue(workers=1, max_attempts=2)
+    job = _run(q, [BrokenProcessPool("boom"), BrokenProcessPool("boom")])
+    assert job["state"] == "failed" and job["error"] == "worker crashed"
+
+
+def test_patch_error_fails_without_retry():
+    q = PatchJobQueue(workers=1, max_attempts=2)
+    job = _run(q, [ValueError("Patrón no encontrado")])
+    assert job["state"] == "failed" and job["attempts"] == 1
+    assert job["error"] == "Patrón no encontrado"
+
+
+def test_recover_orphans():
+    q, live = PatchJobQueue(), PatchJobQueue()
+    live._claim_owner()  # otro proceso vivo con su lock tomado
+    dead = _order()
+    _job(dead, "running", owner=uuid.uuid4().hex)
+    legacy = _order()
+    _job(legacy, "queued")
+    alive = _order()
+    _job(alive, "running", owner=live.owner)
+    finished = _order()
+    _job(finished, "done", owner=uuid.uuid4().hex)
+
+    assert q.recover_orphans() >= 2
+    assert load_job(dead)["state"] == "failed"
+    assert load_job(legacy)["state"] == "failed"
+    assert load_job(alive)["state"] == "running"
+    assert load_job(finished)["state"] == "done"
+
+
+def test_confirm_payment_follows_job_state():
+    failed = _order()
+    _job(failed, "failed", error="Patrón no encontrado")
+    res = confirm_payment_demo(failed, ADMIN)
+    assert res["download_ready"] is False and res["download_url"] is None
+    assert (res["job_state"], res["job_error"]) == ("failed", "Patrón no encontrado")
+
+    pending = _order()
+    _job(pending, "running")
+    assert confirm_payment_demo(pending, ADMIN)["download_ready"] is False
+    # el job termina después del pago: la orden pasa a descargable sin otro paso
+    _job(pending, "done")
+    assert download_ready(storage.load_order(pending))
+
+    done = _order()
+    _job(done, "done")
+    res = confirm_payment_demo(done, ADMIN)
+    assert res["download_ready"] and res["download_url"] == f"/download/{done}"
@@ -0,0 +1,80 @@
+# tests/test_multi_pattern.py
+import random
+
+import pytest
+
+from app.services import multi_pattern
+from app.services.multi_pattern import VECTOR_MIN_PATTERNS, FusedHexSearch, PatternSet, _find_scalar
+
+
+def _image(seed: int, size: int = 64 * 1024) -> bytes:
+    rnd = random.Random(seed)
+    buf = bytearray(b"\xff" * size)
+    for _ in range(size // 8):
+        i = rnd.randrange(size)
+        buf[i] = rnd.randrange(256)
+    return bytes(buf)
+
+
+def _patterns(buf: bytes, seed: int, n: int):
+    rnd = random.Random(seed)
+    out = []
+    for _ in range(n):
+        ln = rnd.choice((1, 2, 3, 4, 8))
+        if rnd.random() < 0.7:
+            i = rnd.randrange(len(buf) - ln)
+            out.append(buf[i:i + ln])
+        else:
+            out.append(bytes(rnd.randrange(256) for _ in range(ln)))
+    return out
+
+
+@pytest.mark.parametrize("n", [4, VECTOR_MIN_PATTERNS + 8])
+def test_find_all_matches_scalar_find(n):
+    buf = _image(n)
+    pats = _patterns(buf, n, n)
+    found = PatternSet(pats).find_all(buf)
+    assert found == [_find_scalar(buf, p) for p in pats]
+
+
+def test_overlapping_and_duplicate_patterns():
+    buf = b"\xaa\xaa\xaa\xaa\x01\xaa\xaa"
+    ps = PatternSet([b"\xaa\xaa", b"\xaa\xaa", b"\x01"])
+    assert ps.slots == [0, 0, 1]
+    assert ps.find_all(buf) == [[0, 1, 2, 5], [0, 1, 2, 5], [4]]
+
+
+def test_without_numpy_same_result(monkeypatch):
+    buf = _image(7)
+    pats = _patterns(buf, 7, VECTOR_MIN_PATTERNS + 4)
+    expected = PatternSet(pats).find_all(buf)
+    monkeypatch.setattr(multi_pattern, "np", None)
+    assert PatternSet(pats).find_all(buf) == expected
+
+
+def test_pattern_longer_than_buffer():
+    pats = [b"\x00\x01\x02\x03"] * (VECTOR_MIN_PATTERNS + 1)
+    assert PatternSet(pats).find_all(b"\x00\x01") == [[]] * len(pats)
+
+
+def _fused(buf, pats, writes):
+    fs = FusedHexSearch(pats)
+    fs.occurrences(0, buf)
+    for off, data in writes:
+        buf[off:off + len(data)] = data
+        fs.mark(off, off + len(data))
+    return fs, fs.occurrences(len(pats) - 1, buf)
+
+
+def test_fused_overlaps_only_gone_or_new_hits():
+    base = b"\x00" * 8 + b"\xca\xfe\xba\xbe" + b"\x00" * 8 + b"\xca\xfe\xba\xbe" + b"\x00" * 8
+    pats = [b"\x00\x00", b"\xca\xfe\xba\xbe"]
+
+    # escritura pegada a la ocurrencia y otra que la reescribe igual: no hay solape
+    fs, occ = _fused(bytearray(base), pats, [(7, b"\x01"), (8, b"\xca\xfe")])
+    assert occ == [8, 20] and fs.overlaps == []
+
+    # pisa la primera y crea una nueva
+    fs, occ = _fused(bytearray(base), pats, [(9, b"\x00"), (0, b"\xca\xfe\xba\xbe")])
+    assert occ == [0, 20]
+    assert fs.overlap_report([3, 5]) == [{"op": 5, "offset": 0}, {"op": 5, "offset": 8}]
@@ -0,0 +1,92 @@
+# tests/test_numeric_search.py
+import random
+import struct
+
+import pytest
+
+from app.services import numeric_search
+from app.services.numeric_search import NumberQuery, find_numbers
+
+CODES = {"u8": "B", "i8": "b", "u16": "H", "i16": "h", "u32": "I", "i32": "i", "f32": "f", "f64": "d"}
+
+
+def _pack(kind, value, endian):
+    return struct.pack(("<" if endian == "le" else ">") + CODES[kind], value)
+
+
+def _reference(buf, kind, target, endian="le", tol=0, align=None, scale=None):
+    """Bucle directo con struct.unpack_from, misma semántica que el escaneo original."""
+    e = "<" if endian.startswith("le") else ">"
+    size = struct.calcsize(CODES[kind])
+    t = target * float(scale) if scale not in (None, 1) else target
+    hits = []
+    for i in range(len(buf) - size + 1):
+        if align and i % align:
+            continue
+        val = struct.unpack_from(e + CODES[kind], buf, i)[0]
+        if kind in ("f32", "f64"):
+            ok = abs(float(val) - float(t)) <= float(tol)
+        else:
+            ok = int(t - tol) <= int(val) <= int(t + tol)
+        if ok:
+            hits.append(i)
+    return hits
+
+
+def _buffer(seed=1234, size=4099):
+    rnd = random.Random(seed)
+    buf = bytearray(rnd.getrandbits(8) for _ in range(size))
+    # valores sembrados en todas las fases para que cada vista tenga hits
+    for off, kind, value, endian in [
+        (17, "u16", 0x1234, "le"), (40, "u16", 0x1234, "be"), (101, "i16", -300, "le"),
+        (203, "u32", 123456, "le"), (306, "i32", -7, "be"), (409, "f32", 3.5, "le"),
+        (515, "f32", 3.5, "be"), (1023, "f64", 1013.25, "le"), (2050, "f64", 1013.25, "be"),
+        (777, "i8", -5, "le"), (778, "u8", 200, "le"),
+    ]:
+        data = _pack(kind, value, endian)
+        buf[off:off + len(data)] = data
+    return bytes(buf)
+
+
+CASES = [
+    ("u8", 200, {}), ("u8", 10, {"tol": 3}), ("i8", -5, {}), ("i8", -120, {"tol": 20}),
+    ("u16", 0x1234, {}), ("u16", 0x1234, {"endian": "be"}), ("u16", 0x1234, {"align": 2}),
+    ("u16", 1000, {"tol": 200, "align": 4}), ("i16", -300, {"tol": 2}),
+    ("u32", 123456, {}), ("u32", 123456, {"align": 4}), ("i32", -7, {"endian": "be"}),
+    ("f32", 3.5, {}), ("f32", 3.5, {"endian": "be", "tol": 0.01}), ("f32", 0.5, {"tol": 1e-3, "scale": 7}),
+    ("f64", 1013.25, {}), ("f64", 1013.25, {"endian": "be", "align": 2}),
+    # cotas que caen fuera del rango del tipo: se recortan, no desbordan la vista
+    ("u8", 250, {"tol": 20}), ("u8", -3, {"tol": 5}), ("i8", 126, {"tol": 10}),
+    ("u16", 70000, {"tol": 10}), ("i16", -32760, {"tol": 50}), ("u32", -1, {"tol": 2}),
+    ("i32", 0x7FFFFFF0, {"tol": 0x100}), ("u16", 5.9, {"tol": 0.5}), ("i16", -5.9, {"tol": 0.5}),
+]
+
+
+@pytest.mark.parametrize("kind,target,opts", CASES)
+def test_find_numbers_matches_unpack_loop(kind, target, opts):
+    buf = _buffer()
+    q = NumberQuery.build(kind, target, **opts)
+    assert find_numbers(buf, [q]) == [_reference(buf, kind, target, **opts)]
+
+
+def test_fused_queries_match_individual_scans(monkeypatch):
+    # ventanas chicas: cada vista se procesa en varios bloques y fases
+    monkeypatch.setattr(numeric_search, "SCAN_WINDOW", 64)
+    buf = _buffer(seed=99, size=3001)
+    qs = [NumberQuery.build(k, t, **o) for k, t, o in CASES]
+    expected = [_reference(buf, k, t, **o) for k, t, o in CASES]
+    assert find_numbers(buf, qs) == expected
+    assert any(expected)
+
+
+def test_scalar_fallback_matches(monkeypatch):
+    monkeypatch.setattr(numeric_search, "np", None)
+    buf = _buffer(seed=7, size=1025)
+    for kind, target, opts in CASES:
+        q = NumberQuery.build(kind, target, **opts)
+        assert find_numbers(buf, [q]) == [_reference(buf, kind, target, **opts)]
+
+
+def test_buffer_shorter_than_type():
+    q = NumberQuery.build("f64", 0.0)
+    assert find_numbers(b"\x00" * 5, [q]) == [[]]
@@ -0,0 +1,86 @@
+# tests/test_patch_engine.py
+import os
+import random
+
+import pytest
+
+from app.services.patch_engine import _SPARSE_HEADER, SPARSE_MERGE_GAP, apply_sparse, build_patch, sparse_diff
+
+
+def _pair(seed: int, size: int = 32 * 1024, edits: int = 40):
+    rnd = random.Random(seed)
+    stock = os.urandom(size)
+    mod = bytearray(stock)
+    for _ in range(edits):
+        i = rnd.randrange(size - 8)
+        mod[i:i + rnd.randint(1, 8)] = os.urandom(8)[:len(mod[i:i + 8])]
+    return stock, bytes(mod[:size])
+
+
+def test_roundtrip():
+    stock, mod = _pair(1)
+    assert bytes(apply_sparse(bytearray(stock), sparse_diff(stock, mod), verify_mod=True)) == mod
+
+
+def test_identical_images_produce_empty_patch():
+    stock = os.urandom(1024)
+    assert bytes(apply_sparse(bytearray(stock), sparse_diff(stock, stock))) == stock
+
+
+def test_edits_at_both_ends_and_merged_gaps():
+    stock = bytearray(4096)
+    mod = bytearray(stock)
+    mod[0] = 1
+    mod[10 + SPARSE_MERGE_GAP] = 2   # dentro del gap: misma corrida
+    mod[-1] = 3
+    assert apply_sparse(bytearray(stock), sparse_diff(bytes(stock), bytes(mod))) == mod
+
+
+def test_wrong_stock_is_rejected_without_writing():
+    stock, mod = _pair(2)
+    patch = sparse_diff(stock, mod)
+    other = bytearray(os.urandom(len(stock)))
+    before = bytes(other)
+    with pytest.raises(ValueError, match="STOCK"):
+        apply_sparse(other, patch)
+    assert bytes(other) == before
+
+
+def test_size_mismatch_and_corrupt_patch():
+    stock, mod = _pair(3)
+    patch = sparse_diff(stock, mod)
+    with pytest.raises(ValueError):
+        apply_sparse(bytearray(stock[:-1]), patch)
+    with pytest.raises(ValueError):
+        apply_sparse(bytearray(stock), patch[:-1])
+    broken = bytearray(patch)
+    broken[-1] ^= 0xFF
+    with pytest.raises(ValueError):
+        apply_sparse(bytearray(stock), bytes(broken))
+
+
+def test_applying_twice_is_rejected():
+    stock, mod = _pair(4)
+    patch = sparse_diff(stock, mod)
+    buf = bytearray(stock)
+    apply_sparse(buf, patch)
+    # los bytes viejos de las corridas ya no coinciden
+    with pytest.raises(ValueError):
+        apply_sparse(buf, patch)
+
+
+def test_verify_mod_checks_result_hash():
+    stock, mod = _pair(6)
+    patch = bytearray(sparse_diff(stock, mod))
+    # el sha256 del MOD es el último campo de la cabecera
+    patch[_SPARSE_HEADER.size - 1] ^= 0xFF
+    apply_sparse(bytearray(stock), bytes(patch))
+    with pytest.raises(ValueError, match="MOD"):
+        apply_sparse(bytearray(stock), bytes(patch), verify_mod=True)
+
+
+def test_build_patch_prefers_sparse_for_small_edits():
+    stock, mod = _pair(5, edits=4)
+    fmt, patch = build_patch(stock, mod)
+    assert fmt == "sparse"
+    assert bytes(apply_sparse(bytearray(stock), patch, verify_mod=True)) == mod
@@ -0,0 +1,66 @@
+# tests/test_storage.py
+import gc
+import threading
+import uuid
+
+from app.services import storage
+from app.services.storage import query_orders, save_order
+
+
+def _owner() -> str:
+    return f"{uuid.uuid4().hex}@test"
+
+
+def _orders(owner: str, created: list, status: str = "uploaded") -> list:
+    ids = []
+    for ts in created:
+        oid = str(uuid.uuid4())
+        storage.order_dir(oid)
+        save_order(oid, {"id": oid, "owner_email": owner, "status": status, "created_at": ts})
+        ids.append(oid)
+    return ids
+
+
+def test_cursor_pages_cover_all_orders_newest_first():
+    owner = _owner()
+    # timestamps repetidos: el desempate por id no puede perder ni repetir órdenes
+    created = [f"2026-01-0{1 + i // 3}T00:00:00" for i in range(8)]
+    ids = _orders(owner, created)
+    expected = [oid for _, oid in sorted(zip(created, ids), reverse=True)]
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        page, cursor = query_orders(owner_email=owner, limit=3, cursor=cursor)
+        seen += [o["id"] for o in page]
+        pages += 1
+        if cursor is None:
+            break
+    assert seen == expected
+    assert pages == 3
+
+
+def test_last_full_page_has_no_cursor():
+    owner = _owner()
+    _orders(owner, ["2026-02-01T00:00:00", "2026-02-02T00:00:00"])
+    page, cursor = query_orders(owner_email=owner, limit=2)
+    assert len(page) == 2 and cursor is None
+
+
+def test_status_filter():
+    owner = _owner()
+    _orders(owner, ["2026-03-01T00:00:00"], status="paid")
+    _orders(owner, ["2026-03-02T00:00:00"], status="uploaded")
+    page, _ = query_orders(owner_email=owner, status="paid")
+    assert [o["status"] for o in page] == ["paid"]
+
+
+def test_connections_of_finished_threads_are_released():
+    storage.index_db()
+    before = storage.OPEN_CONNECTIONS
+    threads = [threading.Thread(target=lambda: storage.index_db().execute("SELECT 1")) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    gc.collect()
+    assert storage.OPEN_CONNECTIONS == before
@@ -0,0 +1,59 @@
+# tests/test_token_cache.py
+import time
+
+from app.services.token_cache import TokenCache, now_ms
+
+USER = {"email": "a@test", "role": "user"}
+
+
+def _exp() -> int:
+    return int(time.time()) + 3600
+
+
+def test_hit_and_miss():
+    c = TokenCache()
+    assert c.get("t1") is None
+    c.put("t1", USER, exp=_exp(), issued_ms=now_ms())
+    assert c.get("t1") == USER
+    assert c.stats()["hits"] == 1 and c.stats()["misses"] == 1
+
+
+def test_revoke_same_second_token():
+    c = TokenCache()
+    issued = now_ms()
+    c.put("t1", USER, exp=_exp(), issued_ms=issued)
+    c.revoke(USER["email"], issued)
+    assert c.get("t1") is None
+    assert c.is_revoked(USER["email"], issued)
+    # emitido 1 ms después del revoke: vale
+    assert not c.is_revoked(USER["email"], issued + 1)
+    c.put("t2", USER, exp=_exp(), issued_ms=issued + 1)
+    assert c.get("t2") == USER
+
+
+def test_token_without_issue_time_is_revoked():
+    c = TokenCache()
+    c.revoke(USER["email"])
+    assert c.is_revoked(USER["email"], None)
+    assert not c.is_revoked("b@test", None)
+
+
+def test_expired_and_lru_eviction():
+    c = TokenCache(max_entries=2)
+    c.put("old", USER, exp=int(time.time()) - 1, issued_ms=now_ms())
+    assert c.get("old") is None
+    for t in ("a", "b", "c"):
+        c.put(t, USER, exp=_exp(), issued_ms=now_ms())
+    assert c.get("a") is None and c.get("c") == USER
+    assert c.stats()["evictions"] == 1
+
+
+def test_loader_revocations_apply():
+    c = TokenCache(recheck_s=3600)
+    issued = now_ms()
+    rows = []
+    c.set_loader(lambda since: [r for r in rows if r[1] >= since])
+    c.put("t1", USER, exp=_exp(), issued_ms=issued)
+    rows.append((USER["email"], issued + 5))
+    c.refresh()
+    assert c.get("t1") is None
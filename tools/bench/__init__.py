@@ -0,0 +1,2 @@
+# tools/bench: benchmark reproducible de los caminos calientes (analyze → patch → download).
+# Ver `python -m tools.bench --help`.
@@ -0,0 +1,158 @@
+# tools/bench/__main__.py
+# Uso (desde la raíz del repo):
+#   python -m tools.bench                                  # corre todo y compara con baseline.json
+#   python -m tools.bench --sizes 512K,8M --cases analyze_bin,tools.patch_apply.hex
+#   python -m tools.bench --save-baseline                  # fija el baseline actual
+#   python -m tools.bench --fail-on-regression             # exit 1 si algo empeora (CI / PRs)
+# baseline.json depende de la máquina: es local (no va al repo); sin él no se compara.
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# el store de análisis escribe en DATA_DIR: aislado en un temp salvo que se indique otro
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="efx-bench-data-"))
+
+from tools.bench import images
+from tools.bench.cases import CASES
+from tools.bench.runner import run_case
+
+ROOT = Path(__file__).resolve().parents[2]
+BASELINE = Path(__file__).resolve().parent / "baseline.json"
+DEFAULT_SIZES = "512K,2M,8M"
+
+# ruido: diferencias menores a esto (ms) no cuentan como regresión
+NOISE_FLOOR_MS = 0.5
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _meta() -> dict:
+    try:
+        import numpy
+        np_version = numpy.__version__
+    except ImportError:
+        np_version = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np_version,
+    }
+
+
+def compare(results: List[dict], baseline: dict, threshold: float) -> List[dict]:
+    base = {(r["case"], r["size"]): r for r in baseline.get("results", [])}
+    out = []
+    for r in results:
+        b = base.get((r["case"], r["size"]))
+        if b is None:
+            continue
+        ratio = r["p50_ms"] / b["p50_ms"] if b["p50_ms"] else None
+        regressed = (
+            ratio is not None
+            and ratio > 1 + threshold
+            and r["p50_ms"] - b["p50_ms"] > NOISE_FLOOR_MS
+        )
+        out.append({
+            "case": r["case"],
+            "size_label": r["size_label"],
+            "baseline_p50_ms": b["p50_ms"],
+            "p50_ms": r["p50_ms"],
+            "ratio": round(ratio, 3) if ratio is not None else None,
+            "regressed": regressed,
+        })
+    return out
+
+
+def _print_results(results: List[dict], comparison: List[dict]) -> None:
+    cmp = {(c["case"], c["size_label"]): c for c in comparison}
+    print(f"{'case':32} {'size':>5} {'p50 ms':>10} {'p90 ms':>10} {'MB/s':>9} {'RSS MB':>8} {'alloc MB':>9} "
+          f"{'vs base':>9}")
+    for r in results:
+        c = cmp.get((r["case"], r["size_label"]))
+        vs = "" if c is None else f"{c['ratio']:.2f}x" + (" !" if c["regressed"] else "")
+        print(f"{r['case']:32} {r['size_label']:>5} {r['p50_ms']:>10.2f} {r['p90_ms']:>10.2f} "
+              f"{(r['mb_s'] or 0):>9.1f} {(r['peak_rss_mb'] or 0):>8.1f} {r.get('alloc_peak_mb', 0):>9.1f} {vs:>9}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m tools.bench", description="Benchmark analyze → patch → download")
+    ap.add_argument("--sizes", default=DEFAULT_SIZES, help="tamaños separados por coma (512K,2M,8M)")
+    ap.add_argument("--cases", default=",".join(CASES), help="casos separados por coma")
+    ap.add_argument("--repeat", type=int, default=7)
+    ap.add_argument("--warmup", type=int, default=1)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", default="bench-report.json", help="reporte JSON de esta corrida")
+    ap.add_argument("--baseline", default=str(BASELINE))
+    ap.add_argument("--save-baseline", action="store_true", help="escribe el reporte también como baseline")
+    ap.add_argument("--threshold", type=float, default=0.10, help="regresión si p50 > baseline*(1+threshold)")
+    ap.add_argument("--fail-on-regression", action="store_true")
+    ap.add_argument("--no-isolate", action="store_true", help="todo en este proceso (RSS no separado por caso)")
+    args = ap.parse_args(argv)
+
+    names = [c.strip() for c in args.cases.split(",") if c.strip()]
+    unknown = [n for n in names if n not in CASES]
+    if unknown:
+        ap.error(f"casos desconocidos: {', '.join(unknown)} (disponibles: {', '.join(CASES)})")
+    sizes = [images.parse_size(s) for s in args.sizes.split(",") if s.strip()]
+
+    jobs = [(n, s) for n in names for s in sizes]
+    results: List[dict] = []
+    if args.no_isolate:
+        for n, s in jobs:
+            results.append(run_case(n, s, args.repeat, args.warmup, args.seed))
+    else:
+        # un proceso por caso: peak RSS comparable y sin caches calientes entre casos
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx, max_tasks_per_child=1) as pool:
+            for n, s in jobs:
+                results.append(pool.submit(run_case, n, s, args.repeat, args.warmup, args.seed).result())
+
+    report: Dict = {"meta": _meta(), "params": {"repeat": args.repeat, "warmup": args.warmup, "seed": args.seed},
+                    "results": results}
+
+    comparison: List[dict] = []
+    baseline_path = Path(args.baseline)
+    if baseline_path.exists() and not args.save_baseline:
+        baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+        comparison = compare(results, baseline, args.threshold)
+        report["baseline"] = {"path": str(baseline_path), "meta": baseline.get("meta"), "threshold": args.threshold}
+        report["comparison"] = comparison
+
+    _print_results(results, comparison)
+    Path(args.out).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"[i] reporte: {args.out}")
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"[i] baseline actualizado: {baseline_path}")
+
+    regressions = [c for c in comparison if c["regressed"]]
+    if regressions:
+        print(f"[!] {len(regressions)} regresión(es) vs baseline (>{args.threshold:.0%})")
+        if args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
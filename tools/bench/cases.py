@@ -0,0 +1,343 @@
+# tools/bench/cases.py
+# Casos del benchmark. Cada caso se prepara una vez por imagen con setup(img) → (fresh, run):
+#   fresh() arma la entrada de una iteración (fuera del cronómetro, p.ej. copiar el buffer)
+#   run(arg) es exactamente lo que se mide
+from __future__ import annotations
+
+import asyncio
+import io
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, Tuple
+
+from tools.bench import images
+
+Setup = Callable[[bytes], Tuple[Callable[[], Any], Callable[[Any], Any]]]
+
+
+@dataclass(frozen=True)
+class Case:
+    name: str
+    setup: Setup
+    # fracción de --repeat (los casos lentos como bsdiff corren menos veces)
+    repeat_scale: float = 1.0
+
+
+def _compile(yaml_text: str, name: str):
+    from app.services.recipe_registry import compile_recipe
+    return compile_recipe(f"<bench:{name}>", yaml_text.encode("utf-8"))
+
+
+# -----------------------------
+# analyze_bin (router público)
+# -----------------------------
+def _analyze_bin(img: bytes):
+    from starlette.datastructures import UploadFile
+    from app.routers.public import analyze_bin
+
+    def fresh():
+        return UploadFile(io.BytesIO(img), filename="bench.bin")
+
+    def run(upload):
+        return asyncio.run(analyze_bin(upload))
+
+    return fresh, run
+
+
+# -----------------------------
+# detección de familia / PN / SW (una pasada con todos los marcadores)
+# -----------------------------
+def _fingerprint(img: bytes):
+    from app.services.ecu_fingerprint import detect_fingerprint
+
+    detect_fingerprint(img[:64])  # compila el índice fuera del cronómetro
+    return (lambda: None), (lambda _: detect_fingerprint(img))
+
+
+# -----------------------------
+# services/patcher.apply_patch
+# -----------------------------
+def _patcher(img: bytes):
+    from app.services.patcher import apply_patch
+
+    patch_def = {
+        "id": "bench_padding",
+        "actions": [{
+            "type": "patch_in_padding",
+            "needle_hex": images.PADDING_NEEDLE.hex(),
+            "write_ascii": "EFX-BENCH",
+        }],
+    }
+    return (lambda: None), (lambda _: apply_patch(img, patch_def))
+
+
+# varias acciones encadenadas sobre la misma orden (el caso que más copias hacía)
+PIPELINE_PATCH = {
+    "id": "bench_padding_pipeline",
+    "actions": [{
+        "type": "patch_in_padding",
+        "needle_hex": images.PADDING_NEEDLE.hex(),
+        "write_ascii": f"EFX-BENCH-{i}",
+    } for i in range(6)],
+}
+
+
+def _patcher_pipeline(img: bytes):
+    from app.services.patcher import apply_patch
+
+    return (lambda: None), (lambda _: apply_patch(img, PIPELINE_PATCH))
+
+
+def _patcher_pipeline_offsets(img: bytes):
+    # create_order con los offsets que dejó analyze_bin: sin búsquedas
+    from app.services.applicability import precompute
+    from app.services.patcher import apply_patch
+
+    offsets = precompute(img, [PIPELINE_PATCH])[0][PIPELINE_PATCH["id"]]["offsets"]
+    return (lambda: None), (lambda _: apply_patch(img, PIPELINE_PATCH, offsets))
+
+
+def _applicability(img: bytes):
+    from app.services.applicability import precompute
+
+    missing = {"id": "bench_missing", "actions": [{
+        "type": "patch_in_padding", "needle_hex": "5A" * 24, "write_ascii": "X"}]}
+    return (lambda: None), (lambda _: precompute(img, [PIPELINE_PATCH, missing]))
+
+
+# -----------------------------
+# services/patch_exec._apply_yaml
+# -----------------------------
+PATCH_EXEC_RECIPE = f"""
+id: bench_exec
+guards:
+  min_size: 1024
+ops:
+  - patch:
+      find_hex: "{images.HEX_MARKER.hex(' ').upper()}"
+      replace_hex: "DE AD BE EF 00 02"
+      count: {images.HEX_MARKER_COPIES}
+  - write:
+      at: "0x100"
+      hex: "45 46 58 42"
+post:
+  - checksum:
+      type: crc32
+"""
+
+
+def _patch_exec(img: bytes):
+    from app.services.patch_exec import _apply_yaml
+
+    recipe = _compile(PATCH_EXEC_RECIPE, "patch_exec")
+    return (lambda: bytearray(img)), (lambda buf: _apply_yaml(buf, recipe))
+
+
+def _patch_exec_checksums(img: bytes):
+    # mismas ops + dos bloques (crc32 y sum16) que cubren casi todo el binario
+    from app.services.checksums import fix_blocks, parse_blocks
+    from app.services.patch_exec import _apply_yaml
+
+    n = len(img)
+    blocks = f"""
+      blocks:
+        - {{name: cal, algo: crc32, start: 0, end: {n // 2}, at: {n - 16}}}
+        - {{name: rest, algo: sum16, start: {n // 2}, end: {n - 64}, at: {n - 12}, endian: be}}
+"""
+    recipe = _compile(PATCH_EXEC_RECIPE + blocks, "patch_exec_checksums")
+    stock = bytearray(img)
+    fix_blocks(stock, parse_blocks(recipe.get("post")[0]["checksum"]["blocks"]))
+    return (lambda: bytearray(stock)), (lambda buf: _apply_yaml(buf, recipe))
+
+
+# -----------------------------
+# services/patch_engine (bsdiff / sparse)
+# -----------------------------
+def _engine_create(fmt: str):
+    def setup(img: bytes):
+        from app.services.patch_engine import create_patch
+
+        mod = images.make_mod(img)
+        out = Path(tempfile.mkdtemp(prefix="efx-bench-"))
+        return (lambda: None), (lambda _: create_patch(img, mod, out, formats=(fmt,)))
+    return setup
+
+
+def _engine_apply(fmt: str):
+    def setup(img: bytes):
+        from app.services.patch_engine import apply_patch, create_patch
+
+        mod = images.make_mod(img)
+        out = Path(tempfile.mkdtemp(prefix="efx-bench-"))
+        create_patch(img, mod, out, formats=(fmt,))
+        return (lambda: None), (lambda _: apply_patch(img, out))
+    return setup
+
+
+# -----------------------------
+# tools/patch_apply (ops hex y numéricas)
+# -----------------------------
+TOOLS_HEX_RECIPE = f"""
+id: bench_tools_hex
+ops:
+  - find_hex: "{images.HEX_MARKER.hex(' ').upper()}"
+    replace_hex: "DE AD BE EF 00 03"
+  - find_hex: "{images.SW_NUMBER.hex(' ').upper()}"
+    replace_hex: "{images.SW_NUMBER.hex(' ').upper()}"
+  - find_hex: "{images.ECU_LABEL.hex(' ').upper()}"
+    replace_hex: "{images.ECU_LABEL.hex(' ').upper()}"
+  - find_hex: "{images.DTC_BLOCK[:10].hex(' ').upper()}"
+    replace_hex: "{b'P0000P0000'.hex(' ').upper()}"
+  - find_hex: "00 11 22 33 44 55 66 77"
+    replace_hex: "77 66 55 44 33 22 11 00"
+"""
+
+TOOLS_NUMERIC_RECIPE = f"""
+id: bench_tools_numeric
+ops:
+  - value_find:
+      kind: u16
+      value: {images.U16_TARGET}
+      replace_value: 7000
+      align: 2
+  - value_find:
+      kind: f32
+      value: {images.F32_TARGET}
+      tol: 0.001
+      replace_value: 1.25
+      align: 4
+  - value_find:
+      kind: u32
+      value: 123456789
+      endian: be
+"""
+
+
+# -----------------------------
+# multi_pattern: N finds vs un barrido (justifica VECTOR_MIN_PATTERNS)
+# -----------------------------
+def _bench_patterns(img: bytes, count: int) -> list:
+    # patrones de 4-8 bytes tomados del binario y poco repetidos (como los find_hex reales)
+    import random
+
+    rnd = random.Random(count)
+    out = []
+    while len(out) < count:
+        i = rnd.randrange(len(img) - 8)
+        p = img[i:i + rnd.choice((4, 6, 8))]
+        if img.count(p) <= 4:
+            out.append(p)
+    return out
+
+
+def _multi_pattern(count: int, sweep: bool):
+    def setup(img: bytes):
+        from app.services.multi_pattern import PatternSet, _find_scalar
+
+        ps = PatternSet(_bench_patterns(img, count))
+        if sweep:
+            return (lambda: None), (lambda _: ps._sweep(img))
+        return (lambda: None), (lambda _: [_find_scalar(img, p) for p in ps.patterns])
+    return setup
+
+
+def _tools_ops(yaml_text: str, name: str):
+    def setup(img: bytes):
+        from tools.patch_apply import _apply_ops
+
+        recipe = _compile(yaml_text, name)
+        return (lambda: bytearray(img)), (lambda buf: _apply_ops(buf, recipe.ops, recipe.path))
+    return setup
+
+
+def _tools_file(mode: str):
+    # apply_patch completo (archivo → archivo) con recetas en un RECIPES_DIR temporal
+    def setup(img: bytes):
+        import tools.patch_apply as pa
+
+        root = Path(tempfile.mkdtemp(prefix="efx-bench-"))
+        fam = root / "recipes" / "EDC17"
+        fam.mkdir(parents=True)
+        (fam / "bench_tools_hex.yml").write_text(
+            TOOLS_HEX_RECIPE + f'selectors:\n  ascii_contains: ["{images.ECU_LABEL.decode()}"]\n',
+            encoding="utf-8")
+        pa.RECIPES_DIR = root / "recipes"
+        src = root / "EDC17_bench.bin"
+        src.write_bytes(img)
+        dst = root / "out.bin"
+        return (lambda: None), (lambda _: pa.apply_patch(str(src), str(dst), "bench_tools_hex", mode=mode))
+    return setup
+
+
+# -----------------------------
+# auth: get_current_user por request (1000 requests por corrida; no depende del tamaño)
+# -----------------------------
+AUTH_REQUESTS = 1000
+
+
+def _auth(cached: bool):
+    def setup(img: bytes):
+        from app.routers.auth import TOKENS, get_current_user, make_token, verify_token
+
+        header = f"Bearer {make_token('bench@example.com')}"
+        token = header.split()[1]
+
+        def run(_):
+            if cached:
+                for _ in range(AUTH_REQUESTS):
+                    get_current_user(header)
+            else:
+                for _ in range(AUTH_REQUESTS):
+                    verify_token(token)
+                TOKENS.clear()
+        return (lambda: None), run
+    return setup
+
+
+# -----------------------------
+# descarga: variantes gzip/zstd + manifest (se generan una vez por mod)
+# -----------------------------
+def _publish(img: bytes):
+    from app.services.mod_variants import publish
+
+    out = Path(tempfile.mkdtemp(prefix="efx-bench-")) / "output.mod.bin"
+    out.write_bytes(img)
+    return (lambda: None), (lambda _: publish(out, img))
+
+
+# -----------------------------
+# escáner de DTCs (ASCII + tablas u16) sobre un mmap del archivo
+# -----------------------------
+def _dtc_scan(img: bytes):
+    from app.services.dtc_scanner import scan_file
+
+    path = Path(tempfile.mkdtemp(prefix="efx-bench-")) / "dtc.bin"
+    path.write_bytes(img)
+    return (lambda: None), (lambda _: scan_file(path))
+
+
+CASES: Dict[str, Case] = {c.name: c for c in (
+    Case("analyze_bin", _analyze_bin),
+    Case("ecu_fingerprint.detect", _fingerprint),
+    Case("patcher.apply_patch", _patcher),
+    Case("patcher.pipeline", _patcher_pipeline),
+    Case("patcher.pipeline_offsets", _patcher_pipeline_offsets),
+    Case("applicability.precompute", _applicability),
+    Case("patch_exec._apply_yaml", _patch_exec),
+    Case("patch_exec.checksums", _patch_exec_checksums),
+    Case("patch_engine.create_patch", _engine_create("bsdiff"), repeat_scale=0.4),
+    Case("patch_engine.apply_patch", _engine_apply("bsdiff")),
+    Case("patch_engine.sparse_create", _engine_create("sparse")),
+    Case("patch_engine.sparse_apply", _engine_apply("sparse")),
+    *(Case(f"multi_pattern.{'sweep' if sweep else 'scalar'}_{n}", _multi_pattern(n, sweep))
+      for n in (4, 6, 12) for sweep in (False, True)),
+    Case("tools.patch_apply.hex", _tools_ops(TOOLS_HEX_RECIPE, "tools_hex")),
+    Case("tools.patch_apply.numeric", _tools_ops(TOOLS_NUMERIC_RECIPE, "tools_numeric")),
+    Case("tools.patch_apply.file_copy", _tools_file("copy")),
+    Case("tools.patch_apply.file_mmap", _tools_file("mmap")),
+    Case("mod_variants.publish", _publish, repeat_scale=0.4),
+    Case("auth.verify_token", _auth(cached=False)),
+    Case("auth.get_current_user", _auth(cached=True)),
+    Case("dtc_scanner.scan_file", _dtc_scan),
+)}
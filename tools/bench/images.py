@@ -0,0 +1,103 @@
+# tools/bench/images.py
+# Imágenes ECU sintéticas y deterministas (misma semilla → mismos bytes) para el benchmark.
+# Layout aproximado de un dump real:
+#   ~12% código (entropía alta) | ~30% calibración (mapas u16/f32) | resto padding 0xFF con bloques 0x00
+# con strings de identificación (SW/HW/ECU), bloques DTC ascii y marcadores para las ops de parche.
+from __future__ import annotations
+
+import random
+import struct
+
+SW_NUMBER = b"SW1037527034"
+HW_NUMBER = b"0281031234"
+ECU_LABEL = b"EDC17C81"
+DTC_BLOCK = b"P0401P2002P0299U0100P0087P0088"
+
+# marcador que las recetas del benchmark buscan/reemplazan
+HEX_MARKER = bytes.fromhex("DEADBEEF0001")
+HEX_MARKER_COPIES = 8
+
+# valores que las ops numéricas buscan
+U16_TARGET = 8000
+F32_TARGET = 1.5
+NUMERIC_COPIES = 32
+
+# needle de padding para patcher.patch_in_padding
+PADDING_NEEDLE = b"\xFF" * 64
+
+
+def parse_size(text: str) -> int:
+    t = text.strip().upper()
+    mult = 1
+    if t.endswith("K"):
+        mult, t = 1024, t[:-1]
+    elif t.endswith("M"):
+        mult, t = 1024 * 1024, t[:-1]
+    return int(float(t) * mult)
+
+
+def size_label(size: int) -> str:
+    if size % (1024 * 1024) == 0:
+        return f"{size // (1024 * 1024)}M"
+    if size % 1024 == 0:
+        return f"{size // 1024}K"
+    return str(size)
+
+
+def make_image(size: int, seed: int = 0) -> bytes:
+    rng = random.Random(seed * 1_000_003 + size)
+    buf = bytearray(b"\xFF") * size
+
+    # código
+    code_end = int(size * 0.12)
+    buf[0:code_end] = rng.randbytes(code_end)
+
+    # calibración: mapas 16x16 u16 LE con rampas suaves + ruido
+    cal_start, cal_end = code_end, code_end + int(size * 0.30)
+    pos = cal_start
+    while pos + 512 <= cal_end:
+        base = rng.randrange(500, 5000)
+        step = rng.randrange(1, 40)
+        row = [min(0xFFFF, base + step * i + rng.randrange(0, 8)) for i in range(256)]
+        buf[pos:pos + 512] = struct.pack("<256H", *row)
+        pos += 512 + rng.randrange(0, 64) * 2
+
+    # bloques 0x00 en la zona de padding
+    pad_start = cal_end
+    for _ in range(max(1, size // (256 * 1024))):
+        at = rng.randrange(pad_start, max(pad_start + 1, size - 8192))
+        buf[at:at + 4096] = b"\x00" * 4096
+
+    def put(data: bytes, lo: int, hi: int) -> int:
+        at = rng.randrange(lo, max(lo + 1, hi - len(data)))
+        buf[at:at + len(data)] = data
+        return at
+
+    # identificación (en la zona de código, como en los dumps reales)
+    put(SW_NUMBER, 0x100, code_end)
+    put(HW_NUMBER, 0x100, code_end)
+    put(ECU_LABEL, 0x100, code_end)
+    put(DTC_BLOCK, 0x100, code_end)
+
+    # marcadores para las recetas (hex y numéricos) dentro de calibración
+    for _ in range(HEX_MARKER_COPIES):
+        put(HEX_MARKER, cal_start, cal_end)
+    for _ in range(NUMERIC_COPIES):
+        at = rng.randrange(cal_start // 2, cal_end // 2) * 2
+        buf[at:at + 2] = struct.pack("<H", U16_TARGET)
+        at = rng.randrange(cal_start // 4, cal_end // 4) * 4
+        buf[at:at + 4] = struct.pack("<f", F32_TARGET)
+
+    return bytes(buf)
+
+
+def make_mod(image: bytes, edits: int = 64, seed: int = 1) -> bytes:
+    """Versión "tuneada": pocos cambios dispersos en calibración (lo que genera un bsdiff real)."""
+    rng = random.Random(seed * 7919 + len(image))
+    buf = bytearray(image)
+    lo, hi = int(len(image) * 0.12), int(len(image) * 0.42)
+    for _ in range(edits):
+        at = rng.randrange(lo, hi - 32)
+        n = rng.randrange(2, 32)
+        buf[at:at + n] = rng.randbytes(n)
+    return bytes(buf)
@@ -0,0 +1,80 @@
+# tools/bench/runner.py
+# Ejecución y medición de un caso. Vive fuera de __main__ para que el pool (spawn) pueda importarlo.
+from __future__ import annotations
+
+import math
+import sys
+import time
+import tracemalloc
+from typing import List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from tools.bench import images
+from tools.bench.cases import CASES
+
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux: KB, macOS: bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 2)
+
+
+def _percentile(sorted_vals: List[float], p: float) -> float:
+    # nearest-rank: con pocas muestras no interpola valores que nunca ocurrieron
+    k = max(0, math.ceil(p / 100 * len(sorted_vals)) - 1)
+    return sorted_vals[k]
+
+
+def run_case(name: str, size: int, repeat: int, warmup: int, seed: int) -> dict:
+    """Corre un caso en el proceso actual (en el runner: un proceso nuevo por caso → RSS limpio)."""
+    case = CASES[name]
+    img = images.make_image(size, seed)
+    fresh, run = case.setup(img)
+    n = max(1, int(round(repeat * case.repeat_scale)))
+
+    for _ in range(warmup):
+        run(fresh())
+    rss_before = _peak_rss_mb()
+
+    times = []
+    for _ in range(n):
+        arg = fresh()
+        t0 = time.perf_counter()
+        run(arg)
+        times.append(time.perf_counter() - t0)
+    rss_after = _peak_rss_mb()
+
+    # una corrida extra (fuera del cronómetro) con tracemalloc: pico de memoria
+    # asignada por Python durante el caso (copias de buffers, resultados intermedios)
+    arg = fresh()
+    tracemalloc.start()
+    try:
+        run(arg)
+        _, alloc_peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del arg
+
+    ts = sorted(times)
+    p50 = _percentile(ts, 50)
+    return {
+        "case": name,
+        "size": size,
+        "size_label": images.size_label(size),
+        "repeat": n,
+        "min_ms": round(ts[0] * 1000, 3),
+        "p50_ms": round(p50 * 1000, 3),
+        "p90_ms": round(_percentile(ts, 90) * 1000, 3),
+        "p99_ms": round(_percentile(ts, 99) * 1000, 3),
+        "mean_ms": round(sum(ts) / len(ts) * 1000, 3),
+        "mb_s": round(size / (1024 * 1024) / p50, 2) if p50 > 0 else None,
+        "peak_rss_mb": rss_after,
+        "rss_delta_mb": round(rss_after - rss_before, 2) if rss_after is not None else None,
+        "alloc_peak_mb": round(alloc_peak / (1024 * 1024), 2),
+    }
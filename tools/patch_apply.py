@@ -1,18 +1,36 @@
 # tools/patch_apply.py
 # Motor PRO: aplica recetas YAML por patrones (hex + numéricos) con selectores por ECU/SW/CVN.
 from __future__ import annotations
-import os, re, struct, glob, json
+import os, re, struct, glob, json, mmap, shutil, sys
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
 try:
     import yaml  # PyYAML
 except Exception as e:
     raise RuntimeError("PyYAML requerido. Agrega 'PyYAML' a requirements.txt") from e
 
+from app.services.multi_pattern import FusedHexSearch, OnWrite, PatternSet, replace_occurrences
+from app.services.numeric_search import NumberQuery, FusedNumberSearch, find_numbers
+from app.services.recipe_registry import CompiledRecipe, HexOp, NumberOp, Op, load_recipe
+
 ROOT = Path(__file__).resolve().parents[1]   # repo root
 RECIPES_DIR = ROOT / "store" / "recipes"
 
+# modos de apply_patch:
+#   copy: lee src a un bytearray y escribe dst al final (admite ops que cambian el largo)
+#   mmap: clona src → dst (reflink/copy_file_range) y aplica selectores y ops sobre el mapeo
+MODES = ("copy", "mmap")
+
+# ioctl FICLONE (linux/fs.h): reflink en btrfs/xfs/overlayfs, O(1) y sin duplicar bloques
+FICLONE = 0x40049409
+
 # -------------------------------
 # Utils
 # -------------------------------
@@ -24,25 +42,17 @@ def _write_bytes(path: Path, data: bytes) -> None:
     with open(path, "wb") as f:
         f.write(data)
 
-def _hex_to_bytes(s: str) -> bytes:
-    s = re.sub(r"[^0-9A-Fa-f]", " ", s or "")
-    parts = [p for p in s.split() if p]
-    return bytes(int(p, 16) for p in parts)
-
-def _pack_number(kind: str, value: float, endian: str="le") -> bytes:
-    """Empaqueta número según tipo/endian."""
-    e = "<" if endian.lower().startswith("le") else ">"
-    k = kind.lower()
-    if   k == "u8":  return struct.pack("B", int(value) & 0xFF)
-    elif k == "i8":  return struct.pack("b", int(value))
-    elif k == "u16": return struct.pack(e+"H", int(value) & 0xFFFF)
-    elif k == "i16": return struct.pack(e+"h", int(value))
-    elif k == "u32": return struct.pack(e+"I", int(value) & 0xFFFFFFFF)
-    elif k == "i32": return struct.pack(e+"i", int(value))
-    elif k == "f32": return struct.pack(e+"f", float(value))
-    elif k == "f64": return struct.pack(e+"d", float(value))
-    else:
-        raise ValueError(f"tipo numérico no soportado: {kind}")
+def _fast_copy(src: Path, dst: Path) -> str:
+    """Copia src → dst sin pasar los bytes por Python. Devuelve el método usado."""
+    if fcntl is not None and sys.platform.startswith("linux"):
+        try:
+            with open(src, "rb") as fs, open(dst, "wb") as fd:
+                fcntl.ioctl(fd.fileno(), FICLONE, fs.fileno())
+            return "reflink"
+        except OSError:
+            pass  # otro filesystem / sin soporte: copia en kernel
+    shutil.copyfile(src, dst)  # Linux: sendfile / copy_file_range
+    return "copy"
 
 def _iter_number_matches(buf: bytes, kind: str, target: float, *, endian="le", tol=0, align=None, scale=None) -> List[int]:
     """
@@ -51,85 +61,47 @@ def _iter_number_matches(buf: bytes, kind: str, target: float, *, endian="le", t
     tol:   para floats: diferencia absoluta aceptada; para enteros: ±tol
     align: si se define, solo índices % align == 0
     """
-    k = kind.lower()
-    size_map = {"u8":1,"i8":1,"u16":2,"i16":2,"u32":4,"i32":4,"f32":4,"f64":8}
-    sz = size_map.get(k)
-    if not sz: raise ValueError(f"tipo no soportado: {kind}")
-    e = "<" if endian.lower().startswith("le") else ">"
-
-    # valor esperado
-    if scale not in (None, 1):
-        target_eff = target * float(scale)
-    else:
-        target_eff = target
-
-    hits = []
-    i = 0
-    limit = len(buf) - sz
-    while i <= limit:
-        if align and (i % align) != 0:
-            i += 1; continue
-        chunk = buf[i:i+sz]
-        try:
-            if   k == "u8":  val = struct.unpack("B", chunk)[0]
-            elif k == "i8":  val = struct.unpack("b", chunk)[0]
-            elif k == "u16": val = struct.unpack(e+"H", chunk)[0]
-            elif k == "i16": val = struct.unpack(e+"h", chunk)[0]
-            elif k == "u32": val = struct.unpack(e+"I", chunk)[0]
-            elif k == "i32": val = struct.unpack(e+"i", chunk)[0]
-            elif k == "f32": val = struct.unpack(e+"f", chunk)[0]
-            elif k == "f64": val = struct.unpack(e+"d", chunk)[0]
-        except struct.error:
-            i += 1; continue
-
-        ok = False
-        if k.startswith(("f32","f64")):
-            ok = abs(float(val) - float(target_eff)) <= float(tol or 0)
-        else:
-            ok = (int(val) >= int(target_eff - (tol or 0)) and int(val) <= int(target_eff + (tol or 0)))
+    q = NumberQuery.build(kind, target, endian=endian, tol=tol, align=align, scale=scale)
+    return find_numbers(buf, [q])[0]
 
-        if ok:
-            hits.append(i)
-        i += 1
-    return hits
-
-def _apply_hex(buf: bytearray, find_b: bytes, repl_b: bytes, *, expect: Optional[int]=None) -> int:
-    cnt = 0
-    i = 0
+def _apply_hex(buf: bytearray, find_b: bytes, repl_b: bytes, *, expect: Optional[int]=None,
+               hits: Optional[List[int]]=None, on_write: Optional[OnWrite]=None) -> int:
     L = len(find_b)
     if L == 0: return 0
-    while True:
-        j = buf.find(find_b, i)
-        if j < 0: break
-        buf[j:j+L] = repl_b
-        cnt += 1
-        i = j + len(repl_b)  # continuar luego del reemplazo
+    if hits is None:
+        hits = PatternSet([find_b]).find_all(buf)[0]
+    # reemplazo en orden de offset; el siguiente match se busca luego del reemplazo
+    cnt = replace_occurrences(buf, hits, L, repl_b, on_write=on_write)
     if expect is not None and cnt < expect:
         raise RuntimeError(f"find_hex esperaba >= {expect} match(es) y encontró {cnt}")
     return cnt
 
-def _apply_number(buf: bytearray, op: Dict[str, Any]) -> int:
-    kind   = op["kind"]               # u16,u32,f32,f64...
-    value  = float(op["value"])
-    endian = op.get("endian","le")
-    tol    = float(op.get("tol", 0))
-    align  = op.get("align")          # ej. 2 o 4 si sabes que está alineado
-    scale  = op.get("scale")          # ej. km/h→unidad interna
-    expect = op.get("expect")         # mínimo de aciertos esperados
-    replace_value = float(op.get("replace_value", value))
-    replace_scale = op.get("replace_scale", scale)
-
-    hits = _iter_number_matches(buf, kind, value, endian=endian, tol=tol, align=align, scale=scale)
-    if not hits and expect:
-        raise RuntimeError(f"value_find {kind} no encontró coincidencias (expect>0). value={value}, tol={tol}")
-
-    repl_bytes = _pack_number(kind, replace_value * (float(replace_scale) if replace_scale not in (None,1) else 1), endian=endian)
+def _apply_number(buf: bytearray, op: NumberOp, *, hits: Optional[List[int]]=None,
+                  on_write: Optional[OnWrite]=None) -> int:
+    # op compilada: query (kind/endian/tol/align/scale) + repl ya empaquetado
+    if hits is None:
+        hits = find_numbers(buf, [op.query])[0]
+    if not hits and op.expect:
+        raise RuntimeError(f"value_find {op.kind} no encontró coincidencias (expect>0). value={op.value}, tol={op.tol}")
+
     for pos in hits:
-        buf[pos:pos+len(repl_bytes)] = repl_bytes
+        buf[pos:pos+len(op.repl)] = op.repl
+        if on_write is not None:
+            on_write(pos, pos + len(op.repl))
     return len(hits)
 
-def _matches_selectors(buf: bytes, sel: Dict[str, Any]) -> bool:
-    """Evalúa selectores: sw_contains[], cvn_in[], size_between[], regex_any[]"""
+@lru_cache(maxsize=256)
+def _selector_regex(pat) -> "re.Pattern":
+    # el buffer son bytes: patrones str → latin-1 (1 carácter = 1 byte)
+    if isinstance(pat, str):
+        pat = pat.encode("latin-1")
+    return re.compile(pat, flags=re.DOTALL)
+
+def _matches_selectors(buf, sel: Dict[str, Any]) -> bool:
+    """
+    Evalúa selectores: sw_contains[], cvn_in[], size_between[], regex_any[]
+    Directo sobre el buffer (bytearray o mmap): sin copias ni decode del binario.
+    """
     if not sel: return True
     # SW / CVN / size pueden venir de otra capa. Aquí hacemos heurística con regex/bytes.
     size_between = sel.get("size_between")
@@ -139,41 +111,104 @@ def _matches_selectors(buf: bytes, sel: Dict[str, Any]) -> bool:
 
     regex_any = sel.get("regex_any", [])
     for pat in regex_any:
-        if not re.search(pat, buf, flags=re.DOTALL):
+        try:
+            rx = _selector_regex(pat)
+        except UnicodeEncodeError:
+            return False
+        if not rx.search(buf):
             return False
 
-    # Permite matches por "markers" en ASCII (útil cuando el SW imprime cadenas)
+    # Permite matches por "markers" en ASCII (útil cuando el SW imprime cadenas);
+    # buscar los bytes latin-1 equivale a buscar en buf.decode("latin-1")
     ascii_contains = sel.get("ascii_contains", [])
-    view = None
-    if ascii_contains:
+    for s in ascii_contains:
         try:
-            view = buf.decode("latin-1", "ignore")
-        except Exception:
-            view = ""
-        for s in ascii_contains:
-            if s not in view:
-                return False
+            needle = s.encode("latin-1")
+        except UnicodeEncodeError:
+            return False
+        if buf.find(needle) < 0:
+            return False
 
     return True
 
+def _apply_ops(buf: bytearray, ops: Sequence[Op], path: Optional[str]=None,
+               overlaps: Optional[List[dict]]=None) -> int:
+    """
+    Aplica las ops en orden de archivo. Todas las `find_hex` de la receta se
+    buscan en un solo barrido multi-patrón (FusedHexSearch) y todas las
+    `value_find` en una sola pasada vectorizada (FusedNumberSearch); las
+    escrituras de ops anteriores se revalidan localmente, así los resultados son
+    los mismos que si cada op escaneara el buffer completo.
+    Si se pasa `overlaps`, se le agregan los matches de find_hex que una op
+    anterior pisó o creó: [{"op", "offset"}].
+    """
+    hex_index = [i for i, op in enumerate(ops) if isinstance(op, HexOp) and op.key == "find_hex"]
+    hexes = [ops[i] for i in hex_index]
+    nums = [op for op in ops if isinstance(op, NumberOp)]
+    hsearch = FusedHexSearch([op.find for op in hexes]) if hexes else None
+    nsearch = FusedNumberSearch([op.query for op in nums]) if nums else None
+    searches = [x for x in (hsearch, nsearch) if x is not None]
+
+    def mark(start: int, end: int) -> None:
+        for x in searches:
+            x.mark(start, end)
+
+    changed = 0
+    hi = qi = 0
+    for op in ops:
+        before = len(buf)
+        if isinstance(op, HexOp) and op.key == "find_hex":
+            changed += _apply_hex(buf, op.find, op.repl, expect=op.expect,
+                                  hits=hsearch.occurrences(hi, buf), on_write=mark)
+            hi += 1
+        elif isinstance(op, NumberOp):
+            changed += _apply_number(buf, op, hits=nsearch.hits(qi, buf), on_write=mark)
+            qi += 1
+        else:
+            raise RuntimeError(f"Operación no soportada en {path}: {getattr(op, 'raw', op)}")
+        if len(buf) != before:
+            for x in searches:
+                x.invalidate()  # offsets desplazados → re-escanear lo pendiente
+    if overlaps is not None and hsearch is not None:
+        overlaps.extend(hsearch.overlap_report(hex_index))
+    return changed
+
 # -------------------------------
 # Carga y aplicación
 # -------------------------------
-def _load_family_recipes(family: str) -> List[Dict[str, Any]]:
-    paths = sorted(glob.glob(str((RECIPES_DIR / family).glob("*.yml"))))
+# batch: cada worker precarga las recetas una vez (ver preload_recipes)
+_PRELOADED: Optional[Dict[str, List[CompiledRecipe]]] = None
+
+def preload_recipes() -> Dict[str, int]:
+    """
+    Carga todas las familias de RECIPES_DIR una vez y las fija en memoria para este
+    proceso: detectar familia y cargar recetas dejan de tocar el disco. Devuelve
+    {familia: n_recetas}.
+    """
+    global _PRELOADED
+    _PRELOADED = None
+    fams = sorted(d.name for d in RECIPES_DIR.iterdir() if d.is_dir()) if RECIPES_DIR.exists() else []
+    loaded = {fam: _load_family_recipes(fam) for fam in fams}
+    _PRELOADED = loaded
+    return {fam: len(recs) for fam, recs in loaded.items()}
+
+def _load_family_recipes(family: str) -> List[CompiledRecipe]:
+    if _PRELOADED is not None:
+        return _PRELOADED.get(family, [])
+    # recetas compiladas y cacheadas por el registro compartido (mtime/size)
+    paths = sorted((RECIPES_DIR / family).glob("*.yml"))
     out = []
     for p in paths:
         try:
-            data = yaml.safe_load(Path(p).read_text(encoding="utf-8")) or {}
-            data["_path"] = p
-            out.append(data)
+            out.append(load_recipe(p))
         except Exception as e:
             raise RuntimeError(f"Error cargando receta {p}: {e}")
     return out
 
 def _detect_family_from_name(name: str) -> Optional[str]:
     up = name.upper()
-    for fam in [d.name for d in RECIPES_DIR.iterdir() if d.is_dir()]:
+    fams = list(_PRELOADED) if _PRELOADED is not None else [d.name for d in RECIPES_DIR.iterdir() if d.is_dir()]
+    for fam in fams:
         if fam.upper() in up:
             return fam
     # heurística simple
@@ -183,63 +218,105 @@ def _detect_family_from_name(name: str) -> Optional[str]:
     if "EDC17" in up: return "EDC17"
     return None
 
-def apply_patch(src_path: str, dst_path: str, patch_id: str) -> None:
+def _targets_patch(rec: CompiledRecipe, patch_id: str) -> bool:
+    meta = rec.get("meta", {})
+    rid  = _recipe_id(rec)
+    targets = meta.get("patch_ids") or [meta.get("patch_id"), rid]
+    targets = [t for t in targets if t]
+    return not targets or patch_id in targets
+
+def _resizes(recipes: Sequence[CompiledRecipe]) -> bool:
+    """¿Alguna op cambia el largo del binario? (un mmap no se puede redimensionar)"""
+    return any(
+        isinstance(op, HexOp) and op.key == "find_hex" and len(op.find) != len(op.repl)
+        for rec in recipes for op in rec.ops
+    )
+
+def _recipe_id(rec: CompiledRecipe) -> str:
+    return rec.get("meta", {}).get("id") or Path(rec.path).stem
+
+def _apply_recipes(buf, recipes: Sequence[CompiledRecipe], patch_id: str,
+                   family: str) -> Tuple[int, List[str], List[dict]]:
+    """
+    Devuelve (cambios totales, ids de las recetas que aplicaron cambios, solapes).
+    Solapes: matches de una op sobre bytes que escribió una op anterior de la misma
+    receta, [{"recipe", "op", "offset"}]; con `on_overlap: error` la receta falla.
+    """
+    total_changes = 0
+    matched: List[str] = []
+    overlaps: List[dict] = []
+
+    for rec in recipes:
+        # selectores
+        if not _matches_selectors(buf, rec.get("selectors", {})):
+            continue
+
+        # aplicar ops
+        found: List[dict] = []
+        changed = _apply_ops(buf, rec.ops, rec.path, overlaps=found)
+        rid = _recipe_id(rec)
+        if found and rec.get("on_overlap") == "error":
+            raise RuntimeError(f"Receta {rid}: {len(found)} match(es) solapados entre ops "
+                               f"(op {found[0]['op']} @ 0x{found[0]['offset']:X})")
+        overlaps.extend({"recipe": rid, **o} for o in found)
+
+        if changed > 0:
+            matched.append(rid)
+            total_changes += changed
+
+    if not matched:
+        raise RuntimeError(f"No hubo recetas compatibles para '{patch_id}' en familia {family}")
+    return total_changes, matched, overlaps
+
+def _apply_mmap(src: Path, dst: Path, recipes: Sequence[CompiledRecipe], patch_id: str,
+                family: str) -> Tuple[int, List[str], List[dict]]:
+    # se trabaja sobre un temporal junto a dst: si algo falla, dst no queda a medias
+    tmp = dst.with_name(dst.name + f".{os.getpid()}.tmp")
+    try:
+        _fast_copy(src, tmp)
+        with open(tmp, "r+b") as f:
+            mm = mmap.mmap(f.fileno(), 0)
+            try:
+                res = _apply_recipes(mm, recipes, patch_id, family)
+                mm.flush()
+            finally:
+                mm.close()
+        os.replace(tmp, dst)
+        return res
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+def apply_patch(src_path: str, dst_path: str, patch_id: str, *, mode: str = "copy") -> Dict[str, Any]:
     """
     Aplica el 'patch_id' buscando recetas compatibles por familia + selectores.
     - Si hay varias recetas compatibles, aplica TODAS sus 'ops' (orden archivo).
     - Si ninguna receta match → error (quedará fallback en la capa superior si la implementaste).
+    - mode="mmap": memoria acotada sin importar el tamaño del binario; si alguna receta
+      cambia el largo (o src está vacío) se usa "copy".
+    Devuelve {family, mode, changes, recipes, overlaps} (recipes: ids que aplicaron
+    cambios; overlaps: matches sobre bytes escritos por una op anterior).
     """
+    if mode not in MODES:
+        raise ValueError(f"mode inválido: {mode} (usa {', '.join(MODES)})")
     src = Path(src_path); dst = Path(dst_path)
-    buf = _read_bytes(src)
 
     # 1) detectar familia por nombre de archivo o heurística
     family = _detect_family_from_name(src.name) or _detect_family_from_name(patch_id) or ""
     if not family:
         raise RuntimeError("No se pudo inferir familia ECU (usa nombre que contenga MEVD17/EDC17/MD1, etc.)")
 
-    # 2) cargar recetas de la familia
+    # 2) cargar recetas de la familia (filtro por patch_id)
     recipes = _load_family_recipes(family)
     if not recipes:
         raise RuntimeError(f"Sin recetas para familia {family}")
+    recipes = [rec for rec in recipes if _targets_patch(rec, patch_id)]
 
-    total_changes = 0
-    compatible = 0
-
-    for rec in recipes:
-        meta = rec.get("meta", {})
-        rid  = meta.get("id") or Path(rec.get("_path","")).stem
-
-        # filtro por patch_id
-        targets = meta.get("patch_ids") or [meta.get("patch_id"), rid]
-        targets = [t for t in targets if t]
-        if targets and patch_id not in targets:
-            continue
-
-        # selectores
-        if not _matches_selectors(bytes(buf), rec.get("selectors", {})):
-            continue
-
-        # aplicar ops
-        ops = rec.get("ops", [])
-        changed = 0
-        for op in ops:
-            if "find_hex" in op:
-                find_b = _hex_to_bytes(op["find_hex"])
-                repl_b = _hex_to_bytes(op.get("replace_hex", ""))
-                exp    = op.get("expect")
-                changed += _apply_hex(buf, find_b, repl_b, expect=exp)
-            elif "value_find" in op:
-                vf = op["value_find"]
-                # vf: {kind, value, endian?, tol?, align?, scale?, replace_value?, replace_scale?, expect?}
-                changed += _apply_number(buf, vf)
-            else:
-                raise RuntimeError(f"Operación no soportada en {rec.get('_path')}: {op}")
-
-        if changed > 0:
-            compatible += 1
-            total_changes += changed
-
-    if compatible == 0:
-        raise RuntimeError(f"No hubo recetas compatibles para '{patch_id}' en familia {family}")
-
-    _write_bytes(dst, bytes(buf))
+    if mode == "mmap" and not _resizes(recipes) and src.stat().st_size > 0:
+        changes, matched, overlaps = _apply_mmap(src, dst, recipes, patch_id, family)
+    else:
+        mode = "copy"
+        buf = _read_bytes(src)
+        changes, matched, overlaps = _apply_recipes(buf, recipes, patch_id, family)
+        _write_bytes(dst, buf)
+    return {"family": family, "mode": mode, "changes": changes, "recipes": matched, "overlaps": overlaps}
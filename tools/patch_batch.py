@@ -0,0 +1,222 @@
+# tools/patch_batch.py
+# QA de recetas sobre un corpus: aplica uno o más patch ids a muchos binarios en un pool
+# de procesos (recetas precargadas una vez por worker) y deja un reporte NDJSON.
+# Uso (desde la raíz del repo):
+#   python -m tools.patch_batch corpus/ --patch dpf_off --patch egr_off
+#   python -m tools.patch_batch "corpus/**/*.bin" --patch dpf_off --out-dir patched/ --mode mmap
+#   python -m tools.patch_batch corpus/ --patch dpf_off --report qa.ndjson --summary qa.json -j 8
+from __future__ import annotations
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from tools import patch_apply
+
+# errores más frecuentes que se listan en el resumen
+TOP_ERRORS = 10
+
+
+def _glob_root(spec: str) -> Path:
+    """Parte fija (sin comodines) de un glob: "corpus/**/*.bin" → corpus."""
+    parts = []
+    for part in Path(spec).parts:
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    return Path(*parts) if parts else Path(".")
+
+
+def collect_inputs(specs: Iterable[str], *, recursive: bool = False) -> List[Tuple[Path, Path]]:
+    """
+    Directorios (sus archivos) y/o globs → [(archivo, ruta relativa a su raíz de entrada)],
+    ordenada por ruta absoluta y sin repetidos. La ruta relativa arma el destino en --out-dir.
+    """
+    out: Dict[str, Tuple[Path, Path]] = {}
+    for spec in specs:
+        p = Path(spec)
+        if p.is_dir():
+            it = p.rglob("*") if recursive else p.iterdir()
+            found = [(q, q.relative_to(p)) for q in it if q.is_file()]
+        elif p.is_file():
+            found = [(p, Path(p.name))]
+        else:
+            root = _glob_root(spec)
+            found = []
+            for q in glob.glob(spec, recursive=True):
+                q = Path(q)
+                if q.is_file():
+                    try:
+                        rel = q.relative_to(root)
+                    except ValueError:
+                        rel = Path(q.name)
+                    found.append((q, rel))
+        for q, rel in found:
+            out.setdefault(str(q.resolve()), (q, rel))
+    return [out[k] for k in sorted(out)]
+
+
+def output_paths(files: Sequence[Tuple[Path, Path]], patch_id: str, out_dir: Path) -> List[Path]:
+    """
+    Destino por archivo: out_dir/<ruta relativa>/<nombre>.<patch_id><ext>. Si aun así
+    dos entradas chocan (mismo nombre bajo raíces distintas) se agrega ~N al nombre.
+    """
+    used = set()
+    out = []
+    for _, rel in files:
+        base = out_dir / rel.parent
+        dst = base / f"{rel.stem}.{patch_id}{rel.suffix}"
+        n = 1
+        while str(dst) in used:
+            n += 1
+            dst = base / f"{rel.stem}~{n}.{patch_id}{rel.suffix}"
+        used.add(str(dst))
+        out.append(dst)
+    return out
+
+
+# -----------------------------
+# Worker (proceso hijo)
+# -----------------------------
+_SCRATCH: Optional[str] = None
+
+
+def _init_worker(recipes_dir: str, scratch: str) -> None:
+    global _SCRATCH
+    patch_apply.RECIPES_DIR = Path(recipes_dir)
+    patch_apply.preload_recipes()
+    _SCRATCH = scratch
+
+
+def _run_one(src: str, patch_id: str, dst: Optional[str], mode: str) -> dict:
+    rec = {"file": src, "patch_id": patch_id, "ok": False, "family": None, "mode": mode,
+           "changes": 0, "recipes": [], "overlaps": [], "bytes": None, "elapsed_ms": None, "out": dst, "error": None}
+    # sin --out-dir el resultado se descarta (solo interesa si la receta aplica)
+    target = dst or os.path.join(_SCRATCH or tempfile.gettempdir(), f"{os.getpid()}.{patch_id}.bin")
+    t0 = time.perf_counter()
+    try:
+        rec["bytes"] = os.path.getsize(src)
+        res = patch_apply.apply_patch(src, target, patch_id, mode=mode)
+        rec.update(ok=True, family=res["family"], mode=res["mode"], changes=res["changes"], recipes=res["recipes"],
+                   overlaps=res["overlaps"])
+    except Exception as e:
+        rec["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        rec["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 3)
+        if dst is None:
+            try:
+                os.unlink(target)
+            except FileNotFoundError:
+                pass
+    return rec
+
+
+# -----------------------------
+# Resumen
+# -----------------------------
+def summarize(records: List[dict], wall_s: float, workers: int) -> dict:
+    n = len(records)
+    ok = sum(1 for r in records if r["ok"])
+    files = len({r["file"] for r in records})
+    size = sum(r["bytes"] or 0 for r in {r["file"]: r for r in records}.values())
+    errors = Counter(r["error"] for r in records if r["error"])
+    per_patch: Dict[str, Dict[str, int]] = {}
+    for r in records:
+        s = per_patch.setdefault(r["patch_id"], {"tasks": 0, "ok": 0, "failed": 0})
+        s["tasks"] += 1
+        s["ok" if r["ok"] else "failed"] += 1
+    times = sorted(r["elapsed_ms"] for r in records if r["elapsed_ms"] is not None)
+    return {
+        "files": files,
+        "tasks": n,
+        "ok": ok,
+        "failed": n - ok,
+        "failure_rate": round((n - ok) / n, 4) if n else None,
+        "workers": workers,
+        "wall_s": round(wall_s, 3),
+        "tasks_per_s": round(n / wall_s, 2) if wall_s > 0 else None,
+        "mb_per_s": round(size / (1024 * 1024) / wall_s, 2) if wall_s > 0 else None,
+        "task_ms_p50": times[len(times) // 2] if times else None,
+        "task_ms_max": times[-1] if times else None,
+        "changes_total": sum(r["changes"] for r in records),
+        "per_patch": per_patch,
+        "top_errors": [{"error": e, "count": c} for e, c in errors.most_common(TOP_ERRORS)],
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m tools.patch_batch",
+                                 description="Aplica patch ids a un corpus de binarios en paralelo")
+    ap.add_argument("inputs", nargs="+", help="directorios, archivos o globs (\"corpus/**/*.bin\")")
+    ap.add_argument("--patch", "-p", action="append", required=True, dest="patches",
+                    help="patch id (repetible)")
+    ap.add_argument("--out-dir", help="guarda los binarios parcheados (<ruta relativa>/<nombre>.<patch_id><ext>); "
+                                      "sin esto se descartan")
+    ap.add_argument("--report", default="patch-batch.ndjson", help="reporte NDJSON (una línea por archivo y patch)")
+    ap.add_argument("--summary", help="además escribe el resumen JSON en este archivo")
+    ap.add_argument("--mode", choices=patch_apply.MODES, default="mmap")
+    ap.add_argument("--workers", "-j", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--recursive", "-r", action="store_true", help="recorre subdirectorios")
+    ap.add_argument("--recipes-dir", default=str(patch_apply.RECIPES_DIR))
+    ap.add_argument("--fail-on-error", action="store_true", help="exit 1 si alguna tarea falla")
+    args = ap.parse_args(argv)
+
+    files = collect_inputs(args.inputs, recursive=args.recursive)
+    if not files:
+        ap.error("no se encontraron archivos de entrada")
+    out_dir = Path(args.out_dir) if args.out_dir else None
+    if out_dir is not None:
+        out_dir.mkdir(parents=True, exist_ok=True)
+
+    dsts = {pid: output_paths(files, pid, out_dir) for pid in args.patches} if out_dir is not None else {}
+    tasks = []
+    for i, (f, _) in enumerate(files):
+        for pid in args.patches:
+            dst = dsts[pid][i] if out_dir is not None else None
+            if dst is not None:
+                dst.parent.mkdir(parents=True, exist_ok=True)
+            tasks.append((str(f), pid, str(dst) if dst is not None else None))
+
+    workers = max(1, min(args.workers, len(tasks)))
+    print(f"[i] {len(files)} archivo(s) × {len(args.patches)} patch(es) = {len(tasks)} tarea(s), {workers} worker(s)")
+
+    records: List[dict] = []
+    t0 = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="efx-batch-") as scratch, \
+            open(args.report, "w", encoding="utf-8") as report:
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker,
+                                 initargs=(args.recipes_dir, scratch)) as pool:
+            futs = {pool.submit(_run_one, src, pid, dst, args.mode): (src, pid, dst) for src, pid, dst in tasks}
+            for fut in as_completed(futs):
+                try:
+                    rec = fut.result()
+                except Exception as e:  # worker caído (BrokenProcessPool, OOM…)
+                    src, pid, dst = futs[fut]
+                    rec = {"file": src, "patch_id": pid, "ok": False, "family": None, "mode": args.mode,
+                           "changes": 0, "recipes": [], "overlaps": [], "bytes": None, "elapsed_ms": None, "out": dst,
+                           "error": f"{type(e).__name__}: {e}"}
+                records.append(rec)
+                report.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    summary = summarize(records, time.perf_counter() - t0, workers)
+
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+    print(f"[i] reporte: {args.report}")
+    if args.summary:
+        Path(args.summary).write_text(json.dumps(summary, indent=2, ensure_ascii=False), encoding="utf-8")
+    if summary["failed"] and args.fail_on_error:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,34 +1,46 @@
 ﻿# tools/scan_dtc_ascii.py
+# CLI sobre app/services/dtc_scanner.py: clusters de DTC ASCII y tablas u16 binarias.
+# Uso (desde la raíz del repo):
+#   python -m tools.scan_dtc_ascii archivo.bin
+#   python -m tools.scan_dtc_ascii archivo.bin --json > dtc.json
 from __future__ import annotations
-import sys, re
+import argparse, json, sys
 from pathlib import Path
+from typing import List, Optional
 
-PAT = re.compile(rb"[PBCU][0-9][0-9A-F][0-9A-F][0-9A-F]")  # P0301, U0100, etc. (hex/dec mixto)
+if __package__ in (None, ""):  # python tools/scan_dtc_ascii.py (uso viejo)
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
 
-def main():
-    if len(sys.argv) < 2:
-        print("Uso: python tools/scan_dtc_ascii.py archivo.bin"); return
-    buf = Path(sys.argv[1]).read_bytes()
-    matches = list(PAT.finditer(buf))
-    if not matches:
-        print("No se encontraron secuencias tipo DTC ASCII."); return
+from app.services.dtc_scanner import scan_file
 
-    # agrupa cercanos (< 64 bytes de distancia) como “cluster”
-    clusters = []
-    cur = [matches[0]]
-    for m in matches[1:]:
-        if m.start() - cur[-1].start() <= 64:
-            cur.append(m)
-        else:
-            clusters.append(cur); cur = [m]
-    clusters.append(cur)
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m tools.scan_dtc_ascii",
+                                 description="Busca DTCs (ASCII y tablas u16) en un BIN")
+    ap.add_argument("bin", help="archivo .bin")
+    ap.add_argument("--json", action="store_true", help="imprime el resultado completo en JSON")
+    args = ap.parse_args(argv)
 
-    print(f"[i] Encontrados {len(matches)} DTC ascii (~ agrupados en {len(clusters)} clusters)")
-    for i,group in enumerate(clusters, 1):
-        start = group[0].start()
-        end = group[-1].end()
-        sample = b", ".join(g.group(0) for g in group[:6])
-        print(f"  - Cluster #{i}: offset 0x{start:X}..0x{end:X}  (items={len(group)})  ej: {sample[:60]!r}")
+    res = scan_file(args.bin, max_clusters=sys.maxsize, max_tables=sys.maxsize)
+    if args.json:
+        print(json.dumps(res, indent=2, ensure_ascii=False)); return 0
+
+    ascii_ = res["ascii"]
+    if not ascii_["count"]:
+        print("No se encontraron secuencias tipo DTC ASCII.")
+    else:
+        # agrupa cercanos (< 64 bytes de distancia) como “cluster”
+        print(f"[i] Encontrados {ascii_['count']} DTC ascii (~ agrupados en {len(ascii_['clusters'])} clusters)")
+        for i, c in enumerate(ascii_["clusters"], 1):
+            sample = ", ".join(c["samples"]).encode("ascii")
+            print(f"  - Cluster #{i}: offset 0x{c['start']:X}..0x{c['end']:X}  (items={c['count']})  ej: {sample[:60]!r}")
+
+    if res["tables"]:
+        print(f"[i] Tablas u16 de DTC candidatas: {len(res['tables'])}")
+        for i, t in enumerate(res["tables"], 1):
+            amb = "  (ambigua LE/BE)" if t["ambiguous"] else ""
+            print(f"  - Tabla #{i}: offset 0x{t['start']:X}..0x{t['end']:X}  {t['endian'].upper()}  "
+                  f"(items={t['count']})  ej: {', '.join(t['samples'])}{amb}")
+    return 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())